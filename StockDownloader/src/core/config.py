@@ -27,8 +27,8 @@ class Settings:
         DATABASE_URL (str): 数据库连接 URL。
         LOG_LEVEL (str): 日志级别。
         MAX_CSV_AGE_DAYS (int): 股票列表 CSV 文件最大有效天数。
-        MAX_RETRIES (int): API 请求最大重试次数。
-        RETRY_DELAY (int): API 请求重试间隔（秒）。
+        MAX_RETRIES (int): 每次下载中单个代码的最多尝试次数。
+        RETRY_DELAY (int): 单个代码第一次失败后延迟重试的等待时间（秒），之后按次数翻倍。
         GET_TIMEOUT (int): API 请求超时时间（秒）。
         MAX_THREADS (int): 最大线程数。
 
@@ -90,7 +90,7 @@ class Settings:
     # 数据更新频率（天）
     DATA_UPDATE_INTERVAL = int(os.getenv("DATA_UPDATE_INTERVAL", 100))
 
-    # stock_zh_a_daily\index_zh_a_hist重试次数和间隔
+    # 单个代码的最多尝试次数和首次延迟重试的等待时间（失败的代码在一轮下载结束后重试，不在原地等待）
     MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
     RETRY_DELAY = int(os.getenv("RETRY_DELAY", 5))
     GET_TIMEOUT = int(os.getenv("GET_TIMEOUT", 10))
@@ -98,10 +98,64 @@ class Settings:
     # 并行线程数
     MAX_THREADS = int(os.getenv("MAX_THREADS", 10))
 
+    # 全量下载时暂停衍生表的行级触发器，写入完成后批量刷新 derived_stock / derived_index
+    DERIVED_BULK_LOAD = os.getenv("DERIVED_BULK_LOAD", "false").lower() == "true"
+
+    # 每日更新任务图中各资源类别可同时运行的任务数，格式: 类别=数量,类别=数量
+    DAG_RESOURCE_LIMITS = {
+        name.strip(): int(limit)
+        for name, limit in (item.split("=") for item in os.getenv("DAG_RESOURCE_LIMITS", "network=4,cpu=1,db=2").split(",") if item.strip())
+    }
+
+    # 分布式下载队列：租约时长（秒）、每次领取的工作数、最多领取次数、失败后首次重试的等待时间（秒，之后按次数翻倍）
+    QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", 300))
+    QUEUE_CLAIM_BATCH = int(os.getenv("QUEUE_CLAIM_BATCH", 5))
+    QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", 5))
+    QUEUE_RETRY_DELAY = int(os.getenv("QUEUE_RETRY_DELAY", 60))
+    # 每日更新以工作队列方式下载股票和指数日线时本机的工作进程数，0表示不使用工作队列
+    QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", 0))
+
+    # 单机多进程分片下载：进程数（1表示不分片）、每个进程的下载线程数、所有进程合计每秒最多请求数（0表示不限制）
+    INGEST_SHARDS = int(os.getenv("INGEST_SHARDS", 1))
+    SHARD_FETCH_THREADS = int(os.getenv("SHARD_FETCH_THREADS", 2))
+    INGEST_RATE_LIMIT = float(os.getenv("INGEST_RATE_LIMIT", 5))
+
+    # 多资产并发下载：各数据源每秒最多请求数（未列出的数据源不限制）、各资产类别分配请求的权重、每个类别的下载线程数
+    INGEST_UPSTREAM_RATES = {
+        name.strip(): float(rate)
+        for name, rate in (item.split("=") for item in os.getenv("INGEST_UPSTREAM_RATES", "sina=4,eastmoney=4").split(",") if item.strip())
+    }
+    INGEST_CLASS_WEIGHTS = {
+        name.strip(): float(weight)
+        for name, weight in (item.split("=") for item in os.getenv("INGEST_CLASS_WEIGHTS", "stock=4,index=1,etf=1,hot_rank=2").split(",") if item.strip())
+    }
+    MULTI_ASSET_THREADS = int(os.getenv("MULTI_ASSET_THREADS", 4))
+    # 每日更新是否以多资产并发方式下载股票、指数、ETF和热度排名
+    MULTI_ASSET_INGEST = os.getenv("MULTI_ASSET_INGEST", "false").lower() == "true"
+
+    # 后台任务登记：运行中任务写入心跳的间隔（秒），超过 JOB_STALE_SECONDS 没有心跳的任务视为进程已退出
+    JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", 30))
+    JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 180))
+    # 后台任务各资源类别可同时占用的数量，格式: 类别=数量,类别=数量；未列出的类别不受限制
+    JOB_RESOURCE_BUDGETS = {
+        name.strip(): int(limit)
+        for name, limit in (item.split("=") for item in os.getenv("JOB_RESOURCE_BUDGETS", "network=1,db_write=1,cpu=1").split(",") if item.strip())
+    }
+
     # 下载配置
     INDICES_NAMES= os.getenv("INDICES_NAMES", "沪深重要指数")
     START_DATE = os.getenv("START_DATE","19900101")
 
+    # 相关度计算配置：进程池每次分发的股票数、每个子进程处理多少块后被替换
+    CORRELATION_CHUNK_SIZE = int(os.getenv("CORRELATION_CHUNK_SIZE", 8))
+    CORRELATION_MAX_TASKS_PER_CHILD = int(os.getenv("CORRELATION_MAX_TASKS_PER_CHILD", 100))
+    # 相关度候选剪枝：上一年排名前几的指数、波动率最接近的几个指数作为候选，
+    # 候选内第一名领先第二名的相对幅度低于阈值时退回全量扫描，并按比例抽样与全量结果比对
+    CORRELATION_PRUNE_TOP_K = int(os.getenv("CORRELATION_PRUNE_TOP_K", 3))
+    CORRELATION_PRUNE_VOLATILITY_K = int(os.getenv("CORRELATION_PRUNE_VOLATILITY_K", 3))
+    CORRELATION_PRUNE_MIN_MARGIN = float(os.getenv("CORRELATION_PRUNE_MIN_MARGIN", 0.05))
+    CORRELATION_PRUNE_AUDIT_RATE = float(os.getenv("CORRELATION_PRUNE_AUDIT_RATE", 0.05))
+
 
 # 实例化配置对象
 config = Settings()
@@ -0,0 +1,81 @@
+# src/database/models/correlation.py
+"""
+此模块定义了股票与指数相关度计算结果的数据库模型。
+按(股票, 年份, 指数)保存平均得分、有效交易日数和排名，以及支持增量更新的累计得分；
+同一记录上还保存可选计算的 Pearson、Spearman 和 beta 系数。
+stock_info 中各年份的所属指数由该表中排名第一的记录派生。
+滚动窗口模式的结果按(股票, 交易日, 窗口长度)保存相关度最高的指数。
+其他证券池之间（如ETF与指数、股票与ETF）的相关度按(证券池组合, 代码, 年份, 比较对象)保存。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Integer, BigInteger, Float, Date, PrimaryKeyConstraint, Index
+
+from ..base import Base
+
+
+class StockIndexCorrelation(Base):
+    __tablename__ = "stock_index_correlation"
+
+    symbol = Column(String(10), nullable=False)  # 股票代码
+    year = Column(Integer, nullable=False)  # 年份
+    index_symbol = Column(String(10), nullable=False)  # 指数代码
+    score_sum = Column(BigInteger, nullable=False, default=0)  # 累计得分
+    valid_days = Column(Integer, nullable=False, default=0)  # 有效交易日数
+    score = Column(Float)  # 平均得分（累计得分/有效交易日数），越低相关度越高
+    rank = Column(Integer)  # 该股票该年份内按平均得分的排名，1为最相关指数
+    last_date = Column(Date)  # 已累计到的最后一个交易日
+    pearson = Column(Float)  # Pearson相关系数
+    spearman = Column(Float)  # Spearman秩相关系数
+    beta = Column(Float)  # 股票相对指数的beta
+    metric_days = Column(Integer)  # 计算上述系数使用的共同交易日数
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'year', 'index_symbol'),
+        Index('ix_stock_index_correlation_rank', 'symbol', 'year', 'rank'),
+    )
+
+    def __repr__(self):
+        return f"<StockIndexCorrelation(symbol={self.symbol}, year={self.year}, index_symbol={self.index_symbol})>"
+
+
+class StockIndexRollingCorrelation(Base):
+    __tablename__ = "stock_index_rolling_correlation"
+
+    symbol = Column(String(10), nullable=False)  # 股票代码
+    date = Column(Date, nullable=False)  # 交易日（窗口的最后一天）
+    window_size = Column(Integer, nullable=False)  # 窗口长度（交易日）
+    index_symbol = Column(String(10), nullable=False)  # 窗口内相关度最高的指数代码
+    score = Column(Float)  # 窗口内的平均得分
+    valid_days = Column(Integer)  # 窗口内的有效交易日数
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'date', 'window_size'),
+    )
+
+    def __repr__(self):
+        return f"<StockIndexRollingCorrelation(symbol={self.symbol}, date={self.date}, window_size={self.window_size})>"
+
+
+class UniverseCorrelation(Base):
+    __tablename__ = "universe_correlation"
+
+    source_universe = Column(String(20), nullable=False)  # 被比较的证券池，如 etf
+    target_universe = Column(String(20), nullable=False)  # 比较对象所在的证券池，如 index
+    symbol = Column(String(20), nullable=False)  # 被比较的代码
+    year = Column(Integer, nullable=False)  # 年份
+    target_symbol = Column(String(20), nullable=False)  # 比较对象代码
+    score_sum = Column(BigInteger, nullable=False, default=0)  # 累计得分
+    valid_days = Column(Integer, nullable=False, default=0)  # 有效交易日数
+    score = Column(Float)  # 平均得分，越低相关度越高
+    rank = Column(Integer)  # 该代码该年份内按平均得分的排名，1为最相关
+    last_date = Column(Date)  # 计算到的最后一个交易日
+
+    __table_args__ = (
+        PrimaryKeyConstraint('source_universe', 'target_universe', 'symbol', 'year', 'target_symbol'),
+        Index('ix_universe_correlation_rank', 'source_universe', 'target_universe', 'symbol', 'year', 'rank'),
+    )
+
+    def __repr__(self):
+        return f"<UniverseCorrelation({self.source_universe}->{self.target_universe}, symbol={self.symbol}, year={self.year}, target_symbol={self.target_symbol})>"
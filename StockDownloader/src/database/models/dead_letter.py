@@ -0,0 +1,32 @@
+# src/database/models/dead_letter.py
+"""
+此模块定义了下载失败代码的死信表数据模型。
+一次下载中多次延迟重试后仍然失败的代码记录在 ingestion_dead_letter 中，
+下一次下载时优先重试这些代码，成功后删除记录。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, DateTime, Integer, Text, JSON, PrimaryKeyConstraint, func
+
+from ..base import Base
+
+
+class IngestionDeadLetter(Base):
+    __tablename__ = "ingestion_dead_letter"
+
+    asset_class = Column(String, nullable=False)  # 资产类别：stock、index、etf、hot_rank
+    symbol = Column(String, nullable=False)  # 代码
+    params = Column(JSON)  # 下载参数（如起止日期、名称）
+    attempts = Column(Integer, nullable=False)  # 最后一次下载中的尝试次数
+    failed_runs = Column(Integer, nullable=False, default=1)  # 连续失败的下载次数
+    last_error = Column(Text)  # 最后一次失败的错误信息
+    first_failed_at = Column(DateTime, nullable=False, server_default=func.now())  # 首次进入死信表的时间
+    last_failed_at = Column(DateTime, nullable=False, server_default=func.now())  # 最后一次失败的时间
+
+    __table_args__ = (
+        PrimaryKeyConstraint('asset_class', 'symbol'),
+    )
+
+    def __repr__(self):
+        return f"<IngestionDeadLetter(asset_class={self.asset_class}, symbol={self.symbol}, failed_runs={self.failed_runs})>"
@@ -0,0 +1,42 @@
+# src/database/models/derived.py
+"""
+此模块定义了衍生数据相关的数据库模型。
+derived_stock / derived_index 由 daily_stock / daily_index 上的触发器维护（见 sql2build），
+这里仅提供只读访问所需的表结构。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Float, Date, PrimaryKeyConstraint
+
+from ..base import Base
+
+
+class DerivedStock(Base):
+    __tablename__ = "derived_stock"
+
+    symbol = Column(String(10), nullable=False)  # 股票代码
+    date = Column(Date, nullable=False)  # 日期
+    real_change = Column(Float)  # 实际涨跌幅
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'date', name='derived_stock_pk'),
+    )
+
+    def __repr__(self):
+        return f"<DerivedStock(symbol={self.symbol}, date={self.date})>"
+
+
+class DerivedIndex(Base):
+    __tablename__ = "derived_index"
+
+    symbol = Column(String(10), nullable=False)  # 指数代码
+    date = Column(Date, nullable=False)  # 日期
+    real_change = Column(Float)  # 实际涨跌幅
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'date', name='derived_index_pk'),
+    )
+
+    def __repr__(self):
+        return f"<DerivedIndex(symbol={self.symbol}, date={self.date})>"
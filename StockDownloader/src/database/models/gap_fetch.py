@@ -0,0 +1,30 @@
+# src/database/models/gap_fetch.py
+"""
+此模块定义了补全数据下载记录的数据模型。
+gap_fetch_log 记录补全数据时已成功下载过的缺失区间，区间内仍然没有日线的交易日（停牌、退市）
+是上游本身没有数据，缺失检测时不再把这些交易日视为缺失，避免每次补全都重复请求同样的区间。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Date, DateTime, Integer, PrimaryKeyConstraint, func
+
+from ..base import Base
+
+
+class GapFetchLog(Base):
+    __tablename__ = "gap_fetch_log"
+
+    source = Column(String, nullable=False)  # 数据源：stock 或 index
+    symbol = Column(String, nullable=False)  # 代码
+    start_date = Column(Date, nullable=False)  # 下载区间起始日期
+    end_date = Column(Date, nullable=False)  # 下载区间结束日期
+    row_count = Column(Integer, nullable=False)  # 上游返回的行数，0表示区间内没有任何数据
+    fetched_at = Column(DateTime, nullable=False, server_default=func.now())  # 最后一次下载的时间
+
+    __table_args__ = (
+        PrimaryKeyConstraint('source', 'symbol', 'start_date'),
+    )
+
+    def __repr__(self):
+        return f"<GapFetchLog(source={self.source}, symbol={self.symbol}, start_date={self.start_date}, end_date={self.end_date}, row_count={self.row_count})>"
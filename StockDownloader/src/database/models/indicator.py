@@ -0,0 +1,51 @@
+# src/database/models/indicator.py
+"""
+此模块定义了技术指标相关的数据库模型。
+stock_indicator 按(股票, 日期)保存由 daily_stock 计算的均线、收益率、波动率、ATR和EMA；
+stock_indicator_state 保存每只股票计算到的最后交易日以及增量计算所需的窗口尾部数据和EMA递推值。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Float, Date, Integer, JSON, PrimaryKeyConstraint
+
+from ..base import Base
+
+
+class StockIndicator(Base):
+    __tablename__ = "stock_indicator"
+
+    symbol = Column(String, nullable=False)  # 股票代码
+    date = Column(Date, nullable=False)  # 日期
+    ma5 = Column(Float)  # 5日均线
+    ma10 = Column(Float)  # 10日均线
+    ma20 = Column(Float)  # 20日均线
+    ma60 = Column(Float)  # 60日均线
+    return_1d = Column(Float)  # 日收益率（百分比）
+    volatility_20 = Column(Float)  # 20日收益率标准差（百分比）
+    atr_14 = Column(Float)  # 14日平均真实波幅（Wilder平滑）
+    ema12 = Column(Float)  # 12日指数移动平均
+    ema26 = Column(Float)  # 26日指数移动平均
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'date'),
+    )
+
+    def __repr__(self):
+        return f"<StockIndicator(symbol={self.symbol}, date={self.date})>"
+
+
+class StockIndicatorState(Base):
+    __tablename__ = "stock_indicator_state"
+
+    symbol = Column(String, primary_key=True, nullable=False)  # 股票代码
+    last_date = Column(Date, nullable=False)  # 已计算到的最后交易日
+    bar_count = Column(Integer, nullable=False)  # 已计算的交易日数
+    closes = Column(JSON, nullable=False)  # 最近的收盘价（最长均线窗口）
+    returns = Column(JSON, nullable=False)  # 最近的日收益率（波动率窗口）
+    ema12 = Column(Float)  # 最后交易日的12日EMA
+    ema26 = Column(Float)  # 最后交易日的26日EMA
+    atr_14 = Column(Float)  # 最后交易日的ATR
+
+    def __repr__(self):
+        return f"<StockIndicatorState(symbol={self.symbol}, last_date={self.last_date})>"
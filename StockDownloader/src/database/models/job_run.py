@@ -0,0 +1,41 @@
+# src/database/models/job_run.py
+"""
+此模块定义了后台任务登记表的数据模型。
+job_run 每行是一次后台任务（网页端触发的更新、重建、相关度计算以及定时的每日更新）的运行记录，
+保存任务参数、状态、进度、时间和最后的错误信息；任务所在进程定期写入心跳，
+心跳超时的运行中任务视为进程已退出。多个进程共享同一张表，网页端可以用多进程WSGI服务器运行；
+新任务按运行中任务占用的资源类别（网络、数据库写入、CPU等）决定能否启动。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Text, JSON, Index, func
+
+from ..base import Base
+
+
+class JobRun(Base):
+    __tablename__ = "job_run"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)  # 任务ID
+    job_type = Column(String, nullable=False)  # 任务类型：update_data、rebuild_database、update_correlation、daily_update 等
+    source = Column(String, nullable=False)  # 触发来源：server 或 daily_update
+    params = Column(JSON)  # 任务参数
+    resources = Column(JSON)  # 任务占用的资源 {资源类别: 数量}，exclusive 表示与所有任务冲突
+    status = Column(String(10), nullable=False)  # running 运行中，success 成功，error 失败
+    message = Column(Text)  # 当前进度说明
+    progress_done = Column(Integer, nullable=False, default=0)  # 已完成的步骤数
+    progress_total = Column(Integer, nullable=False, default=0)  # 总步骤数，0表示未知
+    owner = Column(String)  # 运行任务的进程（主机名:进程号）
+    created_at = Column(DateTime, nullable=False, server_default=func.now())  # 创建时间
+    heartbeat_at = Column(DateTime, nullable=False, server_default=func.now())  # 最后一次心跳时间
+    finished_at = Column(DateTime)  # 结束时间
+    last_error = Column(Text)  # 最后的错误信息
+
+    __table_args__ = (
+        Index('ix_job_run_type_created', 'job_type', 'created_at'),
+        Index('ix_job_run_status', 'status'),
+    )
+
+    def __repr__(self):
+        return f"<JobRun(id={self.id}, job_type={self.job_type}, status={self.status})>"
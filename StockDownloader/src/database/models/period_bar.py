@@ -0,0 +1,55 @@
+# src/database/models/period_bar.py
+"""
+此模块定义了由日线数据聚合得到的周线、月线、季线数据模型。
+每根K线按(代码, 周期, 周期开始日期)保存，date 为该周期内最后一个交易日。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Float, Date, BigInteger, PrimaryKeyConstraint
+
+from ..base import Base
+
+
+class StockPeriodBar(Base):
+    __tablename__ = "stock_period_bar"
+
+    symbol = Column(String, nullable=False)  # 股票代码
+    frequency = Column(String(1), nullable=False)  # 周期：W 周线，M 月线，Q 季线
+    period_start = Column(Date, nullable=False)  # 周期开始日期（自然周/月/季的第一天）
+    date = Column(Date, nullable=False)  # 周期内最后一个交易日
+    open = Column(Float)  # 开盘价
+    close = Column(Float)  # 收盘价
+    high = Column(Float)  # 最高价
+    low = Column(Float)  # 最低价
+    volume = Column(BigInteger)  # 成交量
+    amount = Column(BigInteger)  # 成交额
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'frequency', 'period_start'),
+    )
+
+    def __repr__(self):
+        return f"<StockPeriodBar(symbol={self.symbol}, frequency={self.frequency}, period_start={self.period_start})>"
+
+
+class IndexPeriodBar(Base):
+    __tablename__ = "index_period_bar"
+
+    symbol = Column(String, nullable=False)  # 指数代码
+    frequency = Column(String(1), nullable=False)  # 周期：W 周线，M 月线，Q 季线
+    period_start = Column(Date, nullable=False)  # 周期开始日期（自然周/月/季的第一天）
+    date = Column(Date, nullable=False)  # 周期内最后一个交易日
+    open = Column(Float)  # 开盘
+    close = Column(Float)  # 收盘
+    high = Column(Float)  # 最高
+    low = Column(Float)  # 最低
+    volume = Column(BigInteger)  # 成交量
+    amount = Column(BigInteger)  # 成交额
+
+    __table_args__ = (
+        PrimaryKeyConstraint('symbol', 'frequency', 'period_start'),
+    )
+
+    def __repr__(self):
+        return f"<IndexPeriodBar(symbol={self.symbol}, frequency={self.frequency}, period_start={self.period_start})>"
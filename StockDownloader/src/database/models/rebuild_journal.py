@@ -0,0 +1,52 @@
+# src/database/models/rebuild_journal.py
+"""
+此模块定义了可断点续传的全量重建的检查点日志数据模型。
+rebuild_run 每行是一次全量重建，记录清空数据表和生成下载计划两个步骤是否已完成；
+rebuild_checkpoint 保存该次重建的下载计划（每个代码的起止日期）和每个代码是否已写入，
+进程崩溃或重启后可以从日志继续下载未完成的代码。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Date, DateTime, BigInteger, Text, JSON, PrimaryKeyConstraint, Index, func
+
+from ..base import Base
+
+
+class RebuildRun(Base):
+    __tablename__ = "rebuild_run"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)  # 重建ID
+    kinds = Column(JSON, nullable=False)  # 重建的数据类型列表：stock、index
+    status = Column(String(10), nullable=False, default="planning")  # planning 清空和生成计划中，running 下载中，failed 中断或有失败的代码，done 完成，aborted 已被新的重建取代
+    cleared_at = Column(DateTime)  # 数据表清空完成的时间，为空时继续重建会重新清空
+    planned_at = Column(DateTime)  # 下载计划写入完成的时间，为空时继续重建会重新生成计划
+    last_error = Column(Text)  # 最后一次中断的错误信息
+    created_at = Column(DateTime, nullable=False, server_default=func.now())  # 开始时间
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())  # 最后更新时间
+    finished_at = Column(DateTime)  # 完成时间
+
+    def __repr__(self):
+        return f"<RebuildRun(id={self.id}, kinds={self.kinds}, status={self.status})>"
+
+
+class RebuildCheckpoint(Base):
+    __tablename__ = "rebuild_checkpoint"
+
+    run_id = Column(BigInteger, nullable=False)  # 所属重建ID
+    kind = Column(String, nullable=False)  # 数据类型：stock 或 index
+    symbol = Column(String, nullable=False)  # 代码
+    name = Column(String(100))  # 名称（指数保存数据时需要）
+    start_date = Column(Date, nullable=False)  # 下载起始日期
+    end_date = Column(Date, nullable=False)  # 下载结束日期，重建期间固定，之后的数据由增量更新补齐
+    status = Column(String(10), nullable=False, default="pending")  # pending 未下载，done 已写入，failed 多次重试后失败
+    last_error = Column(Text)  # 最后一次失败的错误信息
+    completed_at = Column(DateTime)  # 写入完成的时间
+
+    __table_args__ = (
+        PrimaryKeyConstraint('run_id', 'kind', 'symbol'),
+        Index('ix_rebuild_checkpoint_run_status', 'run_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f"<RebuildCheckpoint(run_id={self.run_id}, kind={self.kind}, symbol={self.symbol}, status={self.status})>"
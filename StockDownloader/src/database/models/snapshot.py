@@ -0,0 +1,31 @@
+# src/database/models/snapshot.py
+"""
+此模块定义了按日期组织的全市场截面数据模型。
+stock_daily_snapshot 每个交易日一行，以数组形式保存当天所有股票的日线数据和 real_change，
+按股票代码排序，各数组下标一一对应；读取某一天的全市场数据只需读取一行。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Float, Date, BigInteger
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from ..base import Base
+
+
+class StockDailySnapshot(Base):
+    __tablename__ = "stock_daily_snapshot"
+
+    date = Column(Date, primary_key=True, nullable=False)  # 日期
+    symbols = Column(ARRAY(String), nullable=False)  # 股票代码（升序）
+    open = Column(ARRAY(Float))  # 开盘价
+    close = Column(ARRAY(Float))  # 收盘价
+    high = Column(ARRAY(Float))  # 最高价
+    low = Column(ARRAY(Float))  # 最低价
+    volume = Column(ARRAY(BigInteger))  # 成交量
+    amount = Column(ARRAY(BigInteger))  # 成交额
+    turnover = Column(ARRAY(Float))  # 换手率
+    real_change = Column(ARRAY(Float))  # 实际涨跌幅（来自 derived_stock）
+
+    def __repr__(self):
+        return f"<StockDailySnapshot(date={self.date})>"
@@ -0,0 +1,42 @@
+# src/database/models/work_queue.py
+"""
+此模块定义了分布式下载工作队列的数据模型。
+ingestion_job 每行是某个下载计划中一个代码的一项工作，多个主机上的工作进程用
+SELECT ... FOR UPDATE SKIP LOCKED 领取工作，并通过租约和心跳判断领取者是否仍然存活。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from sqlalchemy import Column, String, Date, DateTime, Integer, BigInteger, Text, UniqueConstraint, Index, func
+
+from ..base import Base
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_job"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)  # 工作ID
+    plan = Column(String, nullable=False)  # 下载计划名称，同一计划的工作由所有工作进程共同完成
+    kind = Column(String, nullable=False)  # 数据类型：stock 或 index
+    symbol = Column(String, nullable=False)  # 代码
+    name = Column(String(100))  # 名称（指数保存数据时需要）
+    start_date = Column(Date, nullable=False)  # 下载起始日期
+    end_date = Column(Date, nullable=False)  # 下载结束日期
+    status = Column(String(10), nullable=False, default="pending")  # pending 待领取，running 执行中，done 完成，dead 多次失败后放弃
+    attempts = Column(Integer, nullable=False, default=0)  # 已领取次数
+    max_attempts = Column(Integer, nullable=False)  # 最多领取次数，超过后进入 dead 状态
+    available_at = Column(DateTime, nullable=False, server_default=func.now())  # 失败后最早可以再次领取的时间
+    lease_owner = Column(String)  # 当前领取者（主机名:进程号）
+    lease_expires_at = Column(DateTime)  # 租约到期时间，到期未续约的工作可以被其他工作进程重新领取
+    heartbeat_at = Column(DateTime)  # 最后一次心跳时间
+    last_error = Column(Text)  # 最后一次失败的错误信息
+    created_at = Column(DateTime, nullable=False, server_default=func.now())  # 创建时间
+    updated_at = Column(DateTime, nullable=False, server_default=func.now())  # 最后更新时间
+
+    __table_args__ = (
+        UniqueConstraint('plan', 'kind', 'symbol', name='ingestion_job_plan_kind_symbol_key'),
+        Index('ix_ingestion_job_plan_status', 'plan', 'status', 'available_at'),
+    )
+
+    def __repr__(self):
+        return f"<IngestionJob(plan={self.plan}, kind={self.kind}, symbol={self.symbol}, status={self.status})>"
@@ -9,32 +9,45 @@ Date: 2024-07-03
 
 import argparse
 import sys
-import threading
-import time
 
 import uvicorn
 
 from .api.app import app
 from .core.logger import logger
-from .tasks.download_index_task import download_all_index_data, download_index_data
-from .tasks.download_stock_task import download_all_stock_data, download_stock_task
+from .tasks.download_index_task import download_all_index_data, download_index_data, refresh_index_universe
+from .tasks.download_stock_task import download_all_stock_data, download_stock_task, refresh_stock_universe
 from .services.data_fetcher import DataFetcher
 from .services.data_saver import DataSaver
 from .tasks.scheduled_tasks import start_scheduled_tasks
 from .tasks.complete_data_task import run_complete_data_task
+from .tasks.queue_worker import run_queue_ingestion
+from .tasks.sharded_ingestion import run_sharded_ingestion
+from .tasks.multi_asset_ingestion import run_multi_asset_ingestion
+from .tasks.rebuild_task import start_rebuild, resume_rebuild, rebuild_summary
 from .utils.db_utils import initialize_database_if_needed
+from .utils.job_registry import track_job, EXCLUSIVE
+from .utils.scheduler import scheduler, TradingDayRule
+
+
+# 支持 --shards 的运行模式: {模式: (数据类型, 下载方式)}
+SHARDED_MODES = {
+    1: (["index"], "rebuild"),
+    2: (["stock"], "rebuild"),
+    3: (["index"], "update"),
+    4: (["stock"], "update"),
+    5: (["stock", "index"], "rebuild"),
+    6: (["stock", "index"], "update"),
+}
 
 
 def run_scheduled_tasks():
     """
-    定期运行数据下载任务。
+    执行一次定时数据更新任务，由调度器在启动时和每个交易日17:00触发。
     """
-    while True:
-        logger.info("开始执行定时数据下载任务...")
-        download_all_stock_data(update_only=True)
-        download_all_index_data(update_only=True)
-        logger.info("定时数据下载任务执行完成，等待下次执行...")
-        time.sleep(86400)  # 每天执行一次，86400秒 = 1天
+    logger.info("开始执行定时数据下载任务...")
+    download_all_stock_data(update_only=True)
+    download_all_index_data(update_only=True)
+    logger.info("定时数据下载任务执行完成，等待下次执行...")
 
 
 def ensure_directories():
@@ -69,16 +82,35 @@ def parse_args():
     parser.add_argument(
         "--mode", 
         type=int, 
-        choices=range(1, 9),
+        choices=range(1, 10),
         help="运行模式：\n"
              "1：只下载指数日线数据\n"
              "2：只下载股票日线数据\n"
              "3：只更新指数日线数据\n"
              "4：只更新股票日线数据\n"
-             "5：只下载股票和指数日线数据\n"
-             "6：只更新股票和指数日线数据\n"
+             "5：同时下载股票和指数日线数据\n"
+             "6：同时更新股票和指数日线数据\n"
              "7：更新stock_info以及index_info表\n"
-             "8：补全特定股票或指数的历史数据"
+             "8：补全特定股票或指数的历史数据\n"
+             "9：同时更新股票、指数、ETF日线和股票热度排名"
+    )
+    parser.add_argument(
+        "--queue",
+        choices=["update", "rebuild"],
+        help="以工作队列方式下载股票和指数日线：多个主机使用相同参数运行时共同完成同一个下载计划"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="--queue 时本机的工作进程数")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="模式1-6按代码哈希分为N个进程并行下载，所有进程共享 INGEST_RATE_LIMIT 请求速率限额"
+    )
+    parser.add_argument(
+        "--rebuild",
+        choices=["start", "resume", "status"],
+        help="全量重建数据库（删除所有数据表后下载股票和指数的全部历史）：start 开始新的重建，"
+             "resume 从检查点继续最近一次未完成的重建，status 查看最近一次重建的进度"
     )
     
     return parser.parse_args()
@@ -121,6 +153,33 @@ def main():
     # 解析命令行参数
     args = parse_args()
     
+    # 以工作队列方式下载，完成后退出
+    if args.queue is not None:
+        run_queue_ingestion(args.queue, workers=args.workers)
+        sys.exit(0)
+    
+    # 可断点续传的全量重建，与网页端的重建数据库登记为同一类任务，不会与其他任务同时运行
+    if args.rebuild is not None:
+        if args.rebuild == "status":
+            print(rebuild_summary())
+        else:
+            with track_job("rebuild_database", {"resume": args.rebuild == "resume"}, source="cli", resources={EXCLUSIVE: 1}) as job:
+                if args.rebuild == "start":
+                    start_rebuild(progress=job.progress)
+                else:
+                    resume_rebuild(progress=job.progress)
+        sys.exit(0)
+    
+    # 分片下载：模式1-6对应的数据类型和下载方式
+    if args.shards > 1 and args.mode in SHARDED_MODES:
+        kinds, shard_mode = SHARDED_MODES[args.mode]
+        if "stock" in kinds:
+            refresh_stock_universe()
+        if "index" in kinds:
+            refresh_index_universe()
+        run_sharded_ingestion(shard_mode, kinds, shards=args.shards)
+        sys.exit(0)
+    
     # 如果指定了运行模式，执行特定任务
     if args.mode is not None:
         if args.mode == 1:  # 只下载指数日线数据
@@ -139,36 +198,26 @@ def main():
             logger.info("开始更新股票日线数据...")
             download_all_stock_data(update_only=True)
             logger.info("股票日线数据更新完成")
-        elif args.mode == 5:  # 只下载股票和指数日线数据
-            logger.info("开始下载股票和指数日线数据...")
-            download_all_stock_data()
-            logger.info("股票日线数据下载完成，等待1分钟后开始下载指数日线数据...")
-            time.sleep(60)  # 等待1分钟
-            download_all_index_data()
-            logger.info("股票和指数日线数据下载完成")
-        elif args.mode == 6:  # 只更新股票和指数日线数据
-            logger.info("开始更新股票和指数日线数据...")
-            download_all_stock_data(update_only=True)
-            logger.info("股票日线数据更新完成，等待1分钟后开始更新指数日线数据...")
-            time.sleep(60)  # 等待1分钟
-            download_all_index_data(update_only=True)
-            logger.info("股票和指数日线数据更新完成")
+        elif args.mode == 5:  # 同时下载股票和指数日线数据，共享各数据源的请求限额
+            run_multi_asset_ingestion("rebuild", ["stock", "index"])
+        elif args.mode == 6:  # 同时更新股票和指数日线数据，共享各数据源的请求限额
+            run_multi_asset_ingestion("update", ["stock", "index"])
         elif args.mode == 7:  # 更新stock_info以及index_info表
             update_stock_and_index_info()
         elif args.mode == 8:  # 补全特定股票或指数的历史数据
             run_complete_data_task()
+        elif args.mode == 9:  # 同时更新所有资产类别
+            run_multi_asset_ingestion("update")
         
         # 执行完特定任务后退出
         sys.exit(0)
     
     # 如果没有指定运行模式，启动完整的API服务和定时任务
     
-    # 启动每日数据下载定时任务
-    task_thread = threading.Thread(target=run_scheduled_tasks)
-    task_thread.daemon = True  # 设置为守护线程，主线程退出时自动结束
-    task_thread.start()
+    # 注册每日数据下载定时任务：启动时执行一次，之后每个交易日17:00执行
+    scheduler.add_job("daily_data", TradingDayRule(17, 0), run_scheduled_tasks, run_now=True)
     
-    # 启动交易日特定时间任务（股票列表下载）
+    # 注册交易日特定时间任务（股票列表下载）并启动调度线程
     start_scheduled_tasks()
 
     # 启动API服务
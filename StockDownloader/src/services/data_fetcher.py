@@ -95,40 +95,29 @@ class DataFetcher:
                 raise DataFetchError(f"Operation timed out after {config.GET_TIMEOUT} seconds")
 
     @staticmethod
-    def _fetch_with_retry(fetch_func, *args, max_retries=config.MAX_RETRIES, retry_delay=config.RETRY_DELAY, **kwargs):
+    def _fetch_once(fetch_func, *args, **kwargs):
         """
-        带重试和超时的数据获取。
+        带超时的单次数据获取，失败时不在原地等待重试，由调用方（见 utils.retry_queue）延迟重试。
 
         Args:
             fetch_func (callable): 数据获取函数。
             *args: 参数。
-            max_retries (int): 最大重试次数。
-            retry_delay (int): 重试间隔（秒）。
             **kwargs: 关键字参数。
 
         Returns:
             Any: 数据获取函数的结果。
 
         Raises:
-            DataFetchError: 如果在最大重试次数后仍然失败，则抛出此异常。
+            DataFetchError: 如果获取失败或超时，则抛出此异常。
         """
-        for attempt in range(max_retries):
-            try:
-                result = DataFetcher._fetch_with_timeout(fetch_func, *args, **kwargs)
-                time.sleep(0.5)  # 成功后等待1秒
-                return result
-            except DataFetchError as e:
-                logger.warning(f"Timeout on attempt {attempt + 1}/{max_retries}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                raise DataFetchError(f"Failed to fetch data after {max_retries} attempts: {str(e)}")
-            except Exception as e:
-                logger.warning(f"Error on attempt {attempt + 1}/{max_retries}: {str(e)}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                raise DataFetchError(f"Failed to fetch data after {max_retries} attempts: {e}")
+        try:
+            result = DataFetcher._fetch_with_timeout(fetch_func, *args, **kwargs)
+        except DataFetchError:
+            raise
+        except Exception as e:
+            raise DataFetchError(f"Failed to fetch data: {e}")
+        time.sleep(0.5)  # 成功后稍作等待，避免请求过于密集
+        return result
 
     def fetch_stock_daily_data(self, symbol, start_date, end_date, adjust='hfq'):
         """
@@ -147,7 +136,7 @@ class DataFetcher:
             DataFetchError: 如果获取股票日线数据失败，则抛出此异常。
         """
         logger.info(f"Fetching daily data in mode {adjust}: for {symbol} from {start_date} to {end_date}...")
-        return self._fetch_with_retry(
+        return self._fetch_once(
             ak.stock_zh_a_daily,
             symbol=symbol,
             start_date=start_date,
@@ -184,7 +173,7 @@ class DataFetcher:
             import time
             start_time = time.time()
             
-            result = self._fetch_with_retry(
+            result = self._fetch_once(
                 ak.index_zh_a_hist,  # 修改为东财的历史数据接口
                 symbol=symbol,
                 start_date=start_date,
@@ -205,8 +194,8 @@ class DataFetcher:
             return result
         except Exception as e:
             logger.error(f"Failed to fetch index data for {symbol}: {e}")
-            # 返回空DataFrame而不是抛出异常，让调用者决定如何处理
-            return pd.DataFrame()
+            # 抛出异常以便调用者延迟重试该指数，不再用空数据掩盖失败
+            raise DataFetchError(f"Failed to fetch index data for {symbol}: {e}")
 
 
     def get_last_n_days(self, n):
@@ -60,17 +60,21 @@ class DataSaver:
             logger.error(f"Failed to save index list to CSV: {e}")
             raise DataSaveError(f"Failed to save index list to CSV: {e}")
 
-    def save_stock_daily_data_to_db(self, stock_data, symbol):
+    def save_stock_daily_data_to_db(self, stock_data, symbol, bulk_load=None):
         """
         保存股票日数据到数据库，仅更新日期较新的数据。
 
         Args:
             stock_data (pandas.DataFrame): 包含股票日线数据的DataFrame。
             symbol (str): 股票代码。
+            bulk_load (BulkDerivedLoad, optional): 批量写入时整批 upsert 到其会话，由其统一刷新衍生表。
 
         Raises:
             DataSaveError: 如果保存股票日线数据到数据库失败，则抛出此异常。
         """
+        if bulk_load:
+            self._save_daily_data_to_bulk_load(stock_data, symbol, StockDailyData, bulk_load)
+            return
         try:
             logger.info(f"Saving daily data for stock {symbol} to database...")
             db: Session = next(get_db())
@@ -211,8 +215,11 @@ class DataSaver:
             logger.error(f"Failed to save index info to database: {e}")
             raise DataSaveError(f"Failed to save index info to database: {e}")
 
-    def save_index_daily_data_to_db(self, index_data, symbol, index_name):  # 添加 index_name 参数
-        """保存指数日数据到数据库"""
+    def save_index_daily_data_to_db(self, index_data, symbol, index_name, bulk_load=None):  # 添加 index_name 参数
+        """保存指数日数据到数据库，bulk_load 的含义同 save_stock_daily_data_to_db"""
+        if bulk_load:
+            self._save_daily_data_to_bulk_load(index_data, symbol, IndexDailyData, bulk_load)
+            return
         try:
             logger.info(f"Saving daily data for index {symbol}({index_name}) to database...")
             db: Session = next(get_db())
@@ -262,3 +269,34 @@ class DataSaver:
             db.rollback()
             logger.error(f"Failed to save daily data for index {symbol} to database: {e}")
             raise DataSaveError(f"Failed to save daily data for index {symbol} to database: {e}")
+
+    def _save_daily_data_to_bulk_load(self, data, symbol, model, bulk_load):
+        """
+        批量写入时用一条 INSERT ... ON CONFLICT DO UPDATE 写入一个代码的全部日线，
+        不再逐行查询，多个下载线程只在 BulkDerivedLoad.upsert 内短暂串行。
+
+        Args:
+            data (pandas.DataFrame): 日线数据，列名见 model.column_mappings。
+            symbol (str): 代码。
+            model: StockDailyData 或 IndexDailyData。
+            bulk_load (BulkDerivedLoad): 批量写入上下文。
+
+        Raises:
+            DataSaveError: 如果保存日线数据到数据库失败，则抛出此异常。
+        """
+        try:
+            frame = data[list(model.column_mappings)].rename(columns=model.column_mappings)
+            frame["date"] = pd.to_datetime(frame["date"], errors='coerce')
+            invalid = frame["date"].isna()
+            if invalid.any():
+                logger.warning(f"Invalid date format in {int(invalid.sum())} rows for {symbol}, skipped.")
+            # 同一条语句不能更新同一行两次，重复的日期只保留最后一条
+            frame = frame[~invalid].drop_duplicates("date", keep="last")
+            frame["date"] = frame["date"].dt.date
+            frame.insert(0, "symbol", symbol)
+            rows = frame.astype(object).where(frame.notna(), None).to_dict("records")
+            count = bulk_load.upsert(model, rows)
+            logger.info(f"Upserted {count} records for {model.__tablename__} {symbol}.")
+        except Exception as e:
+            logger.error(f"Failed to save daily data for {model.__tablename__} {symbol} to database: {e}")
+            raise DataSaveError(f"Failed to save daily data for {model.__tablename__} {symbol} to database: {e}")
@@ -6,8 +6,6 @@ Authors: hovi.hyw & AI
 Date: 2024-07-03
 """
 
-import time
-from datetime import datetime
 import os
 import pandas as pd
 from functools import lru_cache
@@ -15,7 +13,8 @@ from functools import lru_cache
 from ..core.logger import logger
 from ..services.data_fetcher import DataFetcher
 from ..services.data_saver import DataSaver
-from ..utils.trading_calendar import is_trading_day, get_stock_list_filepath_with_datetime
+from ..utils.scheduler import scheduler, TradingDayRule
+from ..utils.trading_calendar import get_stock_list_filepath_with_datetime
 from ..core.config import config
 
 
@@ -51,47 +50,14 @@ def download_stock_list_task():
         return False
 
 
-def check_and_execute_task():
-    """
-    检查当前是否是交易日的9:26，如果是则执行下载任务。
-    """
-    now = datetime.now()
-    current_time = now.time()
-    
-    # 检查是否是交易日
-    if is_trading_day():
-        # 检查是否是上午9:26
-        target_time = datetime.strptime("09:26", "%H:%M").time()
-        
-        # 允许1分钟的误差范围
-        time_diff_seconds = abs(
-            (current_time.hour * 3600 + current_time.minute * 60 + current_time.second) - 
-            (target_time.hour * 3600 + target_time.minute * 60)
-        )
-        
-        if time_diff_seconds <= 60:  # 在目标时间的1分钟内
-            return download_stock_list_task()
-    
-    return False
-
-
 def run_service():
     """
     运行股票列表下载服务。
-    每分钟检查一次是否需要执行任务。
+    在全局调度器中注册交易日09:26的下载任务，并在当前线程中运行调度器。
     """
     logger.info("股票列表下载服务已启动")
-    
-    while True:
-        try:
-            result = check_and_execute_task()
-            if result:
-                logger.info("今日股票列表下载任务已完成")
-        except Exception as e:
-            logger.error(f"任务检查执行失败: {e}")
-        
-        # 每分钟检查一次
-        time.sleep(60)
+    scheduler.add_job("stock_list", TradingDayRule(9, 26), download_stock_list_task)
+    scheduler.run_forever()
 
 
 @lru_cache(maxsize=1)
@@ -1,174 +1,134 @@
 # src/tasks/complete_data_task.py
 """
-此模块定义了补全特定股票或指数历史数据的任务。
-允许用户选择补全特定股票或指数的所有历史数据。
+此模块定义了补全股票或指数历史数据的任务。
+先在数据库中检测每个代码缺失的交易日区间，再并发下载这些区间的数据，
+补全的代价只与缺失的数据量有关，可以一次补全全部股票或指数。
 Authors: hovi.hyw & AI
 Date: 2024-07-03
 """
 
-import os
-from datetime import date, datetime, timedelta
-
-import pandas as pd
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import time
+from typing import List
 
 from ..core.config import config
 from ..core.logger import logger
-from ..database.models.index import IndexDailyData
-from ..database.models.stock import StockDailyData
+from ..database.models.info import IndexInfo
+from ..database.session import SessionLocal
 from ..services.data_fetcher import DataFetcher
 from ..services.data_saver import DataSaver
 from ..utils.db_utils import initialize_database_if_needed
-from ..utils.index_utils import get_index_trading_dates, get_stock_trading_dates
+from ..utils.gap_detector import FetchSpan, detect_gaps, build_fetch_plan, record_fetched_spans
+from ..utils.market_snapshot import refresh_stock_snapshots
+from ..utils.retry_queue import run_with_deferred_retry
+
+
+def _normalize_index_symbol(symbol):
+    # 确保指数代码始终以字符串形式处理，对于纯数字的指数代码补齐6位（如：000001而不是1）
+    symbol = str(symbol).strip()
+    if symbol.isdigit() and len(symbol) < 6:
+        symbol = symbol.zfill(6)
+    return symbol
+
+
+def _complete_stock_span(fetcher: DataFetcher, saver: DataSaver, span: FetchSpan, names) -> int:
+    """下载并保存一只股票一个区间的数据，返回保存的行数"""
+    data = fetcher.fetch_stock_daily_data(span.symbol, span.start_date.strftime("%Y%m%d"), span.end_date.strftime("%Y%m%d"), 'hfq')
+    if data is None or data.empty:
+        return 0
+    saver.save_stock_daily_data_to_db(data, span.symbol)
+    return len(data)
 
 
-def complete_stock_data(symbol):
+def _complete_index_span(fetcher: DataFetcher, saver: DataSaver, span: FetchSpan, names) -> int:
+    """下载并保存一个指数一个区间的数据，返回保存的行数"""
+    data = fetcher.fetch_index_daily_data(span.symbol, span.start_date.strftime("%Y%m%d"), span.end_date.strftime("%Y%m%d"))
+    if data is None or data.empty:
+        return 0
+    saver.save_index_daily_data_to_db(data, span.symbol, names.get(span.symbol, "未知指数"))
+    return len(data)
+
+
+def complete_data(source: str, symbols: List[str] = None, max_workers: int = None):
     """
-    补全特定股票的历史数据。
-    直接下载股票的所有历史数据，然后与数据库中已有数据比较，只保存数据库中不存在的记录。
-    
-    Args:
-        symbol (str): 股票代码。
+    补全股票或指数的缺失数据
+
+    参数:
+    - source: stock 或 index
+    - symbols: 只补全这些代码，默认为日线表中的全部代码
+    - max_workers: 并发下载的线程数，默认为 config.MAX_THREADS
     """
     initialize_database_if_needed()
-    # 确保 DATABASE_URL 不为空，否则抛出异常
-    if config.DATABASE_URL is None:
-        raise ValueError("数据库连接URL不能为空")
-    
-    engine = create_engine(str(config.DATABASE_URL))
+    start_time = time.time()
+    max_workers = max_workers or config.MAX_THREADS
     fetcher = DataFetcher()
     saver = DataSaver()
-    
-    # 创建数据库会话
-    SessionLocal = sessionmaker(bind=engine)
+
     db = SessionLocal()
-    
     try:
-        # 获取该股票在数据库中已有的交易日期
-        stock_trading_dates = get_stock_trading_dates(db, symbol)
-        
-        # 获取股票的所有历史数据
-        # 使用较早的起始日期，确保获取尽可能完整的历史数据
-        start_date = "19900101"  # 从1990年开始，覆盖大部分A股历史
-        end_date = datetime.today().strftime("%Y%m%d")  # 当前日期
-        
-        logger.info(f"获取股票 {symbol} 从 {start_date} 到 {end_date} 的完整历史数据")
-        
-        try:
-            # 获取股票的所有历史数据
-            data = fetcher.fetch_stock_daily_data(symbol, start_date, end_date, 'hfq')
-            
-            # 检查返回的数据是否为None或空
-            if data is None or data.empty:
-                logger.warning(f"获取股票 {symbol} 的历史数据为空，无法补全")
-                return
-            
-            # 将日期列转换为日期对象，以便与数据库中的日期比较
-            data['date'] = pd.to_datetime(data['date']).dt.date
-            
-            # 筛选出数据库中不存在的记录
-            new_data = data[~data['date'].isin(stock_trading_dates)]
-            
-            if new_data.empty:
-                logger.info(f"股票 {symbol} 数据已完整，无需补全")
-                return
-            
-            logger.info(f"股票 {symbol} 有 {len(new_data)} 条新数据需要补全")
-            
-            # 保存新数据到数据库
-            saver.save_stock_daily_data_to_db(new_data, symbol)
-            logger.info(f"股票 {symbol} 历史数据补全完成")
-            
-        except Exception as e:
-            logger.error(f"获取或保存股票 {symbol} 的历史数据出错: {e}")
-            return
-        
-        logger.info(f"股票 {symbol} 所有缺失数据补全完成")
-    except Exception as e:
-        logger.error(f"补全股票 {symbol} 数据出错: {e}")
+        gaps = detect_gaps(db, source, symbols)
+        names = {}
+        if source == "index":
+            names = {symbol: name for symbol, name in db.query(IndexInfo.symbol, IndexInfo.name).all()}
     finally:
         db.close()
 
+    plan = build_fetch_plan(gaps)
+    if not plan:
+        logger.info(f"{source} 数据已完整，无需补全")
+        return
+    logger.info(f"{source} 补全计划: {len(plan)} 次请求, {sum(span.missing_days for span in plan)} 个缺失交易日")
 
-def complete_index_data(symbol):
-    """
-    补全特定指数的历史数据。
-    直接下载指数的所有历史数据，然后与数据库中已有数据比较，只保存数据库中不存在的记录。
-    
-    Args:
-        symbol (str): 指数代码。
-    """
-    initialize_database_if_needed()
-    # 确保 DATABASE_URL 不为空，否则抛出异常
-    if config.DATABASE_URL is None:
-        raise ValueError("数据库连接URL不能为空")
-    
-    engine = create_engine(str(config.DATABASE_URL))
-    fetcher = DataFetcher()
-    saver = DataSaver()
-    
-    # 创建数据库会话
-    SessionLocal = sessionmaker(bind=engine)
+    complete_span = _complete_stock_span if source == "stock" else _complete_index_span
+    spans = {f"{span.symbol}:{span.start_date:%Y%m%d}": span for span in plan}
+    saved = []
+
+    def process(key, params):
+        saved.append((spans[key], complete_span(fetcher, saver, spans[key], names)))
+
+    # 失败的区间延迟到本轮结束后重试；仍然失败的区间下次补全时会被重新检测到，不写入死信表
+    result = run_with_deferred_retry(source, [(key, {}) for key in spans], process, threads=max_workers, persist=False)
+    saved_rows = sum(rows for _, rows in saved)
+    # 停牌、退市期间没有日线数据；记录已下载的区间，下次补全时不再请求
+    empty_spans = sum(1 for _, rows in saved if not rows)
+    failed_spans = len(result["dead"])
     db = SessionLocal()
-    
     try:
-        # 确保指数代码始终以字符串形式处理，并且保留前导零
-        symbol = str(symbol).strip()
-        # 对于纯数字的指数代码，确保格式正确（如：000001而不是1）
-        if symbol.isdigit() and len(symbol) < 6:
-            symbol = symbol.zfill(6)  # 补齐6位
-        
-        # 获取指数在数据库中的名称
-        from ..database.models.info import IndexInfo
-        index_info = db.query(IndexInfo).filter(IndexInfo.symbol == symbol).first()
-        index_name = index_info.name if index_info else "未知指数"
-        
-        # 获取该指数在数据库中已有的交易日期
-        index_trading_dates = get_index_trading_dates(db, symbol)
-        
-        # 获取指数的所有历史数据
-        # 使用较早的起始日期，确保获取尽可能完整的历史数据
-        start_date = "19900101"  # 从1990年开始，覆盖大部分A股历史
-        end_date = datetime.today().strftime("%Y%m%d")  # 当前日期
-        
-        logger.info(f"获取指数 {symbol}({index_name}) 从 {start_date} 到 {end_date} 的完整历史数据")
-        
-        try:
-            # 获取指数的所有历史数据
-            data = fetcher.fetch_index_daily_data(symbol, start_date, end_date)
-            
-            # 检查返回的数据是否为None或空
-            if data is None or data.empty:
-                logger.warning(f"获取指数 {symbol}({index_name}) 的历史数据为空，无法补全")
-                return
-            
-            # 将日期列转换为日期对象，以便与数据库中的日期比较
-            data['日期'] = pd.to_datetime(data['日期']).dt.date
-            
-            # 筛选出数据库中不存在的记录
-            new_data = data[~data['日期'].isin(index_trading_dates)]
-            
-            if new_data.empty:
-                logger.info(f"指数 {symbol}({index_name}) 数据已完整，无需补全")
-                return
-            
-            logger.info(f"指数 {symbol}({index_name}) 有 {len(new_data)} 条新数据需要补全")
-            
-            # 保存新数据到数据库
-            saver.save_index_daily_data_to_db(new_data, symbol, index_name)
-            logger.info(f"指数 {symbol}({index_name}) 历史数据补全完成")
-            
-        except Exception as e:
-            logger.error(f"获取或保存指数 {symbol}({index_name}) 的历史数据出错: {e}")
-            return
-        
-        logger.info(f"指数 {symbol}({index_name}) 所有缺失数据补全完成")
-    except Exception as e:
-        logger.error(f"补全指数 {symbol} 数据出错: {e}")
+        record_fetched_spans(db, source, saved)
     finally:
         db.close()
 
+    if source == "stock" and saved_rows:
+        db = SessionLocal()
+        try:
+            refresh_stock_snapshots(db, min(span.start_date for span in plan), max(span.end_date for span in plan))
+        finally:
+            db.close()
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"{source} 数据补全完成: 保存 {saved_rows} 行, 无数据区间 {empty_spans} 个, 失败 {failed_spans} 个, 耗时 {elapsed_time:.2f} 秒")
+
+
+def complete_stock_data(symbols: List[str] = None):
+    """
+    补全股票的缺失数据，只下载缺失的交易日区间。
+
+    Args:
+        symbols (list, optional): 股票代码列表，默认为全部股票。
+    """
+    complete_data("stock", symbols)
+
+
+def complete_index_data(symbols: List[str] = None):
+    """
+    补全指数的缺失数据，只下载缺失的交易日区间。
+
+    Args:
+        symbols (list, optional): 指数代码列表，默认为全部指数。
+    """
+    if symbols is not None:
+        symbols = [_normalize_index_symbol(symbol) for symbol in symbols]
+    complete_data("index", symbols)
+
 
 def run_complete_data_task():
     """
@@ -176,29 +136,23 @@ def run_complete_data_task():
     """
     print("\n股票/指数数据补全工具")
     print("-" * 40)
-    print("1: 补全特定股票的历史数据")
-    print("2: 补全特定指数的历史数据")
+    print("1: 补全股票的缺失数据")
+    print("2: 补全指数的缺失数据")
     print("0: 返回上级菜单")
     print("-" * 40)
-    
+
     choice = input("请输入您的选择 (0-2): ").strip()
-    
+
     if choice == "1":
-        symbol = input("请输入要补全的股票代码: ").strip()
-        if symbol:
-            logger.info(f"开始补全股票 {symbol} 的历史数据...")
-            complete_stock_data(symbol)
-            logger.info(f"股票 {symbol} 历史数据补全任务完成")
-        else:
-            logger.warning("股票代码不能为空")
+        symbols = input("请输入要补全的股票代码（多个代码用空格分隔，直接回车补全全部股票）: ").split()
+        logger.info(f"开始补全股票 {' '.join(symbols) or '全部'} 的缺失数据...")
+        complete_stock_data(symbols or None)
+        logger.info("股票数据补全任务完成")
     elif choice == "2":
-        symbol = input("请输入要补全的指数代码: ").strip()
-        if symbol:
-            logger.info(f"开始补全指数 {symbol} 的历史数据...")
-            complete_index_data(symbol)
-            logger.info(f"指数 {symbol} 历史数据补全任务完成")
-        else:
-            logger.warning("指数代码不能为空")
+        symbols = input("请输入要补全的指数代码（多个代码用空格分隔，直接回车补全全部指数）: ").split()
+        logger.info(f"开始补全指数 {' '.join(symbols) or '全部'} 的缺失数据...")
+        complete_index_data(symbols or None)
+        logger.info("指数数据补全任务完成")
     elif choice == "0":
         return
     else:
@@ -206,5 +160,17 @@ def run_complete_data_task():
 
 
 if __name__ == "__main__":
-    run_complete_data_task()
-    print
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="检测并补全缺失的日线数据")
+    parser.add_argument("source", nargs="?", choices=["stock", "index"], help="数据源，不指定时进入交互菜单")
+    parser.add_argument("symbols", nargs="*", help="只补全这些代码，默认为全部")
+    parser.add_argument("--workers", type=int, help="并发下载的线程数")
+    args = parser.parse_args()
+    if args.source is None:
+        run_complete_data_task()
+    else:
+        symbols = args.symbols or None
+        if args.source == "index" and symbols:
+            symbols = [_normalize_index_symbol(symbol) for symbol in symbols]
+        complete_data(args.source, symbols, max_workers=args.workers)
@@ -6,6 +6,7 @@ Authors: hovi.hyw & AI
 Date: 2024-07-03
 """
 
+from contextlib import nullcontext
 from datetime import datetime
 
 import pandas as pd
@@ -14,6 +15,8 @@ from ..core.config import config
 from ..core.logger import logger
 from ..services.data_fetcher import DataFetcher
 from ..services.data_saver import DataSaver
+from ..utils.derived_maintenance import BulkDerivedLoad, bulk_load_enabled
+from ..utils.retry_queue import run_with_deferred_retry
 
 
 def format_index_code(symbol):
@@ -21,13 +24,15 @@ def format_index_code(symbol):
     return str(symbol).zfill(6)
 
 
-def download_index_data(symbol: str, name: str):
+def download_index_data(symbol: str, name: str, bulk_load=None, raise_errors=False):
     """
     下载指定指数的日线数据，并保存到数据库。
 
     Args:
         symbol (str): 指数代码。
         name (str): 指数名称
+        bulk_load (BulkDerivedLoad, optional): 批量写入上下文，见 DataSaver.save_stock_daily_data_to_db。
+        raise_errors (bool, optional): 出错时是否抛出异常（由调用方延迟重试），默认只记录日志。
     """
     fetcher = DataFetcher()
     saver = DataSaver()
@@ -41,18 +46,20 @@ def download_index_data(symbol: str, name: str):
         if index_data is None:
             logger.warning(f"未能获取到指数 {formatted_symbol}({name}) 的数据")
             return
-        saver.save_index_daily_data_to_db(index_data, formatted_symbol, name)
+        saver.save_index_daily_data_to_db(index_data, formatted_symbol, name, bulk_load=bulk_load)
         logger.info(f"指数 {formatted_symbol}({name}) 日数据下载并保存完成")
     except Exception as e:
         logger.error(f"处理指数 {formatted_symbol}({name}) 时出错: {e}")
+        if raise_errors:
+            raise
 
 
-def download_all_index_data(update_only=False):
+def refresh_index_universe():
     """
-    下载所有指数的日线数据，并保存到数据库。
-    
-    Args:
-        update_only (bool, optional): 是否只更新最新数据。默认为False，表示下载全部历史数据。
+    获取指数列表（缓存有效时读取缓存），并保存指数基本信息到数据库。
+
+    Returns:
+        pandas.DataFrame: 指数列表。
     """
     fetcher = DataFetcher()
     saver = DataSaver()
@@ -74,6 +81,17 @@ def download_all_index_data(update_only=False):
     # 保存指数基本信息到数据库
     logger.info("保存指数基本信息到数据库")
     saver.save_index_info_to_db(index_list)
+    return index_list
+
+
+def download_all_index_data(update_only=False):
+    """
+    下载所有指数的日线数据，并保存到数据库。
+    
+    Args:
+        update_only (bool, optional): 是否只更新最新数据。默认为False，表示下载全部历史数据。
+    """
+    index_list = refresh_index_universe()
 
     # 下载指数日数据并保存到数据库
     if update_only:
@@ -82,10 +100,13 @@ def download_all_index_data(update_only=False):
         update_index_data()
         logger.info("指数数据增量更新任务完成")
     else:
-        # 否则下载全部历史数据
-        for _, row in index_list.iterrows():
-            symbol = row["代码"]
-            name = row["名称"]
-            download_index_data(symbol, name)
+        # 否则下载全部历史数据，开启 DERIVED_BULK_LOAD 时暂停触发器并在最后批量刷新衍生表
+        # 失败的指数延迟到本轮结束后重试，仍然失败的写入死信表，下次增量更新时从 START_DATE 补全
+        with BulkDerivedLoad() if bulk_load_enabled() else nullcontext() as bulk_load:
+            run_with_deferred_retry(
+                "index",
+                [(format_index_code(row["代码"]), {"start_date": config.START_DATE, "name": str(row["名称"])}) for _, row in index_list.iterrows()],
+                lambda symbol, params: download_index_data(symbol, params["name"], bulk_load=bulk_load, raise_errors=True),
+            )
 
         logger.info("所有指数数据下载任务完成")
\ No newline at end of file
@@ -6,22 +6,29 @@ Authors: hovi.hyw & AI
 Date: 2024-07-03
 """
 
-from datetime import datetime
+from contextlib import nullcontext
+from datetime import datetime, date
 
 import pandas as pd
 
 from ..core.config import config
 from ..core.logger import logger
 from ..services.data_fetcher import DataFetcher
+from ..database.session import SessionLocal
 from ..services.data_saver import DataSaver
+from ..utils.derived_maintenance import BulkDerivedLoad, bulk_load_enabled
+from ..utils.market_snapshot import refresh_stock_snapshots
+from ..utils.retry_queue import run_with_deferred_retry
 
 
-def download_stock_task(symbol: str):
+def download_stock_task(symbol: str, bulk_load=None, raise_errors=False):
     """
     下载指定股票的日线数据，并保存到数据库。
 
     Args:
         symbol (str): 股票代码。
+        bulk_load (BulkDerivedLoad, optional): 批量写入上下文，见 DataSaver.save_stock_daily_data_to_db。
+        raise_errors (bool, optional): 出错时是否抛出异常（由调用方延迟重试），默认只记录日志。
     """
     fetcher = DataFetcher()
     saver = DataSaver()
@@ -29,20 +36,22 @@ def download_stock_task(symbol: str):
     try:
         stock_data = fetcher.fetch_stock_daily_data(symbol, config.START_DATE, datetime.today().strftime("%Y%m%d"), 'hfq')
         if stock_data is not None and not stock_data.empty:
-            saver.save_stock_daily_data_to_db(stock_data, symbol)
+            saver.save_stock_daily_data_to_db(stock_data, symbol, bulk_load=bulk_load)
             logger.info(f"股票 {symbol} 日数据下载并保存完成")
         else:
             logger.warning(f"未能获取到股票 {symbol} 的数据")
     except Exception as e:
         logger.error(f"下载股票 {symbol} 数据时出错: {e}")
+        if raise_errors:
+            raise
 
 
-def download_all_stock_data(update_only=False):
+def refresh_stock_universe():
     """
-    下载所有股票的日线数据，并保存到数据库。
-    
-    Args:
-        update_only (bool, optional): 是否只更新最新数据。默认为False，表示下载全部历史数据。
+    获取股票列表（缓存有效时读取缓存），并保存股票基本信息到数据库。
+
+    Returns:
+        pandas.DataFrame: 股票列表。
     """
     fetcher = DataFetcher()
     saver = DataSaver()
@@ -63,6 +72,17 @@ def download_all_stock_data(update_only=False):
     # 保存股票基本信息到数据库
     logger.info("保存股票基本信息到数据库")
     saver.save_stock_info_to_db(stock_list)
+    return stock_list
+
+
+def download_all_stock_data(update_only=False):
+    """
+    下载所有股票的日线数据，并保存到数据库。
+    
+    Args:
+        update_only (bool, optional): 是否只更新最新数据。默认为False，表示下载全部历史数据。
+    """
+    stock_list = refresh_stock_universe()
 
     # 下载股票日数据并保存到数据库
     if update_only:
@@ -71,7 +91,18 @@ def download_all_stock_data(update_only=False):
         update_stock_data()
         logger.info("股票数据增量更新任务完成")
     else:
-        # 否则下载全部历史数据
-        for symbol in stock_list["代码"]:
-            download_stock_task(symbol)
+        # 否则下载全部历史数据，开启 DERIVED_BULK_LOAD 时暂停触发器并在最后批量刷新衍生表
+        # 失败的股票延迟到本轮结束后重试，仍然失败的写入死信表，下次增量更新时从 START_DATE 补全
+        with BulkDerivedLoad() if bulk_load_enabled() else nullcontext() as bulk_load:
+            run_with_deferred_retry(
+                "stock",
+                [(str(symbol), {"start_date": config.START_DATE}) for symbol in stock_list["代码"]],
+                lambda symbol, params: download_stock_task(symbol, bulk_load=bulk_load, raise_errors=True),
+            )
+        # 全部写入（含衍生表刷新）后重建全市场截面
+        db = SessionLocal()
+        try:
+            refresh_stock_snapshots(db, datetime.strptime(config.START_DATE, "%Y%m%d").date(), date.today())
+        finally:
+            db.close()
         logger.info("所有股票数据下载任务完成")
\ No newline at end of file
@@ -0,0 +1,191 @@
+# src/tasks/multi_asset_ingestion.py
+"""
+此模块定义了多资产并发下载任务。
+股票、指数、ETF日线和股票热度排名各自用一个线程池同时下载，不再依次等待；
+每个请求从所属数据源共享的请求速率限额中领取时间片，多个类别按 INGEST_CLASS_WEIGHTS 的权重公平分配，
+某个类别下载完后其余类别自动使用全部限额，总耗时接近下载量最大的单个类别。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import random
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..core.config import config
+from ..core.exceptions import DataFetchError
+from ..core.logger import logger
+from ..database.session import SessionLocal
+from ..services.data_fetcher import DataFetcher
+from ..services.data_saver import DataSaver
+from ..services.etf_service import ETFService
+from ..services.stock_list_service import get_stock_list
+from ..utils.derived_maintenance import BulkDerivedLoad, bulk_load_enabled
+from ..utils.market_snapshot import refresh_stock_snapshots
+from ..utils.request_budget import get_upstream_limiter
+from ..utils.retry_queue import run_with_deferred_retry
+from .download_hot_rank_task import download_hot_rank_data
+from .download_index_task import refresh_index_universe
+from .download_stock_task import refresh_stock_universe
+from .queue_worker import build_plan_items, fetch_and_save
+
+# 各资产类别使用的数据源，同一数据源的类别共用一个请求速率限额
+ASSET_UPSTREAMS = {
+    "stock": "sina",  # stock_zh_a_daily
+    "index": "eastmoney",  # index_zh_a_hist
+    "etf": "eastmoney",  # fund_etf_hist_em
+    "hot_rank": "eastmoney",  # stock_hot_rank_detail_em
+}
+ASSET_CLASSES = list(ASSET_UPSTREAMS)
+
+# 各资产类别每个下载线程在每个代码之后的随机等待范围（秒）: (成功后, 失败后)，与原来逐个下载ETF和热度排名时的等待相同；
+# 这两个类别的接口对访问频率敏感，共享限额之外仍按此放慢请求
+ASSET_PACING = {
+    "etf": ((3, 5), (8, 13)),
+    "hot_rank": ((1, 3), (0, 0)),
+}
+
+
+def _plan_work(asset_class: str, mode: str, refresh_universe: bool, bulk_load: BulkDerivedLoad = None) -> Tuple[List[Tuple[str, Dict[str, object]]], Callable[[str, Dict[str, object]], object], Optional[Tuple[date, date]]]:
+    """
+    生成某个资产类别的下载工作，股票和指数的日线通过 bulk_load（不为空时）写入
+
+    返回:
+    - (代码, 下载参数) 列表
+    - 下载并保存一个代码数据的函数 process(代码, 下载参数)
+    - 股票和指数工作覆盖的 (起始日期, 结束日期)，其他类别为None
+    """
+    if asset_class in ("stock", "index"):
+        if refresh_universe:
+            get_upstream_limiter(ASSET_UPSTREAMS[asset_class]).acquire(asset_class)
+            if asset_class == "stock":
+                refresh_stock_universe()
+            else:
+                refresh_index_universe()
+        fetcher = DataFetcher()
+        saver = DataSaver()
+        db = SessionLocal()
+        try:
+            items = build_plan_items(db, asset_class, mode)
+        finally:
+            db.close()
+        work = [
+            (symbol, {"name": name, "start_date": start_date.strftime("%Y%m%d"), "end_date": end_date.strftime("%Y%m%d")})
+            for symbol, name, start_date, end_date in items
+        ]
+
+        def process(symbol, params):
+            fetch_and_save(fetcher, saver, {
+                "kind": asset_class, "symbol": symbol, "name": params["name"],
+                "start_date": datetime.strptime(params["start_date"], "%Y%m%d").date(),
+                "end_date": datetime.strptime(params["end_date"], "%Y%m%d").date(),
+            }, bulk_load=bulk_load)
+
+        span = (min(item[2] for item in items), max(item[3] for item in items)) if items else None
+        return work, process, span
+    if asset_class == "etf":
+        etf_service = ETFService()
+        get_upstream_limiter(ASSET_UPSTREAMS[asset_class]).acquire(asset_class)
+        etf_list = etf_service.fetch_etf_list()
+        etf_service.save_etf_list_to_db(etf_list)
+        return (
+            [(str(symbol), {}) for symbol in etf_list["代码"]],
+            lambda symbol, params: etf_service.save_etf_daily_data_to_db(etf_service.fetch_etf_daily_data(symbol), symbol),
+            None,
+        )
+    if asset_class == "hot_rank":
+        codes = [str(code) for code in get_stock_list() if code]
+        if not codes:
+            # get_stock_list 出错时返回空列表，作为失败抛出以便调用方重试
+            raise DataFetchError("获取股票列表失败")
+        return [(code, {}) for code in codes], lambda code, params: download_hot_rank_data(code), None
+    raise ValueError(f"未知的资产类别: {asset_class}")
+
+
+def ingest_asset_class(asset_class: str, mode: str = "update", threads: int = None, refresh_universe: bool = True) -> Dict[str, object]:
+    """
+    下载一个资产类别的数据，每个请求先从所属数据源的共享限额中领取时间片，ETF和热度排名还按 ASSET_PACING 在每个代码之后等待
+
+    参数:
+    - asset_class: stock、index、etf 或 hot_rank
+    - mode: update 增量更新，rebuild 从 START_DATE 下载全部历史（只影响股票和指数）
+    - threads: 下载线程数，默认为 config.MULTI_ASSET_THREADS
+    - refresh_universe: 是否先更新股票或指数列表
+
+    返回:
+    - {"done": 成功的代码数, "failed": [(代码, 错误信息)], "elapsed": 耗时（秒）}
+    """
+    threads = threads or config.MULTI_ASSET_THREADS
+    limiter = get_upstream_limiter(ASSET_UPSTREAMS[asset_class])
+    pacing = ASSET_PACING.get(asset_class)
+    start_time = time.time()
+    # 全量下载股票或指数时，开启 DERIVED_BULK_LOAD 则暂停触发器并在最后批量刷新衍生表；
+    # 每个类别使用自己的批量写入会话，类别内的下载线程在其锁内串行写入
+    bulk = mode == "rebuild" and asset_class in ("stock", "index") and bulk_load_enabled()
+    with BulkDerivedLoad() if bulk else nullcontext() as bulk_load:
+        work, download, span = _plan_work(asset_class, mode, refresh_universe, bulk_load)
+        logger.info(f"[{asset_class}] 需要下载 {len(work)} 个代码，数据源 {ASSET_UPSTREAMS[asset_class]}，{threads} 个下载线程")
+
+        def process(symbol, params):
+            limiter.acquire(asset_class)
+            if pacing is None:
+                download(symbol, params)
+                return
+            try:
+                download(symbol, params)
+            except Exception:
+                time.sleep(random.uniform(*pacing[1]))
+                raise
+            time.sleep(random.uniform(*pacing[0]))
+
+        # 失败的代码延迟到本轮结束后重试（重试同样占用限额），仍然失败的写入死信表；
+        # 股票和指数的死信代码日线落后，下次会被 build_plan_items 重新加入
+        result = run_with_deferred_retry(asset_class, work, process, threads=threads)
+    succeeded, failed = result["done"], result["dead"]
+
+    if asset_class == "stock" and succeeded:
+        # 股票日线写入（含衍生表刷新）后重建下载范围内的全市场截面
+        db = SessionLocal()
+        try:
+            refresh_stock_snapshots(db, *span)
+        finally:
+            db.close()
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"[{asset_class}] 下载完成: 成功 {len(succeeded)} 个, 失败 {len(failed)} 个, 耗时 {elapsed_time:.2f} 秒")
+    return {"done": len(succeeded), "failed": failed, "elapsed": elapsed_time}
+
+
+def run_multi_asset_ingestion(mode: str = "update", asset_classes: List[str] = None, threads: int = None) -> Dict[str, Dict[str, object]]:
+    """
+    同时下载多个资产类别的数据
+
+    参数:
+    - mode: update 或 rebuild
+    - asset_classes: 资产类别列表，默认为全部（stock、index、etf、hot_rank）
+    - threads: 每个类别的下载线程数，默认为 config.MULTI_ASSET_THREADS
+
+    返回:
+    - {资产类别: ingest_asset_class 的结果}，类别本身出错时结果为 {"error": 错误信息}
+    """
+    asset_classes = asset_classes or ASSET_CLASSES
+    start_time = time.time()
+    logger.info(f"开始并发下载 {', '.join(asset_classes)}，模式 {mode}")
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(asset_classes)) as executor:
+        futures = {asset_class: executor.submit(ingest_asset_class, asset_class, mode, threads) for asset_class in asset_classes}
+        for asset_class, future in futures.items():
+            try:
+                results[asset_class] = future.result()
+            except Exception as e:
+                logger.error(f"[{asset_class}] 下载失败: {e}")
+                results[asset_class] = {"error": str(e)}
+
+    elapsed_time = time.time() - start_time
+    slowest = max((result.get("elapsed", 0) for result in results.values()), default=0)
+    logger.info(f"并发下载完成，总耗时 {elapsed_time:.2f} 秒（耗时最长的类别 {slowest:.2f} 秒）")
+    return results
@@ -0,0 +1,166 @@
+# src/tasks/queue_selftest.py
+"""
+此模块提供分布式下载工作队列的多进程自检。
+在指定的PostgreSQL数据库中为一个临时计划加入合成工作，启动多个本机工作进程共同完成，
+其中一个代码总是失败、一个代码第一次领取时工作进程直接退出，
+结束后核对租约过期重新领取、失败退避重试和多次失败后进入 dead 的状态变化，不访问任何数据源。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import argparse
+import logging
+import os
+import time
+from datetime import date
+from queue import Empty
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+
+from StockDownloader.src.core.config import config
+from StockDownloader.src.database.models.work_queue import IngestionJob
+from StockDownloader.src.database.session import SessionLocal
+from StockDownloader.src.tasks import queue_worker
+from StockDownloader.src.utils.work_queue import enqueue_jobs, plan_counts, DONE, DEAD
+
+# 自检只在控制台输出结果
+logger = logging.getLogger("queue_selftest")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# 总是失败的代码，达到最多领取次数后应进入 dead 状态
+FAIL_SYMBOL = "SELFTEST_FAIL"
+# 第一次领取时工作进程直接退出的代码，租约过期后应被其他工作进程重新领取并完成
+CRASH_SYMBOL = "SELFTEST_CRASH"
+# 自检时缩短的租约时长、重试等待时间和空闲轮询间隔（秒）
+LEASE_SECONDS = 6
+RETRY_DELAY = 1
+IDLE_POLL_SECONDS = 1
+# 每项工作模拟的下载耗时（秒），使多个工作进程交替领取
+JOB_SECONDS = 0.2
+
+
+def _fake_download(job: Dict[str, object]):
+    """代替下载的工作函数"""
+    if job["symbol"] == FAIL_SYMBOL:
+        raise RuntimeError("自检: 模拟下载失败")
+    if job["symbol"] == CRASH_SYMBOL and job["attempts"] == 1:
+        # 模拟工作进程崩溃：不释放租约、不记录失败
+        os._exit(1)
+    time.sleep(JOB_SECONDS)
+
+
+def _run_worker(database_url: str, plan: str, results):
+    """子进程：连接自检数据库，用缩短的租约和重试间隔运行工作进程，完成后报告各自的统计"""
+    SessionLocal.configure(bind=create_engine(database_url))
+    config.QUEUE_LEASE_SECONDS = LEASE_SECONDS
+    config.QUEUE_RETRY_DELAY = RETRY_DELAY
+    queue_worker.IDLE_POLL_SECONDS = IDLE_POLL_SECONDS
+    results.put((os.getpid(), queue_worker.run_worker(plan, process=_fake_download)))
+
+
+def _check(db, plan: str, symbols: List[str], max_attempts: int) -> List[str]:
+    """核对计划中各工作的最终状态，返回不符合预期的说明"""
+    jobs = {job.symbol: job for job in db.query(IngestionJob).filter(IngestionJob.plan == plan).all()}
+    problems = []
+    for symbol in symbols:
+        job = jobs[symbol]
+        if job.status != DONE:
+            problems.append(f"{symbol} 状态为 {job.status}，应为 {DONE}")
+    crash = jobs[CRASH_SYMBOL]
+    if crash.status != DONE or crash.attempts != 2:
+        problems.append(f"{CRASH_SYMBOL} 状态 {crash.status}、领取 {crash.attempts} 次，应在租约过期后第 2 次领取时完成")
+    fail = jobs[FAIL_SYMBOL]
+    if fail.status != DEAD or fail.attempts != max_attempts or not fail.last_error:
+        problems.append(f"{FAIL_SYMBOL} 状态 {fail.status}、领取 {fail.attempts} 次，应在第 {max_attempts} 次失败后进入 {DEAD}")
+    held = [job.symbol for job in jobs.values() if job.lease_owner is not None or job.lease_expires_at is not None]
+    if held:
+        problems.append(f"结束后仍持有租约的工作: {', '.join(held)}")
+    return problems
+
+
+def run_selftest(database_url: str, workers: int = 3, jobs: int = 20, max_attempts: int = 3, keep: bool = False) -> List[str]:
+    """
+    运行一次工作队列自检
+
+    参数:
+    - database_url: PostgreSQL 连接串，只会写入 ingestion_job 表中的一个临时计划
+    - workers: 工作进程数，至少为3（其中一个会模拟崩溃）
+    - jobs: 正常完成的合成工作数
+    - max_attempts: 每项工作最多领取次数，至少为3
+    - keep: 是否保留自检计划的工作记录
+
+    返回:
+    - 不符合预期的说明列表，为空表示通过
+    """
+    if workers < 3 or max_attempts < 3:
+        raise ValueError("自检至少需要 3 个工作进程，最多领取次数至少为 3")
+    engine = create_engine(database_url)
+    SessionLocal.configure(bind=engine)
+    IngestionJob.__table__.create(engine, checkfirst=True)
+    plan = f"selftest_{os.getpid()}_{int(time.time())}"
+    symbols = [f"SELFTEST{i:03d}" for i in range(jobs)]
+    today = date.today()
+    db = SessionLocal()
+    try:
+        items = [(symbol, symbol, today, today) for symbol in [CRASH_SYMBOL, *symbols, FAIL_SYMBOL]]
+        enqueue_jobs(db, plan, "stock", items, max_attempts=max_attempts)
+    finally:
+        db.close()
+    # 子进程自行建立连接，不继承父进程连接池中的连接
+    engine.dispose()
+    logger.info(f"计划 {plan}: {len(items)} 项工作，{workers} 个工作进程，租约 {LEASE_SECONDS} 秒")
+
+    start_time = time.time()
+    results = queue_worker._CONTEXT.Queue()
+    processes = [queue_worker._CONTEXT.Process(target=_run_worker, args=(database_url, plan, results), name=f"selftest-worker-{i}")
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    stats = []
+    while True:
+        try:
+            stats.append(results.get(timeout=1))
+        except Empty:
+            break
+    elapsed_time = time.time() - start_time
+
+    db = SessionLocal()
+    try:
+        problems = _check(db, plan, symbols, max_attempts)
+        logger.info(f"计划状态: {plan_counts(db, plan)}，耗时 {elapsed_time:.2f} 秒")
+        exited = sorted(process.exitcode for process in processes)
+        logger.info(f"工作进程退出码: {exited}，各进程统计: {[result for _, result in stats]}")
+        if exited.count(1) != 1:
+            problems.append(f"应恰好有 1 个工作进程模拟崩溃，实际退出码为 {exited}")
+        if sum(1 for _, result in stats if result["done"]) < 2:
+            problems.append("完成工作的工作进程少于 2 个，未能验证多个工作进程共同领取")
+        if not keep:
+            db.query(IngestionJob).filter(IngestionJob.plan == plan).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+    for problem in problems:
+        logger.error(problem)
+    logger.info("自检通过" if not problems else f"自检失败: {len(problems)} 项不符合预期")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分布式下载工作队列多进程自检")
+    parser.add_argument("database_url", help="PostgreSQL 连接串（只写入 ingestion_job 表中的临时计划）")
+    parser.add_argument("--workers", type=int, default=3, help="工作进程数，至少为3")
+    parser.add_argument("--jobs", type=int, default=20, help="正常完成的合成工作数")
+    parser.add_argument("--max-attempts", type=int, default=3, help="每项工作最多领取次数，至少为3")
+    parser.add_argument("--keep", action="store_true", help="保留自检计划的工作记录")
+    args = parser.parse_args()
+
+    if run_selftest(args.database_url, args.workers, args.jobs, args.max_attempts, args.keep):
+        raise SystemExit(1)
@@ -0,0 +1,234 @@
+# src/tasks/queue_worker.py
+"""
+此模块定义了基于工作队列的分布式下载任务。
+一个下载计划（如某个交易日的增量更新或全量重建）按代码拆分为 ingestion_job 中的工作，
+任意主机上的任意多个工作进程可以为同一计划入队（重复入队不会产生重复工作）并共同领取、完成这些工作，
+增加工作进程即可按近似线性的比例缩短下载时间。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from sqlalchemy import func
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.models.index import IndexDailyData
+from ..database.models.info import StockInfo, IndexInfo
+from ..database.models.stock import StockDailyData
+from ..database.models.work_queue import IngestionJob
+from ..database.session import SessionLocal
+from ..services.data_fetcher import DataFetcher
+from ..services.data_saver import DataSaver
+from ..utils.market_snapshot import refresh_stock_snapshots
+from ..utils.trading_calendar import get_latest_trading_day
+from ..utils.work_queue import (
+    enqueue_jobs, claim_jobs, complete_job, fail_job, plan_counts, default_worker_id, LeaseKeeper, DONE, DEAD
+)
+
+# 可入队的数据类型: {类型: (日线模型, 代码列表模型)}
+QUEUE_SOURCES = {
+    "stock": (StockDailyData, StockInfo),
+    "index": (IndexDailyData, IndexInfo),
+}
+# 计划模式：update 从每个代码的最新日期之后增量更新，rebuild 从 START_DATE 下载全部历史
+PLAN_MODES = ("update", "rebuild")
+# 没有可领取的工作但计划尚未完成（其他工作进程持有租约或工作在退避中）时的等待间隔（秒）
+IDLE_POLL_SECONDS = 10
+# 本机工作进程和分片进程的启动方式：下载可能由每日更新任务图的工作线程发起，此时其他线程可能持有日志或连接池的锁，
+# fork 出的子进程会继承这些锁，因此从 forkserver（不支持时为 spawn）启动，子进程自行建立数据库连接
+_CONTEXT = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+def default_plan_name(mode: str, kinds: List[str]) -> str:
+    """同一交易日、同一模式和数据类型的计划名称相同，各主机无需协调即可加入同一计划"""
+    return f"{mode}_{'_'.join(sorted(kinds))}_{get_latest_trading_day().strftime('%Y%m%d')}"
+
+
+def build_plan_items(db, kind: str, mode: str):
+    """
+    生成某类数据的工作列表
+
+    返回:
+    - (代码, 名称, 起始日期, 结束日期) 列表，已是最新的代码不生成工作
+    """
+    daily_model, info_model = QUEUE_SOURCES[kind]
+    end_date = get_latest_trading_day()
+    full_start = datetime.strptime(config.START_DATE, "%Y%m%d").date()
+    latest = {}
+    if mode == "update":
+        latest = dict(db.query(daily_model.symbol, func.max(daily_model.date)).group_by(daily_model.symbol).all())
+    items = []
+    for symbol, name in db.query(info_model.symbol, info_model.name).all():
+        start_date = latest[symbol] + timedelta(days=1) if symbol in latest else full_start
+        if start_date <= end_date:
+            items.append((symbol, name, start_date, end_date))
+    return items
+
+
+def enqueue_plan(plan: str, kinds: List[str], mode: str) -> int:
+    """为计划加入各类数据的工作，返回新加入的工作数"""
+    db = SessionLocal()
+    try:
+        added = 0
+        for kind in kinds:
+            items = build_plan_items(db, kind, mode)
+            count = enqueue_jobs(db, plan, kind, items)
+            logger.info(f"计划 {plan}: {kind} 需要下载 {len(items)} 个代码，新加入 {count} 项工作")
+            added += count
+        return added
+    finally:
+        db.close()
+
+
+def fetch_and_save(fetcher: DataFetcher, saver: DataSaver, job: Dict[str, object], bulk_load=None):
+    """下载并保存一项工作（类型、代码、名称、起止日期）的数据，失败时抛出异常；bulk_load 见 DataSaver.save_stock_daily_data_to_db"""
+    start_date = job["start_date"].strftime("%Y%m%d")
+    end_date = job["end_date"].strftime("%Y%m%d")
+    if job["kind"] == "stock":
+        data = fetcher.fetch_stock_daily_data(job["symbol"], start_date, end_date, 'hfq')
+        if data is not None and not data.empty:
+            saver.save_stock_daily_data_to_db(data, job["symbol"], bulk_load=bulk_load)
+    else:
+        data = fetcher.fetch_index_daily_data(job["symbol"], start_date, end_date)
+        if data is not None and not data.empty:
+            saver.save_index_daily_data_to_db(data, job["symbol"], job["name"] or "未知指数", bulk_load=bulk_load)
+
+
+def run_worker(plan: str, worker: str = None, process: Callable[[Dict[str, object]], object] = None) -> Dict[str, int]:
+    """
+    领取并完成计划中的工作，直到计划中没有待领取和执行中的工作
+
+    参数:
+    - plan: 计划名称
+    - worker: 工作进程标识，默认为 主机名:进程号
+    - process: 完成一项工作的函数 process(工作)，失败时抛出异常，默认为 fetch_and_save（queue_selftest 用它代替下载）
+
+    返回:
+    - 本工作进程完成、失败的工作数
+    """
+    worker = worker or default_worker_id()
+    if process is None:
+        fetcher = DataFetcher()
+        saver = DataSaver()
+        process = lambda job: fetch_and_save(fetcher, saver, job)
+    stats = {"done": 0, "failed": 0}
+    start_time = time.time()
+    logger.info(f"工作进程 {worker} 开始处理计划 {plan}")
+
+    db = SessionLocal()
+    try:
+        while True:
+            jobs = claim_jobs(db, plan, worker)
+            if not jobs:
+                counts = plan_counts(db, plan)
+                if counts["pending"] == 0 and counts["running"] == 0:
+                    break
+                time.sleep(IDLE_POLL_SECONDS)
+                continue
+
+            with LeaseKeeper(worker, [job["id"] for job in jobs]) as keeper:
+                for job in jobs:
+                    try:
+                        process(job)
+                        complete_job(db, worker, job["id"])
+                        stats["done"] += 1
+                    except Exception as e:
+                        db.rollback()
+                        status = fail_job(db, worker, job["id"], str(e))
+                        stats["failed"] += 1
+                        level = logger.error if status == DEAD else logger.warning
+                        level(f"工作 {job['kind']} {job['symbol']} 第 {job['attempts']} 次失败（{status}）: {e}")
+                    finally:
+                        keeper.release(job["id"])
+    finally:
+        db.close()
+
+    elapsed_time = time.time() - start_time
+    logger.info(f"工作进程 {worker} 结束: 完成 {stats['done']} 项, 失败 {stats['failed']} 项, 耗时 {elapsed_time:.2f} 秒")
+    return stats
+
+
+def run_local_workers(plan: str, workers: int) -> Dict[str, int]:
+    """
+    在本机启动多个工作进程处理同一计划，所有工作进程结束后返回计划中各状态的工作数
+    多个主机各自运行本函数即可共同完成同一计划
+    """
+    if workers <= 1:
+        run_worker(plan)
+    else:
+        # 子进程不继承父进程的连接池，父进程的连接池可能正被其他任务使用，不能在这里释放
+        processes = [_CONTEXT.Process(target=run_worker, args=(plan,), name=f"queue-worker-{i}") for i in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    db = SessionLocal()
+    try:
+        counts = plan_counts(db, plan)
+    finally:
+        db.close()
+    logger.info(f"计划 {plan} 状态: {counts}")
+    return counts
+
+
+def run_queue_ingestion(mode: str = "update", kinds: List[str] = None, workers: int = 1, plan: str = None) -> Dict[str, int]:
+    """
+    入队（可重复）并以本机 workers 个工作进程参与完成下载计划
+    所有主机使用相同的 mode 在同一交易日运行时会加入同一个计划
+
+    参数:
+    - mode: update 或 rebuild
+    - kinds: 数据类型列表，默认为 stock 和 index
+    - workers: 本机工作进程数
+    - plan: 计划名称，默认为 default_plan_name(mode, kinds)
+    """
+    kinds = kinds or list(QUEUE_SOURCES)
+    plan = plan or default_plan_name(mode, kinds)
+    enqueue_plan(plan, kinds, mode)
+    counts = run_local_workers(plan, workers)
+    if "stock" in kinds:
+        # 股票日线写入后重建计划中已完成的股票工作覆盖范围内的全市场截面
+        db = SessionLocal()
+        try:
+            start_date, end_date = db.query(func.min(IngestionJob.start_date), func.max(IngestionJob.end_date)).filter(
+                IngestionJob.plan == plan, IngestionJob.kind == "stock", IngestionJob.status == DONE
+            ).one()
+            if start_date is not None:
+                refresh_stock_snapshots(db, start_date, end_date)
+        finally:
+            db.close()
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="基于工作队列的分布式日线下载")
+    parser.add_argument("command", choices=["run", "enqueue", "work", "status"],
+                        help="run: 入队并处理; enqueue: 只入队; work: 只处理已有计划; status: 查看计划状态")
+    parser.add_argument("--mode", choices=PLAN_MODES, default="update", help="计划模式")
+    parser.add_argument("--kinds", nargs="+", choices=list(QUEUE_SOURCES), help="数据类型，默认为全部")
+    parser.add_argument("--plan", help="计划名称，默认为 模式_数据类型_最近交易日")
+    parser.add_argument("--workers", type=int, default=1, help="本机工作进程数")
+    args = parser.parse_args()
+
+    kinds = args.kinds or list(QUEUE_SOURCES)
+    plan_name = args.plan or default_plan_name(args.mode, kinds)
+    if args.command == "run":
+        run_queue_ingestion(args.mode, kinds, args.workers, plan_name)
+    elif args.command == "enqueue":
+        enqueue_plan(plan_name, kinds, args.mode)
+    elif args.command == "work":
+        run_local_workers(plan_name, args.workers)
+    else:
+        session = SessionLocal()
+        try:
+            print(plan_name, plan_counts(session, plan_name))
+        finally:
+            session.close()
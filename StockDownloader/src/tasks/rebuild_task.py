@@ -0,0 +1,312 @@
+# src/tasks/rebuild_task.py
+"""
+此模块定义了可断点续传的全量重建任务。
+重建分为三步：清空数据表、刷新股票和指数列表并把下载计划写入 rebuild_checkpoint、按计划逐个代码下载，
+前两步完成后在 rebuild_run 中记录完成时间，每个代码写入后立即把其检查点标记为完成；
+进程崩溃或重启后用 resume_rebuild 从日志继续，跳过已完成的步骤和代码，不需要重新下载全部历史。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import threading
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import func, insert, text
+
+from ..core.logger import logger
+from ..database.base import Base
+from ..database.models.rebuild_journal import RebuildRun, RebuildCheckpoint
+from ..database.session import SessionLocal, engine
+from ..services.data_fetcher import DataFetcher
+from ..services.data_saver import DataSaver
+from ..utils.derived_maintenance import BulkDerivedLoad, bulk_load_enabled
+from ..utils.market_snapshot import refresh_stock_snapshots
+from ..utils.retry_queue import run_with_deferred_retry
+from .download_index_task import refresh_index_universe
+from .download_stock_task import refresh_stock_universe
+from .queue_worker import QUEUE_SOURCES, build_plan_items, fetch_and_save
+
+# 重建状态
+PLANNING = "planning"
+RUNNING = "running"
+FAILED = "failed"
+DONE = "done"
+# 开始新的重建后，之前未完成的重建不能再继续
+ABORTED = "aborted"
+# 可以继续的重建状态
+RESUMABLE = (PLANNING, RUNNING, FAILED)
+
+# 检查点状态
+PENDING = "pending"
+
+# 重建时保留的表：任务登记表和重建日志本身
+KEEP_TABLES = ("job_run", "rebuild_run", "rebuild_checkpoint")
+
+KIND_NAMES = {"stock": "股票", "index": "指数"}
+
+ProgressCallback = Callable[[Optional[int], Optional[int], Optional[str]], object]
+
+
+def _report(progress: Optional[ProgressCallback], done: int = None, total: int = None, message: str = None):
+    if progress is not None:
+        progress(done, total, message)
+
+
+def _update_run(run_id: int, **values):
+    # 时间统一由数据库生成，与 created_at 默认值使用同一时区
+    values["updated_at"] = func.now()
+    db = SessionLocal()
+    try:
+        db.query(RebuildRun).filter(RebuildRun.id == run_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _mark_checkpoint(run_id: int, kind: str, symbol: str, error: str = None):
+    """代码写入完成或最终失败后更新其检查点"""
+    values = {"status": FAILED, "last_error": error[:2000]} if error else {"status": DONE, "last_error": None, "completed_at": func.now()}
+    db = SessionLocal()
+    try:
+        db.query(RebuildCheckpoint).filter(
+            RebuildCheckpoint.run_id == run_id, RebuildCheckpoint.kind == kind, RebuildCheckpoint.symbol == symbol
+        ).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _clear_data_tables():
+    """
+    清空除任务登记表和重建日志以外的所有表
+    用 TRUNCATE 而不是删除重建表，保留 sql2build 中在 daily_stock / daily_index 上建立的衍生表触发器
+    """
+    Base.metadata.create_all(engine)
+    tables = [table.name for table in Base.metadata.sorted_tables if table.name not in KEEP_TABLES]
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE TABLE {', '.join(tables)} RESTART IDENTITY"))
+
+
+def _write_plan(run_id: int, kinds: List[str]):
+    """刷新代码列表并在一个事务内写入下载计划，写入完成后重建进入下载阶段"""
+    for kind in kinds:
+        if kind == "stock":
+            refresh_stock_universe()
+        else:
+            refresh_index_universe()
+    db = SessionLocal()
+    try:
+        db.query(RebuildCheckpoint).filter(RebuildCheckpoint.run_id == run_id).delete(synchronize_session=False)
+        for kind in kinds:
+            items = build_plan_items(db, kind, "rebuild")
+            if items:
+                db.execute(insert(RebuildCheckpoint), [
+                    {"run_id": run_id, "kind": kind, "symbol": symbol, "name": name,
+                     "start_date": start_date, "end_date": end_date, "status": PENDING}
+                    for symbol, name, start_date, end_date in items
+                ])
+            logger.info(f"重建 {run_id}: {KIND_NAMES[kind]}需要下载 {len(items)} 个代码")
+        db.query(RebuildRun).filter(RebuildRun.id == run_id).update({"planned_at": func.now(), "status": RUNNING, "updated_at": func.now()})
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _checkpoint_counts(db, run_id: int) -> Dict[str, Dict[str, int]]:
+    """各数据类型各状态的检查点数 {数据类型: {状态: 数量}}"""
+    counts = {}
+    rows = db.query(RebuildCheckpoint.kind, RebuildCheckpoint.status, func.count()).filter(
+        RebuildCheckpoint.run_id == run_id
+    ).group_by(RebuildCheckpoint.kind, RebuildCheckpoint.status).all()
+    for kind, status, count in rows:
+        counts.setdefault(kind, {})[status] = count
+    return counts
+
+
+def _download(run_id: int, kinds: List[str], progress: Optional[ProgressCallback]) -> int:
+    """按计划下载未完成的代码，返回最终失败的代码数"""
+    db = SessionLocal()
+    try:
+        counts = _checkpoint_counts(db, run_id)
+    finally:
+        db.close()
+    total = sum(sum(statuses.values()) for statuses in counts.values())
+    done = sum(statuses.get(DONE, 0) for statuses in counts.values())
+    if done:
+        logger.info(f"重建 {run_id}: 从检查点继续，已完成 {done}/{total} 个代码")
+    lock = threading.Lock()
+    fetcher = DataFetcher()
+    saver = DataSaver()
+    failed = 0
+
+    # 开启 DERIVED_BULK_LOAD（且通过计算方式检查）时暂停触发器并在最后批量刷新衍生表
+    with BulkDerivedLoad() if bulk_load_enabled() else nullcontext() as bulk_load:
+        for kind in kinds:
+            db = SessionLocal()
+            try:
+                checkpoints = db.query(RebuildCheckpoint).filter(RebuildCheckpoint.run_id == run_id, RebuildCheckpoint.kind == kind).all()
+            finally:
+                db.close()
+            plan = {checkpoint.symbol: checkpoint for checkpoint in checkpoints if checkpoint.status != DONE}
+            if bulk_load is not None:
+                # 之前的进程可能在刷新衍生表之前退出，已完成的代码也按计划范围重新刷新
+                daily_table = QUEUE_SOURCES[kind][0].__tablename__
+                for checkpoint in checkpoints:
+                    if checkpoint.status == DONE:
+                        bulk_load.mark(daily_table, checkpoint.symbol, [checkpoint.start_date, checkpoint.end_date])
+            message = f"正在下载{KIND_NAMES[kind]}数据..."
+            _report(progress, done, total, message)
+
+            def process(symbol, params):
+                checkpoint = plan[symbol]
+                fetch_and_save(fetcher, saver, {
+                    "kind": kind, "symbol": symbol, "name": checkpoint.name,
+                    "start_date": checkpoint.start_date, "end_date": checkpoint.end_date,
+                }, bulk_load=bulk_load)
+
+            def on_finished(symbol, error):
+                nonlocal done
+                _mark_checkpoint(run_id, kind, symbol, error)
+                if error is None:
+                    with lock:
+                        done += 1
+                        current = done
+                    _report(progress, current, total, message)
+
+            # 最终失败的代码记录在检查点中，继续重建时重新下载，不写入死信表
+            result = run_with_deferred_retry(kind, [(symbol, {}) for symbol in plan], process, persist=False, on_finished=on_finished)
+            failed += len(result["dead"])
+    return failed
+
+
+def _execute(run_id: int, progress: Optional[ProgressCallback] = None) -> Dict[str, object]:
+    """从重建日志记录的位置开始执行重建"""
+    db = SessionLocal()
+    try:
+        run = db.query(RebuildRun).filter(RebuildRun.id == run_id).one()
+        kinds, cleared, planned = list(run.kinds), run.cleared_at is not None, run.planned_at is not None
+    finally:
+        db.close()
+
+    try:
+        if not cleared:
+            _report(progress, message="正在清空现有数据表...")
+            _clear_data_tables()
+            _update_run(run_id, cleared_at=func.now())
+        if not planned:
+            _report(progress, message="正在生成下载计划...")
+            _write_plan(run_id, kinds)
+        else:
+            _update_run(run_id, status=RUNNING, last_error=None)
+
+        failed = _download(run_id, kinds, progress)
+        if failed:
+            raise RuntimeError(f"重建 {run_id}: {failed} 个代码下载失败，可以继续重建以重试这些代码")
+
+        if "stock" in kinds:
+            # 全部写入（含衍生表刷新）后重建计划范围内的全市场截面
+            db = SessionLocal()
+            try:
+                start_date, end_date = db.query(func.min(RebuildCheckpoint.start_date), func.max(RebuildCheckpoint.end_date)).filter(
+                    RebuildCheckpoint.run_id == run_id, RebuildCheckpoint.kind == "stock"
+                ).one()
+                if start_date is not None:
+                    refresh_stock_snapshots(db, start_date, end_date)
+            finally:
+                db.close()
+        _update_run(run_id, status=DONE, finished_at=func.now())
+        logger.info(f"重建 {run_id} 完成")
+        return rebuild_summary(run_id)
+    except Exception as e:
+        logger.error(f"重建 {run_id} 中断: {e}")
+        _update_run(run_id, status=FAILED, last_error=str(e)[:2000])
+        raise
+
+
+def start_rebuild(kinds: List[str] = None, progress: ProgressCallback = None) -> Dict[str, object]:
+    """
+    开始一次新的全量重建，之前未完成的重建不再可以继续
+
+    参数:
+    - kinds: 数据类型列表，默认为 stock 和 index
+    - progress: 进度回调 progress(已完成代码数, 代码总数, 进度说明)
+
+    返回:
+    - rebuild_summary 的结果
+    """
+    kinds = kinds or list(QUEUE_SOURCES)
+    db = SessionLocal()
+    try:
+        db.query(RebuildRun).filter(RebuildRun.status.in_(RESUMABLE)).update(
+            {"status": ABORTED, "updated_at": func.now()}, synchronize_session=False
+        )
+        run = RebuildRun(kinds=kinds, status=PLANNING)
+        db.add(run)
+        db.commit()
+        run_id = run.id
+    finally:
+        db.close()
+    logger.info(f"开始重建 {run_id}: {', '.join(kinds)}")
+    return _execute(run_id, progress)
+
+
+def latest_resumable_run() -> Optional[int]:
+    """最近一次未完成、可以继续的重建ID"""
+    db = SessionLocal()
+    try:
+        row = db.query(RebuildRun.id).filter(RebuildRun.status.in_(RESUMABLE)).order_by(RebuildRun.id.desc()).first()
+        return row[0] if row else None
+    finally:
+        db.close()
+
+
+def resume_rebuild(run_id: int = None, progress: ProgressCallback = None) -> Dict[str, object]:
+    """
+    从重建日志继续一次未完成的重建，跳过已完成的步骤和代码，并重试之前失败的代码
+
+    参数:
+    - run_id: 重建ID，默认为最近一次未完成的重建
+    - progress: 进度回调 progress(已完成代码数, 代码总数, 进度说明)
+
+    返回:
+    - rebuild_summary 的结果
+    """
+    run_id = run_id or latest_resumable_run()
+    summary = rebuild_summary(run_id) if run_id else None
+    if summary is None or summary["status"] not in RESUMABLE:
+        raise ValueError(f"没有可以继续的重建: {run_id}" if run_id else "没有可以继续的重建")
+    logger.info(f"继续重建 {run_id}")
+    return _execute(run_id, progress)
+
+
+def rebuild_summary(run_id: int = None) -> Optional[Dict[str, object]]:
+    """
+    重建的状态和各数据类型的检查点数
+
+    参数:
+    - run_id: 重建ID，默认为最近一次重建
+
+    返回:
+    - {"id", "kinds", "status", "last_error", "created_at", "finished_at", "counts": {数据类型: {状态: 数量}}}，没有重建记录时返回None
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(RebuildRun)
+        run = query.filter(RebuildRun.id == run_id).first() if run_id else query.order_by(RebuildRun.id.desc()).first()
+        if run is None:
+            return None
+        return {
+            "id": run.id,
+            "kinds": run.kinds,
+            "status": run.status,
+            "last_error": run.last_error,
+            "created_at": run.created_at.strftime("%Y-%m-%d %H:%M:%S") if run.created_at else None,
+            "finished_at": run.finished_at.strftime("%Y-%m-%d %H:%M:%S") if run.finished_at else None,
+            "counts": _checkpoint_counts(db, run.id),
+        }
+    finally:
+        db.close()
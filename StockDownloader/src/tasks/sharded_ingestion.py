@@ -0,0 +1,167 @@
+# src/tasks/sharded_ingestion.py
+"""
+此模块定义了单机多进程分片下载任务。
+代码按稳定哈希分到 N 个子进程，每个子进程有自己的下载线程池和数据库连接，
+数据整理、日志和ORM开销分摊到多个CPU核心上；所有子进程共享同一个全局请求速率限额，
+父进程汇总各分片的进度和失败的代码。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import queue
+import time
+import zlib
+from typing import Dict, List
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.session import SessionLocal
+from ..services.data_fetcher import DataFetcher
+from ..services.data_saver import DataSaver
+from ..utils.market_snapshot import refresh_stock_snapshots
+from ..utils.retry_queue import run_with_deferred_retry
+from .queue_worker import QUEUE_SOURCES, _CONTEXT, build_plan_items, fetch_and_save
+
+# 父进程每完成多少个代码输出一次进度
+PROGRESS_LOG_INTERVAL = 100
+
+
+def shard_of(symbol: str, shards: int) -> int:
+    """代码所属的分片，不随进程和运行次数变化"""
+    return zlib.crc32(symbol.encode("utf-8")) % shards
+
+
+class SharedRateLimiter:
+    """
+    跨进程共享的请求速率限额：所有进程的请求合计不超过每秒 rate 次。
+    在共享内存中保存下一个可用的请求时间，每次请求预约一个时间片后在锁外等待。
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_time = _CONTEXT.Value("d", 0.0)
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._next_time.get_lock():
+            now = time.time()
+            slot = max(now, self._next_time.value)
+            self._next_time.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _run_shard(shard: int, items: List[Dict[str, object]], limiter: SharedRateLimiter, progress, threads: int):
+    """子进程：用线程池下载本分片的代码，失败的代码延迟重试，每个代码成功或最终失败后向父进程报告结果"""
+    fetcher = DataFetcher()
+    saver = DataSaver()
+
+    try:
+        for kind in sorted({item["kind"] for item in items}):
+            jobs = {item["symbol"]: item for item in items if item["kind"] == kind}
+
+            def process(symbol, params, jobs=jobs):
+                limiter.acquire()
+                fetch_and_save(fetcher, saver, jobs[symbol])
+
+            run_with_deferred_retry(
+                kind,
+                [(symbol, {"start_date": job["start_date"].strftime("%Y%m%d"), "end_date": job["end_date"].strftime("%Y%m%d")})
+                 for symbol, job in jobs.items()],
+                process,
+                threads=threads,
+                on_finished=lambda symbol, error, kind=kind: progress.put((shard, kind, symbol, error)),
+            )
+    finally:
+        progress.put((shard, None, None, None))
+
+
+def run_sharded_ingestion(mode: str = "update", kinds: List[str] = None, shards: int = None, threads: int = None,
+                          rate_limit: float = None) -> Dict[str, object]:
+    """
+    以多进程分片方式下载股票和指数日线
+
+    参数:
+    - mode: update 从每个代码的最新日期之后增量更新，rebuild 从 START_DATE 下载全部历史
+    - kinds: 数据类型列表，默认为 stock 和 index
+    - shards: 子进程数，默认为 config.INGEST_SHARDS
+    - threads: 每个子进程的下载线程数，默认为 config.SHARD_FETCH_THREADS
+    - rate_limit: 所有子进程合计每秒最多请求数，默认为 config.INGEST_RATE_LIMIT
+
+    返回:
+    - {"done": 成功的代码数, "failed": [(类型, 代码, 错误信息)]}
+    """
+    kinds = kinds or list(QUEUE_SOURCES)
+    shards = max(1, shards or config.INGEST_SHARDS)
+    threads = threads or config.SHARD_FETCH_THREADS
+    limiter = SharedRateLimiter(config.INGEST_RATE_LIMIT if rate_limit is None else rate_limit)
+    start_time = time.time()
+
+    db = SessionLocal()
+    try:
+        items = [
+            {"kind": kind, "symbol": symbol, "name": name, "start_date": start_date, "end_date": end_date}
+            for kind in kinds
+            for symbol, name, start_date, end_date in build_plan_items(db, kind, mode)
+        ]
+    finally:
+        db.close()
+    if not items:
+        logger.info(f"{'/'.join(kinds)} 数据已是最新，无需下载")
+        return {"done": 0, "failed": []}
+
+    shard_items = [[] for _ in range(shards)]
+    for item in items:
+        shard_items[shard_of(item["symbol"], shards)].append(item)
+    logger.info(f"分片下载 {len(items)} 个代码: {shards} 个进程, 每个进程 {threads} 个下载线程, 各分片代码数 {[len(part) for part in shard_items]}")
+
+    progress = _CONTEXT.Queue()
+    processes = [
+        _CONTEXT.Process(target=_run_shard, args=(shard, part, limiter, progress, threads), name=f"ingest-shard-{shard}")
+        for shard, part in enumerate(shard_items)
+    ]
+    for process in processes:
+        process.start()
+
+    done = 0
+    failed = []
+    succeeded = set()
+    finished_shards = set()
+    while len(finished_shards) < shards:
+        try:
+            shard, kind, symbol, error = progress.get(timeout=5)
+        except queue.Empty:
+            # 异常退出的子进程不会发送结束标记
+            for shard, process in enumerate(processes):
+                if shard not in finished_shards and not process.is_alive() and process.exitcode != 0:
+                    logger.error(f"分片 {shard} 的进程异常退出 (exitcode={process.exitcode})")
+                    finished_shards.add(shard)
+            continue
+        if kind is None:
+            finished_shards.add(shard)
+            continue
+        if error is None:
+            done += 1
+            succeeded.add((kind, symbol))
+        else:
+            failed.append((kind, symbol, error))
+            logger.error(f"分片 {shard} 下载 {kind} {symbol} 失败: {error}")
+        if (done + len(failed)) % PROGRESS_LOG_INTERVAL == 0:
+            logger.info(f"分片下载进度: {done + len(failed)}/{len(items)}, 失败 {len(failed)}")
+    for process in processes:
+        process.join()
+
+    stock_items = [item for item in items if item["kind"] == "stock" and ("stock", item["symbol"]) in succeeded]
+    if stock_items:
+        # 股票日线写入后重建下载范围内的全市场截面
+        db = SessionLocal()
+        try:
+            refresh_stock_snapshots(db, min(item["start_date"] for item in stock_items), max(item["end_date"] for item in stock_items))
+        finally:
+            db.close()
+
+    elapsed_time = time.time() - start_time
+    unfinished = len(items) - done - len(failed)
+    logger.info(f"分片下载完成: 成功 {done} 个, 失败 {len(failed)} 个, 未完成 {unfinished} 个, 耗时 {elapsed_time:.2f} 秒")
+    return {"done": done, "failed": failed}
@@ -21,6 +21,8 @@ from StockDownloader.src.services.data_fetcher import DataFetcher
 from StockDownloader.src.services.data_saver import DataSaver
 from StockDownloader.src.utils.db_utils import initialize_database_if_needed
 from StockDownloader.src.utils.index_utils import get_index_trading_dates, get_stock_trading_dates
+from StockDownloader.src.utils.market_snapshot import refresh_stock_snapshots
+from StockDownloader.src.utils.retry_queue import pending_dead_letters, run_with_deferred_retry
 
 
 def get_latest_date_from_db(engine, table_model):
@@ -74,83 +76,75 @@ def update_data(engine, fetcher, saver, table_model, fetch_function, save_functi
         # 将字符串日期转换为datetime对象进行比较
         start_date_obj = datetime.strptime(start_date, "%Y%m%d").date()
         end_date_obj = datetime.strptime(end_date, "%Y%m%d").date()
+        asset_class = "index" if table_model == IndexDailyData else "stock"
         
-        # 如果开始日期晚于结束日期，则无需更新
+        items = []
         if start_date_obj > end_date_obj:
+            # 如果开始日期晚于结束日期，则无需更新
             logger.info(f"数据库已是最新，无需更新")
-            return
-            
-        # 检查数据库最新日期是否已经包含最近交易日数据
-        if latest_date and latest_date >= latest_trading_day:
+        elif latest_date and latest_date >= latest_trading_day:
+            # 检查数据库最新日期是否已经包含最近交易日数据
             logger.info(f"数据库已包含最近交易日 {latest_trading_day.strftime('%Y-%m-%d')} 的数据，无需更新")
-            return
+        else:
+            # 如果今天不是交易日，但数据库中的数据不是最新的，仍然需要更新
+            trading_day_status = "非交易日" if not is_trading_day() else "交易日"
+            logger.info(f"今天是{trading_day_status}，数据库需要从 {start_date} 更新到 {end_date}")
+            logger.info(f"更新数据范围: {start_date} 到 {end_date}")
             
-        # 如果今天不是交易日，但数据库中的数据不是最新的，仍然需要更新
-        trading_day_status = "非交易日" if not is_trading_day() else "交易日"
-        logger.info(f"今天是{trading_day_status}，数据库需要从 {start_date} 更新到 {end_date}")
-
+            # 遍历所有股票/指数
+            for _, row in symbol_list.iterrows():
+                # 确保代码始终以字符串形式处理
+                symbol = str(row[symbol_key]).strip()
+                
+                # 对于纯数字的代码，确保格式正确（如：000001而不是1）
+                if symbol.isdigit() and len(symbol) < 6:
+                    symbol = symbol.zfill(6)  # 补齐6位
+                name = str(row['名称']) if '名称' in row and pd.notna(row['名称']) else None
+                items.append((symbol, {"start_date": start_date, "end_date": end_date, "name": name}))
         
-        logger.info(f"更新数据范围: {start_date} 到 {end_date}")
+        # 之前的更新中最终失败的代码从当时的起始日期补到最近交易日（全表最新日期不会因为个别代码失败而停留）
+        params_by_symbol = dict(items)
+        for symbol, params in pending_dead_letters(asset_class).items():
+            if not params.get("start_date"):
+                continue
+            current = params_by_symbol.get(symbol)
+            if current is None:
+                params_by_symbol[symbol] = {**params, "end_date": end_date}
+            else:
+                current["start_date"] = min(current["start_date"], params["start_date"])
+            start_date_obj = min(start_date_obj, datetime.strptime(params["start_date"], "%Y%m%d").date())
+        items = list(params_by_symbol.items())
+        if not items:
+            return
         
-        # 遍历所有股票/指数
-        for _, row in symbol_list.iterrows():
-            # 确保代码始终以字符串形式处理
-            symbol = str(row[symbol_key]).strip()
+        def process(symbol, params):
+            # 获取指定时间范围的数据
+            if table_model == StockDailyData:
+                logger.info(f"获取股票 {symbol} 从 {params['start_date']} 到 {params['end_date']} 的数据")
+                data = fetch_function(symbol, params["start_date"], params["end_date"], 'hfq')
+            else:
+                logger.info(f"获取指数 {symbol}({params.get('name')}) 从 {params['start_date']} 到 {params['end_date']} 的数据")
+                data = fetch_function(symbol, params["start_date"], params["end_date"])
             
-            # 对于纯数字的代码，确保格式正确（如：000001而不是1）
-            if symbol.isdigit() and len(symbol) < 6:
-                symbol = symbol.zfill(6)  # 补齐6位
+            # 检查返回的数据是否为None或空
+            if data is None or data.empty:
+                logger.warning(f"获取{'指数' if table_model == IndexDailyData else '股票'} {symbol} 的数据为空，跳过保存")
+                return
             
-            try:
-                # 获取指定时间范围的数据
-                if table_model == IndexDailyData:
-                    logger.info(f"获取指数 {symbol} 从 {start_date} 到 {end_date} 的数据")
-                    # 记录更详细的指数数据获取信息
-                    logger.info(f"指数更新 - 开始日期: {start_date}, 结束日期: {end_date}, 指数代码: {symbol}")
-                    if '名称' in row:
-                        logger.info(f"指数名称: {row['名称']}")
-                else:
-                    logger.info(f"获取股票 {symbol} 从 {start_date} 到 {end_date} 的数据")
-                
-                # 调用相应的数据获取函数
-                if table_model == StockDailyData:
-                    data = fetch_function(symbol, start_date, end_date, 'hfq')
-                else:
-                    logger.info(f"调用fetch_index_daily_data获取指数 {symbol} 数据...")
-                    data = fetch_function(symbol, start_date, end_date)
-                    if data is not None and not data.empty:
-                        logger.info(f"成功获取到指数 {symbol} 数据，行数: {len(data)}")
-                        logger.info(f"数据日期范围: {data['日期'].min()} 到 {data['日期'].max()}")
-                        logger.info(f"数据列: {list(data.columns)}")
-                    else:
-                        logger.warning(f"获取到的指数 {symbol} 数据为空或None")
-                
-                # 检查返回的数据是否为None或空
-                if data is None or data.empty:
-                    if table_model == IndexDailyData:
-                        logger.warning(f"获取指数 {symbol} 的数据为空，跳过保存")
-                    else:
-                        logger.warning(f"获取股票 {symbol} 的数据为空，跳过保存")
-                    continue
-                
-                # 保存数据到数据库
-                if table_model == IndexDailyData and '名称' in row:
-                    logger.info(f"开始保存指数 {symbol}({row['名称']}) 数据到数据库...")
-                    save_function(data, symbol, row['名称'])
-                    logger.info(f"指数 {symbol}({row['名称']}) 数据保存完成")
-                else:
-                    save_function(data, symbol)
-                
-                if table_model == IndexDailyData:
-                    logger.info(f"指数 {symbol} 数据更新完成")
-                else:
-                    logger.info(f"股票 {symbol} 数据更新完成")
-                    
-            except Exception as e:
-                if table_model == IndexDailyData:
-                    logger.error(f"更新指数 {symbol} 数据出错: {e}")
-                else:
-                    logger.error(f"更新股票 {symbol} 数据出错: {e}")
+            # 保存数据到数据库
+            if table_model == IndexDailyData:
+                save_function(data, symbol, params.get("name") or "未知指数")
+                logger.info(f"指数 {symbol} 数据更新完成")
+            else:
+                save_function(data, symbol)
+                logger.info(f"股票 {symbol} 数据更新完成")
+        
+        # 失败的代码延迟到本轮结束后重试，仍然失败的写入死信表，下次更新时重新下载
+        result = run_with_deferred_retry(asset_class, items, process)
+
+        # 股票日线写入完成后重建本次更新范围内的全市场截面
+        if table_model == StockDailyData and result["done"]:
+            refresh_stock_snapshots(db, start_date_obj, end_date_obj)
     finally:
         db.close()
 
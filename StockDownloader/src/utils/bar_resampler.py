@@ -0,0 +1,158 @@
+# src/utils/bar_resampler.py
+"""
+此模块负责由日线数据聚合周线、月线、季线，保存在 stock_period_bar / index_period_bar 表中。
+周期按自然周（周一开始）、自然月、自然季划分，K线只包含周期内实际有日线数据的交易日；
+每次日线写入后只重新聚合每个代码最近一个（可能尚未结束的）周期及之后的数据。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import time
+from datetime import date
+from typing import Dict, List
+
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.logger import logger
+from ..database.models.index import IndexDailyData
+from ..database.models.info import StockInfo, IndexInfo
+from ..database.models.period_bar import StockPeriodBar, IndexPeriodBar
+from ..database.models.stock import StockDailyData
+from ..database.session import SessionLocal
+
+# 周期代码与pandas周期规则
+FREQUENCIES = {
+    "W": "W-SUN",
+    "M": "M",
+    "Q": "Q",
+}
+# 可聚合的数据源: {名称: (日线模型, 周期K线模型, 代码列表模型)}
+BAR_SOURCES = {
+    "stock": (StockDailyData, StockPeriodBar, StockInfo),
+    "index": (IndexDailyData, IndexPeriodBar, IndexInfo),
+}
+# 每批处理的代码数
+BATCH_SIZE = 200
+
+
+def aggregate_period_bars(daily: pd.DataFrame, frequency: str) -> pd.DataFrame:
+    """
+    将多个代码的日线聚合为指定周期的K线
+
+    参数:
+    - daily: symbol, date, open, close, high, low, volume, amount 列的日线数据
+    - frequency: FREQUENCIES 中的周期代码
+
+    返回:
+    - symbol, frequency, period_start, date, open, close, high, low, volume, amount 列的K线
+    """
+    daily = daily.sort_values(["symbol", "date"])
+    period_start = pd.to_datetime(daily["date"]).dt.to_period(FREQUENCIES[frequency]).dt.start_time.dt.date
+    bars = daily.assign(period_start=period_start).groupby(["symbol", "period_start"], sort=False).agg(
+        date=("date", "max"),
+        open=("open", "first"),
+        close=("close", "last"),
+        high=("high", "max"),
+        low=("low", "min"),
+        volume=("volume", "sum"),
+        amount=("amount", "sum"),
+    ).reset_index()
+    bars.insert(1, "frequency", frequency)
+    return bars
+
+
+def _latest_period_starts(db: Session, bar_model, symbols: List[str]) -> Dict[str, Dict[str, object]]:
+    """查询每个代码各周期已保存的最后一根K线的周期开始日期"""
+    rows = db.query(bar_model.symbol, bar_model.frequency, func.max(bar_model.period_start)).filter(
+        bar_model.symbol.in_(symbols)
+    ).group_by(bar_model.symbol, bar_model.frequency).all()
+    latest = {}
+    for symbol, frequency, period_start in rows:
+        latest.setdefault(symbol, {})[frequency] = period_start
+    return latest
+
+
+def _save_bars(db: Session, bar_model, bars: pd.DataFrame):
+    if bars.empty:
+        return
+    bars = bars.copy()
+    for column in ("volume", "amount"):
+        bars[column] = bars[column].round().astype("Int64")
+    rows = bars.astype(object).where(bars.notna(), None).to_dict("records")
+    stmt = pg_insert(bar_model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["symbol", "frequency", "period_start"],
+        set_={column: getattr(stmt.excluded, column) for column in ("date", "open", "close", "high", "low", "volume", "amount")}
+    )
+    db.execute(stmt, rows)
+
+
+def update_period_bars(source: str = "stock", symbols: List[str] = None, rebuild: bool = False):
+    """
+    增量更新周线、月线、季线
+
+    每个代码从各周期已保存的最后一根K线（可能尚未结束的当前周期）开始重新聚合，更早的K线不再变化；
+    没有K线或rebuild为True时聚合全部历史
+
+    参数:
+    - source: BAR_SOURCES 中的数据源，stock 或 index
+    - symbols: 只更新这些代码，默认为代码列表中的全部
+    - rebuild: 重新聚合全部历史（修正了历史日线数据后使用）
+    """
+    daily_model, bar_model, info_model = BAR_SOURCES[source]
+    start_time = time.time()
+    db = SessionLocal()
+    try:
+        if symbols is None:
+            symbols = [symbol for symbol, in db.query(info_model.symbol).all()]
+        written_bars = 0
+
+        for batch_start in range(0, len(symbols), BATCH_SIZE):
+            batch = symbols[batch_start:batch_start + BATCH_SIZE]
+            latest = {} if rebuild else _latest_period_starts(db, bar_model, batch)
+            # 各周期都有K线的代码从各周期最后一根K线中最早的开始日期读取
+            resume_from = {symbol: min(starts.values()) for symbol, starts in latest.items() if len(starts) == len(FREQUENCIES)}
+
+            query = db.query(
+                daily_model.symbol, daily_model.date, daily_model.open, daily_model.close,
+                daily_model.high, daily_model.low, daily_model.volume, daily_model.amount
+            ).filter(daily_model.symbol.in_(batch))
+            if len(resume_from) == len(batch):
+                query = query.filter(daily_model.date >= min(resume_from.values()))
+            daily = pd.DataFrame(query.all(), columns=["symbol", "date", "open", "close", "high", "low", "volume", "amount"])
+            if daily.empty:
+                continue
+            if resume_from:
+                daily = daily[daily["date"] >= daily["symbol"].map(resume_from).fillna(daily["date"].min())]
+
+            for frequency in FREQUENCIES:
+                bars = aggregate_period_bars(daily, frequency)
+                # 只保留各代码该周期最后一根已保存K线及之后的K线，更早的周期可能因为数据截断而不完整
+                keep_from = bars["symbol"].map({symbol: starts.get(frequency, date.min) for symbol, starts in latest.items()}).fillna(date.min)
+                bars = bars[bars["period_start"] >= keep_from]
+                _save_bars(db, bar_model, bars)
+                written_bars += len(bars)
+            db.commit()
+
+        elapsed_time = time.time() - start_time
+        logger.info(f"{source} 周期K线更新完成: {len(symbols)} 个代码, 写入 {written_bars} 根K线, 耗时 {elapsed_time:.2f} 秒")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"{source} 周期K线更新失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="由日线聚合周线、月线、季线")
+    parser.add_argument("source", choices=list(BAR_SOURCES), help="数据源")
+    parser.add_argument("symbols", nargs="*", help="只更新这些代码，默认为全部")
+    parser.add_argument("--rebuild", action="store_true", help="重新聚合全部历史")
+    args = parser.parse_args()
+    update_period_bars(args.source, symbols=args.symbols or None, rebuild=args.rebuild)
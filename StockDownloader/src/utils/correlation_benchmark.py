@@ -0,0 +1,242 @@
+# src/utils/correlation_benchmark.py
+"""
+此模块提供股票指数相关度计算的基准测试。
+在独立的基准数据库中生成指定规模的合成 derived_stock / derived_index 数据，
+依次运行各计算引擎和进程数组合，核对最佳指数是否一致，并报告耗时、峰值内存和扫描行数。
+用于评估硬件规模，以及在算法修改后发现性能退化。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import argparse
+import logging
+import multiprocessing
+import resource
+import time
+from queue import Empty
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, insert, func
+
+from StockDownloader.src.core.config import config
+from StockDownloader.src.database.session import SessionLocal
+from StockDownloader.src.database.models.derived import DerivedStock, DerivedIndex
+from StockDownloader.src.database.models.info import StockInfo
+from StockDownloader.src.database.models.correlation import StockIndexCorrelation
+from StockDownloader.src.utils import correlation_calculator
+
+# 基准测试只在控制台输出结果
+logger = logging.getLogger("correlation_benchmark")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# 基准数据库中会被清空重建的表
+BENCHMARK_TABLES = [DerivedStock, DerivedIndex, StockInfo, StockIndexCorrelation]
+# 等待子进程结果时检查其是否仍在运行的间隔（秒）
+CASE_POLL_SECONDS = 5
+# 批量写入合成数据时每批的行数
+INSERT_BATCH_SIZE = 10000
+
+
+def generate_synthetic_panel(stocks: int, indices: int, years: List[int], missing_ratio: float, seed: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    生成合成的股票和指数涨跌幅面板
+    每个指数是一个独立的随机序列，每只股票跟随一个指数并叠加噪声，使最佳指数有确定的答案
+
+    返回:
+    - 股票面板 (symbol, date, real_change)
+    - 指数面板 (symbol, date, real_change)
+    每个面板按missing_ratio随机丢弃记录，模拟停牌和缺失数据
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(f"{min(years)}-01-01", f"{max(years)}-12-31")
+    dates = dates[dates.year.isin(years)].date
+
+    index_symbols = [f"{i:06d}" for i in range(indices)]
+    stock_symbols = [f"sh{600000 + i}" for i in range(stocks)]
+    index_values = rng.normal(0, 1.5, size=(len(dates), indices))
+    followed = rng.integers(0, indices, size=stocks)
+    stock_values = index_values[:, followed] * rng.uniform(0.6, 1.4, size=stocks) + rng.normal(0, 1.0, size=(len(dates), stocks))
+
+    def to_panel(symbols, values):
+        panel = pd.DataFrame({
+            "symbol": np.tile(symbols, len(dates)),
+            "date": np.repeat(dates, len(symbols)),
+            "real_change": np.round(values.ravel(), 2),
+        })
+        return panel[rng.random(len(panel)) >= missing_ratio]
+
+    return to_panel(stock_symbols, stock_values), to_panel(index_symbols, index_values)
+
+
+def load_benchmark_database(engine, stock_panel: pd.DataFrame, index_panel: pd.DataFrame):
+    """清空基准数据库中的相关表并写入合成面板"""
+    for model in BENCHMARK_TABLES:
+        model.__table__.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        for model in BENCHMARK_TABLES:
+            connection.execute(model.__table__.delete())
+        connection.execute(insert(StockInfo), [{"symbol": symbol, "name": symbol} for symbol in stock_panel["symbol"].unique()])
+        for model, panel in ((DerivedIndex, index_panel), (DerivedStock, stock_panel)):
+            records = panel.to_dict("records")
+            for start in range(0, len(records), INSERT_BATCH_SIZE):
+                connection.execute(insert(model), records[start:start + INSERT_BATCH_SIZE])
+
+
+def _winners(years: List[int]) -> Dict[Tuple[str, int], str]:
+    """读取每只股票每年排名第一的指数"""
+    db = SessionLocal()
+    try:
+        rows = db.query(StockIndexCorrelation.symbol, StockIndexCorrelation.year, StockIndexCorrelation.index_symbol).filter(
+            StockIndexCorrelation.year.in_(years),
+            StockIndexCorrelation.rank == 1
+        ).all()
+        return {(symbol, year): index_symbol for symbol, year, index_symbol in rows}
+    finally:
+        db.close()
+
+
+def _rows_scanned(years: List[int]) -> int:
+    """计算引擎需要读取的 derived_stock 和 derived_index 行数"""
+    db = SessionLocal()
+    try:
+        total = 0
+        for model in (DerivedStock, DerivedIndex):
+            total += db.query(func.count()).select_from(model).filter(
+                model.date >= f"{min(years)}-01-01",
+                model.date <= f"{max(years)}-12-31",
+                model.real_change.isnot(None)
+            ).scalar()
+        return total
+    finally:
+        db.close()
+
+
+def _run_case(database_url: str, engine_name: str, workers: int, years: List[int], queue):
+    """
+    在独立子进程中运行一个引擎组合，使峰值内存互不影响
+    峰值内存为该子进程与其进程池子进程中的最大值（Linux下单位为KB）
+    子进程自行把 SessionLocal 绑定到基准数据库：spawn/forkserver 方式启动时会重新导入 session 模块，
+    继承的绑定会指向 config.DATABASE_URL
+    向队列写入 ("ok", 耗时, 峰值内存, 最佳指数) 或 ("error", 错误信息)
+    """
+    engine = create_engine(database_url)
+    SessionLocal.configure(bind=engine)
+    try:
+        start_time = time.time()
+        if engine_name == "sql":
+            correlation_calculator.update_stock_index_correlation_in_database(years=years)
+        else:
+            correlation_calculator.update_stock_index_correlation(years=years, max_workers=workers, prune=engine_name == "prune")
+        elapsed = time.time() - start_time
+        peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        queue.put(("ok", elapsed, peak_rss, _winners(years)))
+    except Exception as e:
+        queue.put(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        engine.dispose()
+
+
+def _wait_case(process, queue) -> Tuple:
+    """等待子进程的结果；子进程没有写入结果就退出（如被系统终止）时返回错误"""
+    while True:
+        try:
+            return queue.get(timeout=CASE_POLL_SECONDS)
+        except Empty:
+            if not process.is_alive():
+                # 子进程可能在退出前刚写入结果
+                try:
+                    return queue.get(timeout=1)
+                except Empty:
+                    return ("error", f"子进程退出且没有返回结果，退出码 {process.exitcode}")
+
+
+def run_benchmark(database_url: str, stocks: int, indices: int, years: List[int], missing_ratio: float, engines: List[str], workers: List[int], seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    生成合成数据并依次运行各引擎和进程数组合
+
+    参数:
+    - database_url: 基准数据库连接串，不能与 config.DATABASE_URL 相同，其中的相关表会被清空
+    - engines: python（默认引擎）、sql（数据库内计算）、prune（候选剪枝，结果允许与全量不同）
+    - workers: python 和 prune 引擎使用的进程数列表，sql 引擎只运行一次
+
+    返回:
+    - 每个组合一条结果，包含耗时、峰值内存、扫描行数和与第一个成功组合的最佳指数一致率；运行失败的组合只包含 error
+    """
+    if database_url == config.DATABASE_URL:
+        raise ValueError("基准测试会清空数据表，不能使用生产数据库")
+
+    engine = create_engine(database_url)
+    SessionLocal.configure(bind=engine)
+
+    generate_start = time.time()
+    stock_panel, index_panel = generate_synthetic_panel(stocks, indices, years, missing_ratio, seed)
+    load_benchmark_database(engine, stock_panel, index_panel)
+    rows_scanned = _rows_scanned(years)
+    logger.info(f"合成数据: {stocks} 只股票, {indices} 个指数, 年份 {years}, 缺失比例 {missing_ratio}, "
+                f"共 {rows_scanned} 行, 生成耗时 {time.time() - generate_start:.1f} 秒")
+
+    # prune 引擎依赖上一年的排名，第一个年份总是全量扫描
+    cases = []
+    for engine_name in engines:
+        for worker_count in ([1] if engine_name == "sql" else workers):
+            cases.append((engine_name, worker_count))
+
+    # 子进程使用自己的连接，不继承父进程连接池中的连接
+    engine.dispose()
+    results = []
+    baseline = None
+    for engine_name, worker_count in cases:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_case, args=(database_url, engine_name, worker_count, years, queue))
+        process.start()
+        outcome = _wait_case(process, queue)
+        process.join()
+        if outcome[0] == "error":
+            results.append({"engine": engine_name, "workers": worker_count, "error": outcome[1]})
+            logger.error(f"{engine_name} 引擎 {worker_count} 进程运行失败: {outcome[1]}")
+            continue
+        _, elapsed, peak_rss, winners = outcome
+
+        if baseline is None:
+            baseline, baseline_name = winners, engine_name
+        matched = sum(1 for key, index_symbol in winners.items() if baseline.get(key) == index_symbol)
+        agreement = matched / len(baseline) if baseline else 1.0
+        result = {
+            "engine": engine_name,
+            "workers": worker_count,
+            "seconds": elapsed,
+            "peak_rss_mb": peak_rss / 1024,
+            "rows_scanned": rows_scanned,
+            "rows_per_second": rows_scanned / elapsed if elapsed else 0,
+            "agreement": agreement,
+        }
+        results.append(result)
+        logger.info("{engine:>7} {workers:>4} 进程  耗时 {seconds:8.2f} 秒  峰值内存 {peak_rss_mb:8.1f} MB  "
+                    "扫描 {rows_scanned} 行 ({rows_per_second:,.0f} 行/秒)  最佳指数一致率 {agreement:.2%}".format(**result))
+        if engine_name != "prune" and agreement < 1.0:
+            logger.warning(f"{engine_name} 引擎 {worker_count} 进程的最佳指数与 {baseline_name} 引擎不一致")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="股票指数相关度计算基准测试")
+    parser.add_argument("database_url", help="基准数据库连接串（其中的相关表会被清空）")
+    parser.add_argument("--stocks", type=int, default=500, help="合成股票数量")
+    parser.add_argument("--indices", type=int, default=50, help="合成指数数量")
+    parser.add_argument("--years", type=int, nargs="+", default=[2023, 2024], help="合成数据的年份")
+    parser.add_argument("--missing-ratio", type=float, default=0.05, help="随机丢弃记录的比例")
+    parser.add_argument("--engines", nargs="+", choices=("python", "sql", "prune"), default=["python", "sql"], help="参与测试的引擎")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="python 引擎的进程数列表")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    args = parser.parse_args()
+
+    # 基准测试只关心汇总结果，关闭计算过程中的控制台进度输出
+    logging.getLogger("correlation_console").setLevel(logging.WARNING)
+    run_benchmark(args.database_url, args.stocks, args.indices, args.years, args.missing_ratio, args.engines, args.workers, seed=args.seed)
@@ -1,16 +1,25 @@
 import pandas as pd
+import numpy as np
+from sqlalchemy import inspect, text, bindparam
 from sqlalchemy.orm import Session
-from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import date, datetime, timedelta
+import bisect
+import zlib
 from typing import Dict, List, Tuple, Any
+from multiprocessing import shared_memory
 import multiprocessing
 import os
 import time
-import math
 import logging
 
 from StockDownloader.src.database.session import SessionLocal
 from StockDownloader.src.database.models.derived import DerivedStock, DerivedIndex
+from StockDownloader.src.database.models.etf import ETFDailyData
 from StockDownloader.src.database.models.info import StockInfo
+from StockDownloader.src.database.models.correlation import StockIndexCorrelation, StockIndexRollingCorrelation, UniverseCorrelation
+from StockDownloader.src.utils.correlation_metrics import METRICS, compute_affinity_metrics
+from StockDownloader.src.core.config import config
 from StockDownloader.src.core.logger import get_logger
 
 # 创建专门的日志记录器
@@ -27,6 +36,214 @@ if not console_logger.handlers:
     # 移除父记录器的处理程序，避免日志重复
     console_logger.propagate = False
 
+# 当前进程可用的指数矩阵: {年份或ROLLING_MATRIX_KEY: (指数代码列表, 交易日×指数 的real_change矩阵)}
+# 多进程运行时由进程池初始化函数从共享内存挂载，单进程运行时直接赋值
+_index_matrices: Dict[Any, Tuple[List[str], np.ndarray]] = {}
+# 进程池的启动方式：计算可能在其他线程（DAG节点、网页端任务）仍在运行时发起，
+# 在多线程进程中 fork 的子进程可能继承被其他线程持有的日志或连接池锁而死锁，
+# 因此子进程从 forkserver（不支持时为 spawn）启动，指数矩阵通过共享内存按名称挂载
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+# 滚动窗口模式下指数矩阵在 _index_matrices 中的键
+ROLLING_MATRIX_KEY = "rolling"
+# 滚动窗口模式的默认窗口长度（交易日）
+ROLLING_WINDOWS = [60, 120, 250]
+# 可参与相关度计算的证券池: {名称: (模型, 涨跌幅列名)}，涨跌幅均以百分比计
+UNIVERSES = {
+    "stock": (DerivedStock, "real_change"),
+    "index": (DerivedIndex, "real_change"),
+    "etf": (ETFDailyData, "change_rate"),
+}
+# 子进程挂载的共享内存句柄，需要保持引用，否则矩阵视图会失效
+_attached_shm: List[shared_memory.SharedMemory] = []
+
+
+def _query_universe(universe: str, start_date: date, end_date: date, db: Session, symbols: List[str] = None) -> List[Tuple[str, Any, float]]:
+    """查询一个证券池在日期区间内的 (代码, 日期, 涨跌幅) 记录，证券池定义见 UNIVERSES"""
+    if universe not in UNIVERSES:
+        raise ValueError(f"未知的证券池: {universe}，可选: {', '.join(UNIVERSES)}")
+    model, column = UNIVERSES[universe]
+    value = getattr(model, column)
+    query = db.query(model.symbol, model.date, value).filter(
+        model.date >= start_date,
+        model.date <= end_date,
+        value.isnot(None)
+    )
+    if symbols is not None:
+        query = query.filter(model.symbol.in_(symbols))
+    return query.all()
+
+
+def load_universe_matrix_between(universe: str, start_date: date, end_date: date, db: Session) -> Tuple[List[Any], List[str], np.ndarray]:
+    """
+    一次性加载日期区间内证券池所有代码的涨跌幅，组织成 交易日×代码 的矩阵
+
+    返回值：
+    - 交易日列表（升序）
+    - 代码列表（升序）
+    - 涨跌幅矩阵，缺失值为NaN
+    """
+    rows = _query_universe(universe, start_date, end_date, db)
+
+    if not rows:
+        return [], [], np.empty((0, 0), dtype=np.float64)
+
+    df = pd.DataFrame(rows, columns=["symbol", "date", "real_change"])
+    matrix = df.pivot(index="date", columns="symbol", values="real_change").sort_index().sort_index(axis=1)
+    return list(matrix.index), list(matrix.columns), np.ascontiguousarray(matrix.to_numpy(dtype=np.float64))
+
+
+def load_index_matrix_between(start_date: date, end_date: date, db: Session) -> Tuple[List[Any], List[str], np.ndarray]:
+    """
+    一次性加载日期区间内所有指数的real_change，组织成 交易日×指数 的矩阵，返回值同 load_universe_matrix_between
+    """
+    return load_universe_matrix_between("index", start_date, end_date, db)
+
+
+def load_index_matrix(year: int, db: Session) -> Tuple[List[Any], List[str], np.ndarray]:
+    """
+    一次性加载指定年份所有指数的real_change，返回值同 load_index_matrix_between
+    """
+    return load_index_matrix_between(date(year, 1, 1), date(year, 12, 31), db)
+
+
+def load_universe_arrays_between(universe: str, start_date: date, end_date: date, dates: List[Any], db: Session, symbols: List[str] = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    一次性加载日期区间内证券池的涨跌幅，按代码拆分成紧凑数组
+
+    参数:
+    - dates: 比较对象矩阵的交易日列表，日期会映射为该列表中的行号
+    - symbols: 只加载这些代码，默认为全部
+
+    返回:
+    - {代码: (矩阵行号数组, 涨跌幅数组)}，矩阵中没有数据的交易日被丢弃
+    """
+    if not dates:
+        return {}
+
+    rows = _query_universe(universe, start_date, end_date, db, symbols=symbols)
+
+    if not rows:
+        return {}
+
+    df = pd.DataFrame(rows, columns=["symbol", "date", "real_change"])
+    date_positions = {d: i for i, d in enumerate(dates)}
+    df["position"] = df["date"].map(date_positions)
+    df = df.dropna(subset=["position"]).sort_values(["symbol", "position"])
+
+    stock_arrays = {}
+    for symbol, group in df.groupby("symbol", sort=False):
+        stock_arrays[symbol] = (
+            group["position"].to_numpy(dtype=np.int32),
+            group["real_change"].to_numpy(dtype=np.float64)
+        )
+    return stock_arrays
+
+
+def load_stock_arrays_between(start_date: date, end_date: date, dates: List[Any], db: Session, symbols: List[str] = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    一次性加载日期区间内股票的real_change，按股票拆分成紧凑数组，返回值同 load_universe_arrays_between
+    """
+    return load_universe_arrays_between("stock", start_date, end_date, dates, db, symbols=symbols)
+
+
+def load_stock_arrays(year: int, dates: List[Any], db: Session, symbols: List[str] = None, start_date: date = None) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    一次性加载指定年份股票的real_change，返回值同 load_stock_arrays_between
+
+    参数:
+    - start_date: 只加载该日期及之后的数据，默认为年初
+    """
+    start_date = max(start_date, date(year, 1, 1)) if start_date else date(year, 1, 1)
+    return load_stock_arrays_between(start_date, date(year, 12, 31), dates, db, symbols=symbols)
+
+
+def _competition_rank(differences: np.ndarray) -> np.ndarray:
+    """
+    对每一行的差值做并列排名（差值最小得1分，相同差值得相同分数，下一个差值的分数为其位置+1）
+    NaN表示当天该指数没有数据，得0分
+    """
+    if differences.size == 0:
+        return np.zeros(differences.shape, dtype=np.int64)
+
+    order = np.argsort(differences, axis=1, kind="stable")  # NaN排在最后
+    sorted_diffs = np.take_along_axis(differences, order, axis=1)
+
+    columns = np.arange(differences.shape[1])
+    is_new_value = np.ones(sorted_diffs.shape, dtype=bool)
+    is_new_value[:, 1:] = sorted_diffs[:, 1:] != sorted_diffs[:, :-1]
+    first_positions = np.maximum.accumulate(np.where(is_new_value, columns, 0), axis=1)
+
+    sorted_ranks = first_positions.astype(np.int64) + 1
+    sorted_ranks[np.isnan(sorted_diffs)] = 0
+
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=1)
+    return ranks
+
+
+def score_stock_days(index_matrix: np.ndarray, positions: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算一只股票在给定交易日上与各指数的累计得分和有效交易日数
+
+    参数:
+    - index_matrix: 交易日×指数 的real_change矩阵
+    - positions: 股票交易日在指数矩阵中的行号
+    - values: 股票对应交易日的real_change
+
+    返回:
+    - 各指数的累计得分数组
+    - 各指数的有效交易日数数组
+    """
+    differences = np.abs(index_matrix[positions] - values[:, None])
+    ranks = _competition_rank(differences)
+    return ranks.sum(axis=0), (~np.isnan(differences)).sum(axis=0)
+
+
+def _pick_best_index(index_symbols: List[str], scores: np.ndarray, valid_days: np.ndarray) -> str:
+    """返回平均得分最低的指数代码，没有有效交易日时返回None"""
+    has_data = valid_days > 0
+    if not has_data.any():
+        return None
+    avg_scores = np.full(len(index_symbols), np.inf)
+    avg_scores[has_data] = scores[has_data] / valid_days[has_data]
+    return index_symbols[int(np.argmin(avg_scores))]
+
+
+def rolling_window_scores(index_matrix: np.ndarray, positions: np.ndarray, values: np.ndarray, windows: List[int], output_positions: np.ndarray) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    计算一只股票在若干输出日上、多个滚动窗口内与各指数的累计得分和有效交易日数
+
+    每日排名矩阵只计算一次，再对其做前缀和；任一窗口在任一输出日的得分都是两行前缀和之差，
+    因此每增加一个窗口长度，每只股票每个输出日只多一次O(指数数)的减法
+
+    参数:
+    - index_matrix: 交易日×指数 的real_change矩阵
+    - positions: 股票交易日在指数矩阵中的行号（升序）
+    - values: 股票对应交易日的real_change
+    - windows: 窗口长度列表（按指数矩阵的交易日计）
+    - output_positions: 需要输出结果的交易日行号
+
+    返回:
+    - {窗口长度: (累计得分矩阵 输出日×指数, 有效交易日数矩阵 输出日×指数)}
+    """
+    differences = np.abs(index_matrix[positions] - values[:, None])
+    index_count = index_matrix.shape[1]
+
+    cumulative_ranks = np.zeros((len(positions) + 1, index_count), dtype=np.int64)
+    np.cumsum(_competition_rank(differences), axis=0, out=cumulative_ranks[1:])
+    cumulative_valid_days = np.zeros((len(positions) + 1, index_count), dtype=np.int64)
+    np.cumsum(~np.isnan(differences), axis=0, out=cumulative_valid_days[1:])
+
+    ends = np.searchsorted(positions, output_positions, side="right")
+    window_scores = {}
+    for window in windows:
+        starts = np.searchsorted(positions, output_positions - window + 1, side="left")
+        window_scores[window] = (
+            cumulative_ranks[ends] - cumulative_ranks[starts],
+            cumulative_valid_days[ends] - cumulative_valid_days[starts]
+        )
+    return window_scores
+
 
 def calculate_correlation_for_stock(stock_symbol: str, year: int, db: Session) -> Tuple[str, Dict[str, int], Dict[str, int]]:
     """
@@ -43,185 +260,640 @@ def calculate_correlation_for_stock(stock_symbol: str, year: int, db: Session) -
     - 所有指数的得分字典
     - 所有指数的有效交易日数字典
     """
-    # 获取指定年份的开始和结束日期
-    start_date = datetime(year, 1, 1)
-    end_date = datetime(year, 12, 31)
-    
-    # 获取股票在指定年份的所有交易日数据
-    stock_data = db.query(DerivedStock).filter(
-        DerivedStock.symbol == stock_symbol,
-        DerivedStock.date >= start_date,
-        DerivedStock.date <= end_date
-    ).all()
-    
-    if not stock_data:
-        file_logger.warning(f"没有找到股票 {stock_symbol} 在 {year} 年的数据")
-        return None, {}, {}
-    
-    # 获取所有股票交易日期
-    stock_dates = [data.date for data in stock_data]
-    
-    # 创建股票日期到real_change的映射，只保留有效的real_change值
-    stock_changes = {}
-    for data in stock_data:
-        if data.real_change is not None:
-            stock_changes[data.date] = data.real_change
-    
-    if not stock_changes:
-        file_logger.warning(f"股票 {stock_symbol} 在 {year} 年没有有效的real_change数据")
-        return None, {}, {}
-    
-    # 获取所有指数代码
-    index_symbols = db.query(DerivedIndex.symbol).distinct().all()
-    index_symbols = [symbol[0] for symbol in index_symbols]
-    
+    dates, index_symbols, index_matrix = load_index_matrix(year, db)
     if not index_symbols:
         file_logger.warning("没有找到任何指数数据")
         return None, {}, {}
-    
-    # 初始化指数得分和有效交易日计数
-    index_scores = {symbol: 0 for symbol in index_symbols}
-    index_valid_days = {symbol: 0 for symbol in index_symbols}
-    
-    # 对每个交易日计算相关度得分
-    for date in stock_changes.keys():  # 只遍历有效的股票交易日
-        # 获取当天所有指数的real_change
-        index_changes = db.query(DerivedIndex).filter(
-            DerivedIndex.date == date
-        ).all()
-        
-        # 计算差值并排序，只考虑有有效real_change的指数
-        differences = []
-        valid_indices = set()  # 记录当天有有效数据的指数
-        
-        for idx in index_changes:
-            if idx.real_change is not None:
-                diff = abs(idx.real_change - stock_changes[date])
-                differences.append((idx.symbol, diff))
-                valid_indices.add(idx.symbol)
-        
-        # 如果当天没有有效的指数数据，跳过这一天
-        if not differences:
-            continue
-        
-        # 按差值排序
-        differences.sort(key=lambda x: x[1])
-        
-        # 分配得分（相同差值得相同分数）
-        current_score = 1
-        prev_diff = None
-        for i, (symbol, diff) in enumerate(differences):
-            if prev_diff is not None and diff != prev_diff:
-                current_score = i + 1
-            index_scores[symbol] += current_score
-            index_valid_days[symbol] += 1  # 记录该指数有效的交易日数
-            prev_diff = diff
-    
-    # 过滤掉没有足够有效交易日的指数
-    valid_indices = {}
-    for symbol, score in index_scores.items():
-        if index_valid_days[symbol] > 0:
-            # 计算平均得分（总得分除以有效交易日数）
-            avg_score = score / index_valid_days[symbol]
-            valid_indices[symbol] = avg_score
-    
-    if not valid_indices:
+
+    stock_arrays = load_stock_arrays(year, dates, db, symbols=[stock_symbol])
+    if stock_symbol not in stock_arrays:
+        file_logger.warning(f"没有找到股票 {stock_symbol} 在 {year} 年与指数有共同交易日的数据")
+        return None, {}, {}
+
+    positions, values = stock_arrays[stock_symbol]
+    scores, valid_days = score_stock_days(index_matrix, positions, values)
+    best_index = _pick_best_index(index_symbols, scores, valid_days)
+
+    if not best_index:
         file_logger.warning(f"没有找到与股票 {stock_symbol} 在 {year} 年有共同交易日的指数")
         return None, {}, {}
-    
-    # 找出平均得分最低的指数
-    best_index = min(valid_indices.items(), key=lambda x: x[1])[0] if valid_indices else None
-    
+
     file_logger.debug(f"股票 {stock_symbol} 在 {year} 年最相关指数: {best_index}")
-    return best_index, index_scores, index_valid_days
+    return best_index, dict(zip(index_symbols, scores.tolist())), dict(zip(index_symbols, valid_days.tolist()))
+
+
+def load_correlation_state(year: int, db: Session, symbols: List[str] = None) -> Dict[str, Tuple[Dict[str, Tuple[int, int]], date]]:
+    """
+    读取指定年份已持久化的相关度累计值
+
+    返回:
+    - {股票代码: ({指数代码: (累计得分, 有效交易日数)}, 已累计到的最后交易日)}
+    """
+    query = db.query(
+        StockIndexCorrelation.symbol,
+        StockIndexCorrelation.index_symbol,
+        StockIndexCorrelation.score_sum,
+        StockIndexCorrelation.valid_days,
+        StockIndexCorrelation.last_date
+    ).filter(
+        StockIndexCorrelation.year == year,
+        # 只有相关性系数、尚未计算排名得分的记录没有累计值
+        StockIndexCorrelation.last_date.isnot(None)
+    )
+    if symbols is not None:
+        query = query.filter(StockIndexCorrelation.symbol.in_(symbols))
+
+    state = {}
+    for symbol, index_symbol, score_sum, valid_days, last_date in query.all():
+        accumulators, _ = state.setdefault(symbol, ({}, last_date))
+        accumulators[index_symbol] = (score_sum, valid_days)
+    return state
+
+
+def build_result_rows(symbol: str, year: int, index_symbols: List[str], scores: np.ndarray, valid_days: np.ndarray, last_date: date) -> List[Dict[str, Any]]:
+    """
+    将一只股票一年的得分向量转换为 stock_index_correlation 表的记录
+
+    平均得分越低排名越靠前，平均得分相同时按指数代码顺序排名；
+    没有有效交易日的指数不参与排名，也不生成记录，与数据库内计算写入的记录相同
+    """
+    has_data = valid_days > 0
+    avg_scores = np.full(len(index_symbols), np.inf)
+    avg_scores[has_data] = scores[has_data] / valid_days[has_data]
+    ranks = np.empty(len(index_symbols), dtype=np.int64)
+    ranks[np.argsort(avg_scores, kind="stable")] = np.arange(1, len(index_symbols) + 1)
+
+    rows = []
+    for i in np.flatnonzero(has_data):
+        rows.append({
+            "symbol": symbol,
+            "year": year,
+            "index_symbol": index_symbols[i],
+            "score_sum": int(scores[i]),
+            "valid_days": int(valid_days[i]),
+            "score": float(avg_scores[i]),
+            "rank": int(ranks[i]),
+            "last_date": last_date,
+        })
+    return rows
+
+
+def save_correlation_results(rows: List[Dict[str, Any]], db: Session, replace_years: List[int] = (), symbols: List[str] = None):
+    """
+    将本次计算的所有结果用一条批量upsert写入 stock_index_correlation 表
+
+    参数:
+    - rows: build_result_rows 生成的记录
+    - replace_years: 全量重算的年份，写入前先清空这些年份（或指定股票在这些年份）的旧累计值和排名，
+      同一记录上的相关性系数保留
+    """
+    if replace_years:
+        query = db.query(StockIndexCorrelation).filter(StockIndexCorrelation.year.in_(list(replace_years)))
+        if symbols is not None:
+            query = query.filter(StockIndexCorrelation.symbol.in_(symbols))
+        query.update({
+            StockIndexCorrelation.score_sum: 0,
+            StockIndexCorrelation.valid_days: 0,
+            StockIndexCorrelation.score: None,
+            StockIndexCorrelation.rank: None,
+            StockIndexCorrelation.last_date: None,
+        }, synchronize_session=False)
+
+    if not rows:
+        return
+
+    stmt = pg_insert(StockIndexCorrelation)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["symbol", "year", "index_symbol"],
+        set_={
+            "score_sum": stmt.excluded.score_sum,
+            "valid_days": stmt.excluded.valid_days,
+            "score": stmt.excluded.score,
+            "rank": stmt.excluded.rank,
+            "last_date": stmt.excluded.last_date,
+        }
+    )
+    db.execute(stmt, rows)
+
+
+def build_stock_matrix(stock_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]], symbols: List[str], date_count: int) -> np.ndarray:
+    """将各股票的(行号数组, real_change数组)展开为 股票×交易日 的矩阵，缺失为NaN"""
+    stock_matrix = np.full((len(symbols), date_count), np.nan)
+    for i, symbol in enumerate(symbols):
+        positions, values = stock_arrays[symbol]
+        stock_matrix[i, positions] = values
+    return stock_matrix
+
+
+def save_metric_results(rows: List[Dict[str, Any]], db: Session, metrics: List[str]):
+    """
+    将相关性系数用一条批量upsert写入 stock_index_correlation 表
+    只更新本次计算的系数列和共同交易日数，排名得分相关的列保持不变
+    """
+    if not rows:
+        return
+    stmt = pg_insert(StockIndexCorrelation)
+    set_ = {metric: getattr(stmt.excluded, metric) for metric in metrics}
+    set_["metric_days"] = stmt.excluded.metric_days
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["symbol", "year", "index_symbol"],
+        set_=set_
+    )
+    db.execute(stmt, rows)
 
 
-def process_stock_batch(batch_data: List[Tuple[Any, List[int], bool]]) -> List[Tuple[str, str, int, str]]:
+def derive_stock_info_indices(years: List[int], db: Session, symbols: List[str] = None):
     """
-    处理一批股票的相关度计算
+    根据 stock_index_correlation 中排名第一的记录，用一条UPDATE语句刷新 stock_info 对应年份的所属指数列
+    stock_info 中不存在的年份列会被跳过（结果仍保存在 stock_index_correlation 中）
+    """
+    existing_columns = {column["name"] for column in inspect(db.get_bind()).get_columns(StockInfo.__tablename__)}
+    for year in years:
+        column = f"index_{year}"
+        if column not in existing_columns:
+            file_logger.warning(f"stock_info 表中没有 {column} 列，跳过该年份所属指数的更新")
+            continue
+
+        sql = (
+            f"UPDATE stock_info SET {column} = c.index_symbol "
+            f"FROM stock_index_correlation c "
+            f"WHERE c.symbol = stock_info.symbol AND c.year = :year AND c.rank = 1"
+        )
+        params = {"year": year}
+        if symbols is not None:
+            sql += " AND stock_info.symbol IN :symbols"
+            params["symbols"] = list(symbols)
+        statement = text(sql)
+        if symbols is not None:
+            statement = statement.bindparams(bindparam("symbols", expanding=True))
+        db.execute(statement, params)
+
+
+def get_top_indices(symbol: str, year: int, db: Session, k: int = 3) -> List[Tuple[str, float, int, int]]:
+    """
+    查询指定股票在指定年份相关度最高的k个指数，无需重新计算
+
+    返回:
+    - [(指数代码, 平均得分, 有效交易日数, 排名)]，按排名升序
+    """
+    rows = db.query(
+        StockIndexCorrelation.index_symbol,
+        StockIndexCorrelation.score,
+        StockIndexCorrelation.valid_days,
+        StockIndexCorrelation.rank
+    ).filter(
+        StockIndexCorrelation.symbol == symbol,
+        StockIndexCorrelation.year == year,
+        StockIndexCorrelation.rank <= k
+    ).order_by(StockIndexCorrelation.rank).all()
+    return [tuple(row) for row in rows]
+
+
+def _publish_index_matrices(index_matrices: Dict[Any, Tuple[List[str], np.ndarray]]) -> Tuple[List[shared_memory.SharedMemory], Dict[Any, Tuple[List[str], str, Tuple[int, int]]]]:
+    """
+    将各指数矩阵复制到共享内存，供子进程零拷贝挂载
+
+    返回:
+    - 共享内存句柄列表（父进程负责在计算结束后释放）
+    - 挂载描述 {矩阵键: (指数代码列表, 共享内存名称, 矩阵形状)}
+    """
+    handles = []
+    specs = {}
+    try:
+        for key, (index_symbols, matrix) in index_matrices.items():
+            if matrix.size == 0:
+                continue
+            shm = shared_memory.SharedMemory(create=True, size=matrix.nbytes)
+            handles.append(shm)
+            np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)[:] = matrix
+            specs[key] = (index_symbols, shm.name, matrix.shape)
+    except Exception:
+        _release_index_matrices(handles)
+        raise
+    return handles, specs
+
+
+def _release_index_matrices(handles: List[shared_memory.SharedMemory]):
+    """关闭并删除父进程创建的共享内存"""
+    for shm in handles:
+        shm.close()
+        shm.unlink()
+
+
+def _attach_index_matrices(specs: Dict[Any, Tuple[List[str], str, Tuple[int, int]]]):
+    """
+    进程池初始化函数：按描述挂载父进程发布的共享内存指数矩阵
+    """
+    _index_matrices.clear()
+    for key, (index_symbols, shm_name, shape) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _attached_shm.append(shm)
+        _index_matrices[key] = (index_symbols, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+
+
+def select_candidate_indices(year: int, index_symbols: List[str], index_matrix: np.ndarray, year_tasks: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], db: Session, top_k: int, volatility_k: int) -> Dict[str, np.ndarray]:
+    """
+    为剪枝模式选择每只股票的候选指数（指数矩阵的列号）
+
+    候选为上一年已保存排名中的前top_k个指数，加上本年波动率与该股票最接近的volatility_k个指数；
+    上一年没有排名的股票，或候选已覆盖全部指数时不剪枝（不出现在返回值中）
+    """
+    column_of = {index_symbol: i for i, index_symbol in enumerate(index_symbols)}
+    prior_top = {}
+    query = db.query(StockIndexCorrelation.symbol, StockIndexCorrelation.index_symbol).filter(
+        StockIndexCorrelation.year == year - 1,
+        StockIndexCorrelation.rank <= top_k,
+        StockIndexCorrelation.symbol.in_(list(year_tasks))
+    )
+    for symbol, index_symbol in query.all():
+        if index_symbol in column_of:
+            prior_top.setdefault(symbol, set()).add(column_of[index_symbol])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_index_volatility = np.log(np.nanstd(index_matrix, axis=0))
+    log_index_volatility[~np.isfinite(log_index_volatility)] = np.inf
+
+    candidates = {}
+    for symbol, columns in prior_top.items():
+        values = year_tasks[symbol][1]
+        if volatility_k > 0 and len(values) > 1 and np.std(values) > 0:
+            distance = np.abs(log_index_volatility - np.log(np.std(values)))
+            columns = columns | set(np.argsort(distance, kind="stable")[:volatility_k].tolist())
+        if len(columns) < len(index_symbols):
+            candidates[symbol] = np.array(sorted(columns), dtype=np.int64)
+    return candidates
+
+
+def _score_candidates(index_matrix: np.ndarray, positions: np.ndarray, values: np.ndarray, candidates: np.ndarray, min_margin: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    只在候选指数之间计算每日排名得分，结果按指数矩阵的列对齐，非候选指数的得分和有效交易日数为0
+
+    候选内第一名的平均得分领先第二名的相对幅度小于min_margin时返回None，由调用方退回全量扫描
+    """
+    candidate_scores, candidate_valid_days = score_stock_days(index_matrix[:, candidates], positions, values)
+    has_data = candidate_valid_days > 0
+    if has_data.sum() < 2:
+        return None
+    avg_scores = np.sort(candidate_scores[has_data] / candidate_valid_days[has_data])
+    if (avg_scores[1] - avg_scores[0]) / avg_scores[0] < min_margin:
+        return None
+
+    index_scores = np.zeros(index_matrix.shape[1], dtype=np.int64)
+    index_valid_days = np.zeros(index_matrix.shape[1], dtype=np.int64)
+    index_scores[candidates] = candidate_scores
+    index_valid_days[candidates] = candidate_valid_days
+    return index_scores, index_valid_days
+
+
+def process_stock(task: Tuple[str, str, Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], List[int], bool, Dict[int, np.ndarray]]) -> List[Tuple[str, str, int, str, np.ndarray, np.ndarray, str]]:
+    """
+    处理一只股票的相关度计算，作为进程池的最小调度单位
+    指数矩阵从当前进程已挂载的 _index_matrices 中读取，不再访问数据库
     
     参数:
-    - batch_data: 包含(股票对象, 年份列表, 是否主运行)的元组列表
+    - task: (股票代码, 股票名称, {年份: (行号数组, real_change数组, 已累计得分, 已累计有效交易日数)}, 年份列表, 是否主运行, {年份: 候选指数列号数组})
+      已累计的数组与指数矩阵的列对齐，增量更新时在其基础上累加新交易日的得分；
+      有候选指数的年份只在候选之间排名，第一名领先幅度不足时退回全量扫描
+    
+    返回:
+    - 处理结果列表，每个元素为(股票代码, 股票名称, 年份, 最佳指数, 累计得分数组, 累计有效交易日数组, 扫描方式)的元组，
+      扫描方式为 "full"（全量）、"pruned"（仅候选）或 "fallback"（剪枝后退回全量）
+    """
+    symbol, name, stock_arrays, years, is_main_run, candidates = task
+    results = []
+    
+    # 详细日志写入文件
+    file_logger.info(f"处理股票: {symbol} ({name})")
     
+    for year in years:
+        if year not in stock_arrays or year not in _index_matrices:
+            file_logger.info(f"  未找到{year}年的相关指数")
+            continue
+
+        # 计算相关度最高的指数
+        index_symbols, index_matrix = _index_matrices[year]
+        positions, values, base_scores, base_valid_days = stock_arrays[year]
+        scan = "full"
+        pruned_scores = None
+        if year in candidates:
+            pruned_scores = _score_candidates(index_matrix, positions, values, candidates[year], config.CORRELATION_PRUNE_MIN_MARGIN)
+            scan = "fallback" if pruned_scores is None else "pruned"
+        if pruned_scores is not None:
+            index_scores, index_valid_days = pruned_scores
+        else:
+            index_scores, index_valid_days = score_stock_days(index_matrix, positions, values)
+        index_scores += base_scores
+        index_valid_days += base_valid_days
+        best_index = _pick_best_index(index_symbols, index_scores, index_valid_days)
+
+        if best_index:
+            # 将结果添加到返回列表
+            results.append((symbol, name, year, best_index, index_scores, index_valid_days, scan))
+            file_logger.info(f"  {year}年最相关指数: {best_index}")
+
+            # 如果是单独运行，记录所有指数的得分情况到日志文件
+            if is_main_run:
+                file_logger.info(f"\n  {year}年所有指数得分情况:")
+                file_logger.info("  " + "-"*60)
+                file_logger.info("  {:^10} {:^10} {:^15} {:^10} {:^5}".format("指数代码", "得分", "有效交易日数", "平均得分", ""))
+                file_logger.info("  " + "-"*60)
+
+                # 按平均得分排序（从低到高，低分表示相关性更高）
+                sorted_indices = []
+                for index_symbol, score, valid_days in zip(index_symbols, index_scores.tolist(), index_valid_days.tolist()):
+                    if valid_days > 0:
+                        sorted_indices.append((index_symbol, score, valid_days, score / valid_days))
+
+                # 按平均得分排序
+                sorted_indices.sort(key=lambda x: x[3])
+
+                for index_symbol, score, valid_days, avg_score in sorted_indices:
+                    # 标记最相关的指数
+                    mark = "*" if index_symbol == best_index else " "
+                    file_logger.info("  {:10} {:10d} {:15d} {:10.2f} {}".format(index_symbol, score, valid_days, avg_score, mark))
+
+                file_logger.info("  " + "-"*60)
+                file_logger.info(f"  * 表示相关度最高的指数\n")
+        else:
+            file_logger.info(f"  未找到{year}年的相关指数")
+    return results
+
+
+def process_stock_batch(batch_data: List[Tuple[str, str, Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], List[int], bool, Dict[int, np.ndarray]]]) -> List[Tuple[str, str, int, str, np.ndarray, np.ndarray, str]]:
+    """
+    依次处理一批股票的相关度计算，参数和返回值的元素格式见 process_stock
+    """
+    results = []
+    for task in batch_data:
+        results.extend(process_stock(task))
+    return results
+
+
+def _report_progress(done: int, total: int, start_time: float):
+    """在控制台输出汇总进度和预计剩余时间"""
+    elapsed = time.time() - start_time
+    eta = elapsed / done * (total - done) if done else 0
+    console_logger.info(f"处理进度: [{done}/{total}] {done / total * 100:.1f}% - 已用 {elapsed:.0f} 秒, 预计剩余 {eta:.0f} 秒")
+
+
+def _run_tasks(tasks: List[Tuple], index_matrices: Dict[Any, Tuple[List[str], np.ndarray]], max_workers: int, worker=None) -> List[Tuple]:
+    """
+    用worker（默认为 process_stock）执行所有股票的相关度计算并在父进程中汇总进度
+
+    多进程时按 CORRELATION_CHUNK_SIZE 只股票一块动态分发（imap_unordered），先完成的进程继续领取下一块，
+    避免长上市股票集中的批次拖慢尾部；每个子进程处理 CORRELATION_MAX_TASKS_PER_CHILD 块后被替换，限制内存增长
+    """
+    worker = worker or process_stock
+    total = len(tasks)
+    report_every = max(1, total // 100)
+    start_time = time.time()
+    results = []
+
+    # 如果只有一只股票或者只有一个进程，直接处理
+    if total == 1 or max_workers == 1:
+        _index_matrices.clear()
+        _index_matrices.update(index_matrices)
+        for done, task in enumerate(tasks, 1):
+            results.extend(worker(task))
+            if done % report_every == 0 or done == total:
+                _report_progress(done, total, start_time)
+        return results
+
+    # 将指数矩阵发布到共享内存，创建进程池并行处理
+    shm_handles, shm_specs = _publish_index_matrices(index_matrices)
+    try:
+        with multiprocessing.get_context(POOL_START_METHOD).Pool(
+            processes=max_workers,
+            initializer=_attach_index_matrices,
+            initargs=(shm_specs,),
+            maxtasksperchild=config.CORRELATION_MAX_TASKS_PER_CHILD or None
+        ) as pool:
+            console_logger.info(f"启动 {max_workers} 个进程, 每次分发 {config.CORRELATION_CHUNK_SIZE} 只股票")
+            for done, stock_results in enumerate(pool.imap_unordered(worker, tasks, chunksize=config.CORRELATION_CHUNK_SIZE), 1):
+                results.extend(stock_results)
+                if done % report_every == 0 or done == total:
+                    _report_progress(done, total, start_time)
+    finally:
+        _release_index_matrices(shm_handles)
+    return results
+
+
+def process_stock_rolling(task: Tuple[str, np.ndarray, np.ndarray, List[int], int]) -> List[Tuple[str, int, int, str, float, int]]:
+    """
+    计算一只股票在各输出交易日、各滚动窗口内相关度最高的指数
+    指数矩阵从当前进程已挂载的 _index_matrices[ROLLING_MATRIX_KEY] 中读取
+
+    参数:
+    - task: (股票代码, 行号数组, real_change数组, 窗口长度列表, 第一个输出交易日的行号)
+
     返回:
-    - 处理结果列表，每个元素为(股票代码, 股票名称, 年份, 最佳指数)的元组
+    - 结果列表，每个元素为(股票代码, 交易日行号, 窗口长度, 最佳指数, 平均得分, 有效交易日数)的元组
     """
+    symbol, positions, values, windows, first_output_position = task
+    index_symbols, index_matrix = _index_matrices[ROLLING_MATRIX_KEY]
+
+    output_positions = positions[positions >= first_output_position]
+    if len(output_positions) == 0:
+        return []
+
     results = []
+    for window, (scores, valid_days) in rolling_window_scores(index_matrix, positions, values, windows, output_positions).items():
+        has_data = valid_days > 0
+        avg_scores = np.full(scores.shape, np.inf)
+        avg_scores[has_data] = scores[has_data] / valid_days[has_data]
+        best_columns = np.argmin(avg_scores, axis=1)
+        for k, position in enumerate(output_positions.tolist()):
+            best_column = best_columns[k]
+            if has_data[k, best_column]:
+                results.append((symbol, position, window, index_symbols[best_column], float(avg_scores[k, best_column]), int(valid_days[k, best_column])))
+    return results
+
+
+def _resolve_max_workers(max_workers: int = None) -> int:
+    """未指定进程数时根据CPU核心数自动确定"""
+    if max_workers is None:
+        # 获取CPU逻辑处理器数量
+        cpu_count = os.cpu_count()
+        # 保留一些核心给系统使用，至少保留4个核心
+        max_workers = max(1, cpu_count - 4) if cpu_count else 1
+    return max_workers
+
+
+def _prepare_year(year: int, db: Session, stock_symbols: List[str], symbols: List[str] = None, incremental: bool = False) -> Tuple[List[str], np.ndarray, Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], Dict[str, date], bool]:
+    """
+    为指定年份准备计算所需的数据
+
+    增量模式下读取已持久化的累计值，股票只加载最后累计日之后的新交易日；
+    如果指数集合发生变化（新增或移除指数会改变历史每日排名），则退回该年份的全量重算
+
+    返回:
+    - 指数代码列表
+    - 指数矩阵
+    - {股票代码: (新交易日行号数组, real_change数组, 已累计得分, 已累计有效交易日数)}
+    - {股票代码: 计算后累计到的最后交易日}
+    - 是否为全量重算（需要替换该年份的旧累计值）
+    """
+    dates, index_symbols, index_matrix = load_index_matrix(year, db)
+    if not index_symbols:
+        return [], index_matrix, {}, {}, True
+
+    state = load_correlation_state(year, db, symbols=symbols) if incremental else {}
+    if state:
+        stored_index_symbols = set()
+        for accumulators, _ in state.values():
+            stored_index_symbols.update(accumulators)
+        if stored_index_symbols != set(index_symbols):
+            file_logger.info(f"{year}年指数集合发生变化，改为全量重算")
+            state = {}
+
+    if not state:
+        stock_arrays = load_stock_arrays(year, dates, db, symbols=symbols)
+    else:
+        # 已有累计值的股票只需要读取最早的最后累计日之后的数据，没有累计值的股票读取全年数据
+        earliest_last_date = min(last_date for _, last_date in state.values())
+        stock_arrays = load_stock_arrays(year, dates, db, symbols=symbols, start_date=earliest_last_date + timedelta(days=1))
+        new_symbols = [symbol for symbol in stock_symbols if symbol not in state]
+        if new_symbols:
+            stock_arrays.update(load_stock_arrays(year, dates, db, symbols=new_symbols))
+
+    year_tasks = {}
+    last_dates = {}
+    for symbol, (positions, values) in stock_arrays.items():
+        base_scores = np.zeros(len(index_symbols), dtype=np.int64)
+        base_valid_days = np.zeros(len(index_symbols), dtype=np.int64)
+        if symbol in state:
+            accumulators, last_date = state[symbol]
+            # 只保留最后累计日之后的交易日
+            keep = positions >= bisect.bisect_right(dates, last_date)
+            positions, values = positions[keep], values[keep]
+            for i, index_symbol in enumerate(index_symbols):
+                base_scores[i], base_valid_days[i] = accumulators.get(index_symbol, (0, 0))
+        if len(positions) == 0:
+            continue
+        year_tasks[symbol] = (positions, values, base_scores, base_valid_days)
+        last_dates[symbol] = dates[positions[-1]]
+    return index_symbols, index_matrix, year_tasks, last_dates, not state
+
+
+# 数据库内计算一个年份相关度的SQL：按(股票, 交易日)对各指数的绝对差值做rank()，再按(股票, 指数)汇总得分并排名
+_IN_DATABASE_CORRELATION_SQL = """
+WITH stock_days AS (
+    SELECT s.symbol, s.date, s.real_change
+    FROM derived_stock s
+    WHERE s.date >= :start_date AND s.date <= :end_date AND s.real_change IS NOT NULL
+      AND s.symbol IN (SELECT symbol FROM stock_info){stock_filter}
+),
+daily_ranks AS (
+    SELECT sd.symbol, i.symbol AS index_symbol, sd.date,
+           rank() OVER (PARTITION BY sd.symbol, sd.date ORDER BY abs(i.real_change - sd.real_change)) AS day_rank
+    FROM stock_days sd
+    JOIN derived_index i ON i.date = sd.date
+    WHERE i.real_change IS NOT NULL
+),
+totals AS (
+    SELECT symbol, index_symbol, sum(day_rank) AS score_sum, count(*) AS valid_days, max(date) AS last_date
+    FROM daily_ranks
+    GROUP BY symbol, index_symbol
+)
+INSERT INTO stock_index_correlation (symbol, year, index_symbol, score_sum, valid_days, score, rank, last_date)
+SELECT symbol, :year, index_symbol, score_sum, valid_days,
+       CAST(score_sum AS DOUBLE PRECISION) / valid_days,
+       row_number() OVER (PARTITION BY symbol ORDER BY CAST(score_sum AS DOUBLE PRECISION) / valid_days, index_symbol),
+       max(last_date) OVER (PARTITION BY symbol)
+FROM totals
+WHERE valid_days > 0
+ON CONFLICT (symbol, year, index_symbol) DO UPDATE SET
+    score_sum = excluded.score_sum,
+    valid_days = excluded.valid_days,
+    score = excluded.score,
+    rank = excluded.rank,
+    last_date = excluded.last_date
+"""
+
+
+def update_stock_index_correlation_in_database(stock_symbol: str = None, years: List[int] = None):
+    """
+    在数据库内全量计算股票与指数的相关度
+    每日排名由 rank() 窗口函数完成，derived_stock 与 derived_index 按交易日关联可以直接利用(symbol, date)主键，
+    数据不需要传输到Python进程；结果写入 stock_index_correlation 并派生 stock_info 的年份列，与Python引擎一致
+    """
+    current_year = datetime.now().year
+    if years is None:
+        years = [2020, 2021, 2022, 2023, 2024]
+    years = [year for year in years if year <= current_year]
+    symbols = [stock_symbol] if stock_symbol else None
+    start_time = time.time()
+
+    console_logger.info(f"开始在数据库内更新股票指数相关度... 年份: {years}")
+    file_logger.info(f"开始在数据库内更新股票指数相关度... 年份: {years}")
+
     db = SessionLocal()
     try:
-        total_stocks = len(batch_data)
-        for idx, (stock, years, is_main_run) in enumerate(batch_data):
-            # 在控制台显示进度信息
-            progress = (idx + 1) / total_stocks * 100
-            console_logger.info(f"处理进度: [{idx+1}/{total_stocks}] {progress:.1f}% - 当前: {stock.symbol} ({stock.name})")
-            
-            # 详细日志写入文件
-            file_logger.info(f"处理股票: {stock.symbol} ({stock.name})")
-            
-            for year in years:
-                # 检查当前年份是否已经超过当前年份
-                current_year = datetime.now().year
-                if year > current_year:
-                    file_logger.info(f"跳过未来年份: {year}")
-                    continue
-
-                # 计算相关度最高的指数
-                best_index, index_scores, index_valid_days = calculate_correlation_for_stock(stock.symbol, year, db)
-
-                if best_index:
-                    # 将结果添加到返回列表
-                    results.append((stock.symbol, stock.name, year, best_index))
-                    file_logger.info(f"  {year}年最相关指数: {best_index}")
-
-                    # 如果是单独运行，记录所有指数的得分情况到日志文件
-                    if is_main_run:
-                        file_logger.info(f"\n  {year}年所有指数得分情况:")
-                        file_logger.info("  " + "-"*60)
-                        file_logger.info("  {:^10} {:^10} {:^15} {:^10} {:^5}".format("指数代码", "得分", "有效交易日数", "平均得分", ""))
-                        file_logger.info("  " + "-"*60)
-
-                        # 按平均得分排序（从低到高，低分表示相关性更高）
-                        sorted_indices = []
-                        for symbol, score in index_scores.items():
-                            if index_valid_days[symbol] > 0:
-                                avg_score = score / index_valid_days[symbol]
-                                sorted_indices.append((symbol, score, index_valid_days[symbol], avg_score))
-
-                        # 按平均得分排序
-                        sorted_indices.sort(key=lambda x: x[3])
-
-                        for i, (symbol, score, valid_days, avg_score) in enumerate(sorted_indices):
-                            # 标记最相关的指数
-                            mark = "*" if symbol == best_index else " "
-                            # 添加排名
-                            rank = i + 1
-                            file_logger.info("  {:10} {:10d} {:15d} {:10.2f} {}".format(symbol, score, valid_days, avg_score, mark))
-
-                        file_logger.info("  " + "-"*60)
-                        file_logger.info(f"  * 表示相关度最高的指数\n")
-                else:
-                    file_logger.info(f"  未找到{year}年的相关指数")
+        # 先清空旧的累计值和排名，再由一条 INSERT ... SELECT 写入每个年份的结果
+        save_correlation_results([], db, replace_years=years, symbols=symbols)
+        sql = _IN_DATABASE_CORRELATION_SQL.format(stock_filter=" AND s.symbol = :stock_symbol" if stock_symbol else "")
+        for year in years:
+            params = {"year": year, "start_date": date(year, 1, 1), "end_date": date(year, 12, 31)}
+            if stock_symbol:
+                params["stock_symbol"] = stock_symbol
+            year_start_time = time.time()
+            db.execute(text(sql), params)
+            file_logger.info(f"{year}年相关度在数据库内计算完成. 耗时: {time.time() - year_start_time:.2f} 秒")
+        derive_stock_info_indices(years, db, symbols=symbols)
+        db.commit()
+
+        elapsed_time = time.time() - start_time
+        console_logger.info(f"股票指数相关度更新完成. 耗时: {elapsed_time:.2f} 秒")
+        file_logger.info(f"股票指数相关度更新完成. 耗时: {elapsed_time:.2f} 秒")
     finally:
         db.close()
-    return results
 
 
-def update_stock_index_correlation(stock_symbol: str = None, years: List[int] = None, max_workers: int = None):
+def _audit_pruned_results(results: List[Tuple], index_matrices: Dict[Any, Tuple[List[str], np.ndarray]], year_tasks: Dict[int, Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]], audit_rate: float):
+    """
+    统计剪枝模式的扫描方式，并按audit_rate抽样对剪枝结果做全量扫描，记录最佳指数的一致率
+    抽样按股票代码的哈希确定，同一数据多次运行抽到的股票相同
+    """
+    scans = [result[6] for result in results]
+    pruned = [result for result in results if result[6] == "pruned"]
+    file_logger.info(f"剪枝统计: 仅候选 {scans.count('pruned')}, 退回全量 {scans.count('fallback')}, 未剪枝 {scans.count('full')}")
+
+    sampled = [result for result in pruned if zlib.crc32(result[0].encode()) % 10000 < audit_rate * 10000]
+    if not sampled:
+        return
+    matched = 0
+    for symbol, _, year, best_index, _, _, _ in sampled:
+        index_symbols, index_matrix = index_matrices[year]
+        positions, values, _, _ = year_tasks[year][symbol]
+        full_best = _pick_best_index(index_symbols, *score_stock_days(index_matrix, positions, values))
+        if full_best == best_index:
+            matched += 1
+        else:
+            file_logger.info(f"剪枝抽样: {symbol} {year}年 剪枝结果 {best_index}, 全量结果 {full_best}")
+    console_logger.info(f"剪枝抽样核对: {matched}/{len(sampled)} 只股票的最佳指数与全量扫描一致")
+    file_logger.info(f"剪枝抽样核对: {matched}/{len(sampled)} 只股票的最佳指数与全量扫描一致")
+
+
+def update_stock_index_correlation(stock_symbol: str = None, years: List[int] = None, max_workers: int = None, incremental: bool = False, prune: bool = False):
     """
     更新股票与指数的相关度
     如果指定了stock_symbol，则只更新该股票的相关度
     如果指定了years，则只更新这些年份的相关度
     如果指定了max_workers，则使用指定数量的进程，否则根据CPU核心数自动确定
+    如果incremental为True，则只对上次计算之后新增的交易日累加得分，未指定years时只处理去年和今年
+    如果prune为True，全量重算的年份中每只股票只与候选指数比较（见 select_candidate_indices），
+    这些股票只保存候选指数的得分，且不记录last_date，下次增量运行时会对其全量重算
+
+    指数矩阵和股票数据在父进程中按年份各查询一次；多进程运行时指数矩阵通过共享内存发布，
+    子进程只接收股票代码和紧凑的numpy数组，不再各自连接数据库重复查询
+    每只股票每年与各指数的完整得分向量和排名保存在 stock_index_correlation 表中，stock_info 的年份列由其派生
     """
+    current_year = datetime.now().year
     if years is None:
-        years = [2020, 2021, 2022, 2023, 2024]
+        years = [current_year - 1, current_year] if incremental else [2020, 2021, 2022, 2023, 2024]
     
     # 确定进程数量
-    if max_workers is None:
-        # 获取CPU逻辑处理器数量
-        cpu_count = os.cpu_count()
-        # 保留一些核心给系统使用，至少保留4个核心
-        max_workers = max(1, cpu_count - 4) if cpu_count else 1
+    max_workers = _resolve_max_workers(max_workers)
     
     console_logger.info(f"使用 {max_workers} 个进程进行并行处理")
     file_logger.info(f"使用 {max_workers} 个进程进行并行处理")
@@ -232,48 +904,81 @@ def update_stock_index_correlation(stock_symbol: str = None, years: List[int] =
     try:
         # 如果指定了股票代码，只处理该股票
         if stock_symbol:
-            stocks = [db.query(StockInfo).filter(StockInfo.symbol == stock_symbol).first()]
-            if not stocks[0]:
+            stocks = db.query(StockInfo.symbol, StockInfo.name).filter(StockInfo.symbol == stock_symbol).all()
+            if not stocks:
                 console_logger.error(f"股票 {stock_symbol} 不存在于stock_info表中")
                 file_logger.error(f"股票 {stock_symbol} 不存在于stock_info表中")
                 return
         else:
             # 否则处理所有股票
-            stocks = db.query(StockInfo).all()
+            stocks = db.query(StockInfo.symbol, StockInfo.name).all()
         
         # 检查是否是单独运行（通过__main__调用）
         is_main_run = __name__ == "__main__"
 
         total_stocks = len(stocks)
-        console_logger.info(f"开始更新股票指数相关度... 共 {total_stocks} 只股票")
-        file_logger.info(f"开始更新股票指数相关度... 共 {total_stocks} 只股票")
-        
-        # 如果只有一只股票或者只有一个进程，直接处理
-        if len(stocks) == 1 or max_workers == 1:
-            results = process_stock_batch([(stock, years, is_main_run) for stock in stocks])
+        mode = "增量" if incremental else "全量"
+        console_logger.info(f"开始{mode}更新股票指数相关度... 共 {total_stocks} 只股票")
+        file_logger.info(f"开始{mode}更新股票指数相关度... 共 {total_stocks} 只股票")
+
+        # 跳过未来年份
+        for year in years:
+            if year > current_year:
+                file_logger.info(f"跳过未来年份: {year}")
+        years = [year for year in years if year <= current_year]
+
+        # 按年份一次性加载指数矩阵和股票数据
+        symbols = [stock_symbol] if stock_symbol else None
+        stock_symbols = [symbol for symbol, _ in stocks]
+        index_matrices = {}
+        year_tasks = {}
+        last_dates = {}
+        year_candidates = {}
+        replace_years = set()
+        for year in years:
+            index_symbols, index_matrix, tasks_of_year, last_dates[year], replace = _prepare_year(
+                year, db, stock_symbols, symbols=symbols, incremental=incremental
+            )
+            if not index_symbols:
+                file_logger.warning(f"没有找到任何指数在 {year} 年的数据")
+                continue
+            index_matrices[year] = (index_symbols, index_matrix)
+            year_tasks[year] = tasks_of_year
+            if replace:
+                replace_years.add(year)
+                if prune:
+                    year_candidates[year] = select_candidate_indices(
+                        year, index_symbols, index_matrix, tasks_of_year, db,
+                        config.CORRELATION_PRUNE_TOP_K, config.CORRELATION_PRUNE_VOLATILITY_K
+                    )
+            file_logger.info(f"{year}年: {index_matrix.shape[0]} 个交易日, {len(index_symbols)} 个指数, {len(tasks_of_year)} 只股票需要计算{'（全量）' if replace else '（增量）'}")
+
+        tasks = []
+        for symbol, name in stocks:
+            stock_arrays = {year: arrays[symbol] for year, arrays in year_tasks.items() if symbol in arrays}
+            if incremental and not stock_arrays:
+                continue
+            candidates = {year: by_symbol[symbol] for year, by_symbol in year_candidates.items() if symbol in by_symbol}
+            tasks.append((symbol, name, stock_arrays, sorted(stock_arrays) if incremental else years, is_main_run, candidates))
+
+        if not tasks:
+            console_logger.info("没有新增交易日，无需更新")
+            file_logger.info("没有新增交易日，无需更新")
+            results = []
         else:
-            # 将股票列表分成多个批次
-            batch_size = math.ceil(len(stocks) / max_workers)
-            batches = []
-            for i in range(0, len(stocks), batch_size):
-                batch = [(stock, years, is_main_run) for stock in stocks[i:i+batch_size]]
-                batches.append(batch)
-            
-            # 创建进程池并行处理
-            with multiprocessing.Pool(processes=max_workers) as pool:
-                # 启动多个进程处理不同批次的股票
-                console_logger.info(f"启动 {max_workers} 个进程处理 {len(batches)} 个批次的股票")
-                results = pool.map(process_stock_batch, batches)
-                # 展平结果列表
-                results = [item for sublist in results for item in sublist]
+            results = _run_tasks(tasks, index_matrices, max_workers)
         
         # 更新数据库
         console_logger.info(f"处理完成，正在更新数据库...")
         file_logger.info(f"处理完成，正在更新数据库...")
-        for symbol, name, year, best_index in results:
-            stock = db.query(StockInfo).filter(StockInfo.symbol == symbol).first()
-            if stock:
-                setattr(stock, f"index_{year}", best_index)
+        rows = []
+        for symbol, name, year, best_index, index_scores, index_valid_days, scan in results:
+            last_date = None if scan == "pruned" else last_dates[year][symbol]
+            rows.extend(build_result_rows(symbol, year, index_matrices[year][0], index_scores, index_valid_days, last_date))
+        save_correlation_results(rows, db, replace_years=sorted(replace_years), symbols=symbols)
+        derive_stock_info_indices(sorted({result[2] for result in results}), db, symbols=symbols)
+        if prune:
+            _audit_pruned_results(results, index_matrices, year_tasks, config.CORRELATION_PRUNE_AUDIT_RATE)
         
         # 提交更改
         db.commit()
@@ -286,18 +991,255 @@ def update_stock_index_correlation(stock_symbol: str = None, years: List[int] =
         db.close()
 
 
+def update_stock_index_metrics(metrics: List[str] = METRICS, stock_symbol: str = None, years: List[int] = None):
+    """
+    计算股票与指数的 Pearson、Spearman 相关系数和 beta，结果与排名得分保存在 stock_index_correlation 的同一记录上
+
+    每年只查询一次数据，所有股票×所有指数的系数由 compute_affinity_metrics 通过矩阵乘法一次算出，
+    矩阵乘法本身由BLAS多线程执行，因此不使用进程池
+    """
+    metrics = [metric for metric in METRICS if metric in metrics]
+    current_year = datetime.now().year
+    if years is None:
+        years = [2020, 2021, 2022, 2023, 2024]
+    years = [year for year in years if year <= current_year]
+    start_time = time.time()
+
+    console_logger.info(f"开始计算相关性指标: {', '.join(metrics)}")
+    file_logger.info(f"开始计算相关性指标: {', '.join(metrics)}")
+
+    db = SessionLocal()
+    try:
+        symbols = [stock_symbol] if stock_symbol else None
+        rows = []
+        for year in years:
+            dates, index_symbols, index_matrix = load_index_matrix(year, db)
+            if not index_symbols:
+                file_logger.warning(f"没有找到任何指数在 {year} 年的数据")
+                continue
+            stock_arrays = load_stock_arrays(year, dates, db, symbols=symbols)
+            stock_symbols = sorted(stock_arrays)
+            if not stock_symbols:
+                continue
+
+            stock_matrix = build_stock_matrix(stock_arrays, stock_symbols, len(dates))
+            coefficients, counts = compute_affinity_metrics(stock_matrix, index_matrix, metrics)
+            for i, symbol in enumerate(stock_symbols):
+                for j, index_symbol in enumerate(index_symbols):
+                    row = {"symbol": symbol, "year": year, "index_symbol": index_symbol, "metric_days": int(counts[i, j])}
+                    for metric in metrics:
+                        value = coefficients[metric][i, j]
+                        row[metric] = None if np.isnan(value) else float(value)
+                    rows.append(row)
+            file_logger.info(f"{year}年: {len(stock_symbols)} 只股票 × {len(index_symbols)} 个指数的相关性指标计算完成")
+
+        save_metric_results(rows, db, metrics)
+        db.commit()
+
+        elapsed_time = time.time() - start_time
+        console_logger.info(f"相关性指标更新完成, 写入 {len(rows)} 条记录. 耗时: {elapsed_time:.2f} 秒")
+        file_logger.info(f"相关性指标更新完成, 写入 {len(rows)} 条记录. 耗时: {elapsed_time:.2f} 秒")
+    finally:
+        db.close()
+
+
+def save_universe_correlation_results(source_universe: str, target_universe: str, rows: List[Dict[str, Any]], db: Session, years: List[int], symbols: List[str] = None):
+    """
+    用本次计算的结果替换 universe_correlation 表中该证券池组合在这些年份（或指定代码在这些年份）的旧记录
+
+    参数:
+    - rows: build_result_rows 生成的记录，其中的 index_symbol 即比较对象代码
+    """
+    query = db.query(UniverseCorrelation).filter(
+        UniverseCorrelation.source_universe == source_universe,
+        UniverseCorrelation.target_universe == target_universe,
+        UniverseCorrelation.year.in_(list(years))
+    )
+    if symbols is not None:
+        query = query.filter(UniverseCorrelation.symbol.in_(symbols))
+    query.delete(synchronize_session=False)
+
+    if not rows:
+        return
+    universe_rows = []
+    for row in rows:
+        universe_row = {key: value for key, value in row.items() if key != "index_symbol"}
+        universe_row.update(source_universe=source_universe, target_universe=target_universe, target_symbol=row["index_symbol"])
+        universe_rows.append(universe_row)
+    db.execute(pg_insert(UniverseCorrelation), universe_rows)
+
+
+def update_universe_correlation(source_universe: str, target_universe: str, years: List[int] = None, symbols: List[str] = None, max_workers: int = None):
+    """
+    计算source_universe中每个代码与target_universe中各代码的相关度，如每只ETF最贴近的指数、每只股票最贴近的ETF
+    证券池见 UNIVERSES；按年份全量计算，与股票×指数使用同样的排名得分、共享内存和进程池，
+    结果保存在 universe_correlation 表中
+    股票×指数的相关度请使用 update_stock_index_correlation，其结果会派生 stock_info 的年份列
+    """
+    for universe in (source_universe, target_universe):
+        if universe not in UNIVERSES:
+            raise ValueError(f"未知的证券池: {universe}，可选: {', '.join(UNIVERSES)}")
+    if source_universe == target_universe:
+        raise ValueError("source_universe 与 target_universe 不能相同")
+
+    current_year = datetime.now().year
+    if years is None:
+        years = [2020, 2021, 2022, 2023, 2024]
+    years = [year for year in years if year <= current_year]
+    max_workers = _resolve_max_workers(max_workers)
+    start_time = time.time()
+
+    console_logger.info(f"开始更新 {source_universe} -> {target_universe} 相关度... 年份: {years}, 使用 {max_workers} 个进程")
+    file_logger.info(f"开始更新 {source_universe} -> {target_universe} 相关度... 年份: {years}, 使用 {max_workers} 个进程")
+
+    db = SessionLocal()
+    try:
+        target_matrices = {}
+        target_dates = {}
+        source_arrays = {}
+        for year in years:
+            dates, target_symbols, target_matrix = load_universe_matrix_between(target_universe, date(year, 1, 1), date(year, 12, 31), db)
+            if not target_symbols:
+                file_logger.warning(f"没有找到 {target_universe} 在 {year} 年的数据")
+                continue
+            target_matrices[year] = (target_symbols, target_matrix)
+            target_dates[year] = dates
+            source_arrays[year] = load_universe_arrays_between(source_universe, date(year, 1, 1), date(year, 12, 31), dates, db, symbols=symbols)
+            file_logger.info(f"{year}年: {len(dates)} 个交易日, {len(target_symbols)} 个比较对象, {len(source_arrays[year])} 个代码")
+
+        tasks = []
+        for symbol in sorted({symbol for arrays in source_arrays.values() for symbol in arrays}):
+            symbol_arrays = {}
+            for year, arrays in source_arrays.items():
+                if symbol in arrays:
+                    positions, values = arrays[symbol]
+                    zeros = np.zeros(len(target_matrices[year][0]), dtype=np.int64)
+                    symbol_arrays[year] = (positions, values, zeros, zeros.copy())
+            tasks.append((symbol, symbol, symbol_arrays, sorted(symbol_arrays), False, {}))
+        results = _run_tasks(tasks, target_matrices, max_workers) if tasks else []
+
+        rows = []
+        for symbol, _, year, _, scores, valid_days, _ in results:
+            last_date = target_dates[year][source_arrays[year][symbol][0][-1]]
+            rows.extend(build_result_rows(symbol, year, target_matrices[year][0], scores, valid_days, last_date))
+        save_universe_correlation_results(source_universe, target_universe, rows, db, list(target_matrices), symbols=symbols)
+        db.commit()
+
+        elapsed_time = time.time() - start_time
+        console_logger.info(f"{source_universe} -> {target_universe} 相关度更新完成, 写入 {len(rows)} 条记录. 耗时: {elapsed_time:.2f} 秒")
+        file_logger.info(f"{source_universe} -> {target_universe} 相关度更新完成, 写入 {len(rows)} 条记录. 耗时: {elapsed_time:.2f} 秒")
+    finally:
+        db.close()
+
+
+def _recent_index_dates(db: Session, count: int, as_of: date = None) -> List[Any]:
+    """返回截至as_of（含）最近count个有指数数据的交易日，升序"""
+    query = db.query(DerivedIndex.date).filter(DerivedIndex.real_change.isnot(None))
+    if as_of is not None:
+        query = query.filter(DerivedIndex.date <= as_of)
+    rows = query.distinct().order_by(DerivedIndex.date.desc()).limit(count).all()
+    return sorted(row[0] for row in rows)
+
+
+def save_rolling_correlation_results(rows: List[Dict[str, Any]], db: Session):
+    """将滚动窗口结果用一条批量upsert写入 stock_index_rolling_correlation 表"""
+    if not rows:
+        return
+    stmt = pg_insert(StockIndexRollingCorrelation)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["symbol", "date", "window_size"],
+        set_={
+            "index_symbol": stmt.excluded.index_symbol,
+            "score": stmt.excluded.score,
+            "valid_days": stmt.excluded.valid_days,
+        }
+    )
+    db.execute(stmt, rows)
+
+
+def update_stock_index_rolling_correlation(windows: List[int] = None, days: int = 1, as_of: date = None, stock_symbol: str = None, max_workers: int = None):
+    """
+    按滚动窗口更新股票与指数的相关度
+    对截至as_of的最近days个交易日，分别计算每只股票在最近windows个交易日窗口内相关度最高的指数
+
+    只加载 max(windows)+days-1 个交易日的数据，每只股票的每日排名只计算一次，
+    各窗口的平均得分通过前缀和得到，见 rolling_window_scores
+    """
+    windows = sorted(set(windows or ROLLING_WINDOWS))
+    max_workers = _resolve_max_workers(max_workers)
+    start_time = time.time()
+
+    db = SessionLocal()
+    try:
+        if stock_symbol:
+            stock_symbols = [symbol for symbol, in db.query(StockInfo.symbol).filter(StockInfo.symbol == stock_symbol).all()]
+            if not stock_symbols:
+                console_logger.error(f"股票 {stock_symbol} 不存在于stock_info表中")
+                file_logger.error(f"股票 {stock_symbol} 不存在于stock_info表中")
+                return
+        else:
+            stock_symbols = [symbol for symbol, in db.query(StockInfo.symbol).all()]
+
+        axis_dates = _recent_index_dates(db, max(windows) + days - 1, as_of=as_of)
+        if not axis_dates:
+            file_logger.warning("没有找到任何指数数据")
+            return
+        dates, index_symbols, index_matrix = load_index_matrix_between(axis_dates[0], axis_dates[-1], db)
+        stock_arrays = load_stock_arrays_between(dates[0], dates[-1], dates, db, symbols=[stock_symbol] if stock_symbol else None)
+
+        first_output_position = max(0, len(dates) - days)
+        console_logger.info(f"开始更新滚动窗口相关度... 窗口: {windows}, 输出 {dates[first_output_position]} 至 {dates[-1]}, 共 {len(stock_symbols)} 只股票")
+        file_logger.info(f"开始更新滚动窗口相关度... 窗口: {windows}, 输出 {dates[first_output_position]} 至 {dates[-1]}, 共 {len(stock_symbols)} 只股票")
+
+        tasks = [
+            (symbol, *stock_arrays[symbol], windows, first_output_position)
+            for symbol in stock_symbols if symbol in stock_arrays
+        ]
+        results = _run_tasks(tasks, {ROLLING_MATRIX_KEY: (index_symbols, index_matrix)}, max_workers, worker=process_stock_rolling)
+
+        rows = [
+            {"symbol": symbol, "date": dates[position], "window_size": window, "index_symbol": best_index, "score": score, "valid_days": valid_days}
+            for symbol, position, window, best_index, score, valid_days in results
+        ]
+        save_rolling_correlation_results(rows, db)
+        db.commit()
+
+        elapsed_time = time.time() - start_time
+        console_logger.info(f"滚动窗口相关度更新完成, 写入 {len(rows)} 条记录. 耗时: {elapsed_time:.2f} 秒")
+        file_logger.info(f"滚动窗口相关度更新完成, 写入 {len(rows)} 条记录. 耗时: {elapsed_time:.2f} 秒")
+    finally:
+        db.close()
+
+
 if __name__ == "__main__":
     # 更新所有股票的所有年份
-    # 可以通过命令行参数指定进程数
-    import sys
-    max_workers = None
-    if len(sys.argv) > 1:
-        try:
-            max_workers = int(sys.argv[1])
-            console_logger.info(f"使用命令行指定的进程数: {max_workers}")
-            file_logger.info(f"使用命令行指定的进程数: {max_workers}")
-        except ValueError:
-            console_logger.warning(f"无效的进程数参数: {sys.argv[1]}，将使用自动确定的进程数")
-            file_logger.warning(f"无效的进程数参数: {sys.argv[1]}，将使用自动确定的进程数")
+    # 可以通过命令行参数指定进程数，以及是否只增量处理新增交易日
+    import argparse
+    parser = argparse.ArgumentParser(description="更新股票与指数的相关度")
+    parser.add_argument("max_workers", type=int, nargs="?", default=None, help="进程数，默认根据CPU核心数自动确定")
+    parser.add_argument("--incremental", action="store_true", help="只对上次计算之后新增的交易日累加得分")
+    parser.add_argument("--prune", action="store_true", help="全量重算时只与上一年排名靠前和波动率接近的候选指数比较")
+    parser.add_argument("--engine", choices=("python", "sql"), default="python", help="排名得分的计算引擎，sql表示在数据库内用窗口函数全量计算")
+    parser.add_argument("--metric", nargs="+", choices=("rank",) + METRICS, default=["rank"], help="本次计算的指标，rank为默认的排名得分，可同时指定多个")
+    parser.add_argument("--universe", nargs=2, metavar=("SOURCE", "TARGET"), choices=list(UNIVERSES), help="计算两个证券池之间的相关度，如 etf index、stock etf")
+    parser.add_argument("--rolling", type=int, nargs="*", help="改为按滚动窗口计算，指定窗口长度（交易日），不指定长度时使用 60 120 250")
+    parser.add_argument("--days", type=int, default=1, help="滚动窗口模式下输出最近多少个交易日的结果，默认为1")
+    args = parser.parse_args()
+    if args.max_workers is not None:
+        console_logger.info(f"使用命令行指定的进程数: {args.max_workers}")
+        file_logger.info(f"使用命令行指定的进程数: {args.max_workers}")
     
-    update_stock_index_correlation(max_workers=max_workers)
+    if args.universe and tuple(args.universe) != ("stock", "index"):
+        update_universe_correlation(args.universe[0], args.universe[1], max_workers=args.max_workers)
+    elif args.rolling is not None:
+        update_stock_index_rolling_correlation(windows=args.rolling, days=args.days, max_workers=args.max_workers)
+    else:
+        if "rank" in args.metric and args.engine == "sql":
+            if args.incremental:
+                console_logger.info("数据库内计算只支持全量模式，忽略 --incremental")
+            update_stock_index_correlation_in_database()
+        elif "rank" in args.metric:
+            update_stock_index_correlation(max_workers=args.max_workers, incremental=args.incremental, prune=args.prune)
+        metrics = [metric for metric in args.metric if metric != "rank"]
+        if metrics:
+            update_stock_index_metrics(metrics=metrics)
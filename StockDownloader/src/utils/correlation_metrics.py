@@ -0,0 +1,109 @@
+# src/utils/correlation_metrics.py
+"""
+此模块包含股票与指数之间的经典相关性指标（Pearson、Spearman、beta）的批量计算函数。
+所有股票×所有指数的系数通过少量带缺失值掩码的矩阵乘法一次得到，不逐对计算。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 支持的指标
+METRICS = ("pearson", "spearman", "beta")
+# 股票与指数共同交易日少于该值时不计算系数
+MIN_METRIC_DAYS = 20
+
+
+def _standardize(matrix: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按各序列自身的有效值做标准化，缺失值置0
+
+    返回:
+    - 标准化后的矩阵（缺失值为0）
+    - 各序列的标准差（常数序列为NaN）
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nanmean(matrix, axis=axis, keepdims=True)
+        std = np.nanstd(matrix, axis=axis, keepdims=True)
+        std[std == 0] = np.nan
+        standardized = (matrix - mean) / std
+    return np.nan_to_num(standardized, nan=0.0), np.squeeze(std, axis=axis)
+
+
+def _masked_moments(stock_matrix: np.ndarray, index_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    在每对(股票, 指数)的共同交易日上计算协方差和方差
+
+    参数:
+    - stock_matrix: 股票×交易日 的矩阵，缺失为NaN
+    - index_matrix: 交易日×指数 的矩阵，缺失为NaN
+
+    返回:
+    - 共同交易日数 股票×指数
+    - 协方差、股票方差、指数方差 股票×指数（基于标准化后的序列）
+    - 股票标准差、指数标准差（用于把beta换算回原始尺度）
+    """
+    stock_mask = (~np.isnan(stock_matrix)).astype(np.float64)
+    index_mask = (~np.isnan(index_matrix)).astype(np.float64)
+    x, stock_std = _standardize(stock_matrix, axis=1)
+    y, index_std = _standardize(index_matrix, axis=0)
+
+    counts = stock_mask @ index_mask
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = (x @ index_mask) / counts
+        mean_y = (stock_mask @ y) / counts
+        covariance = (x @ y) / counts - mean_x * mean_y
+        variance_x = ((x * x) @ index_mask) / counts - mean_x * mean_x
+        variance_y = (stock_mask @ (y * y)) / counts - mean_y * mean_y
+    return counts, covariance, variance_x, variance_y, stock_std, index_std
+
+
+def _pearson(stock_matrix: np.ndarray, index_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    counts, covariance, variance_x, variance_y, _, _ = _masked_moments(stock_matrix, index_matrix)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coefficients = covariance / np.sqrt(variance_x * variance_y)
+    return np.clip(coefficients, -1.0, 1.0), counts
+
+
+def compute_affinity_metrics(stock_matrix: np.ndarray, index_matrix: np.ndarray, metrics=METRICS) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    计算所有股票与所有指数之间的相关性指标
+
+    缺失值通过掩码处理，每对(股票, 指数)只使用两者都有数据的交易日；
+    Spearman 使用各序列在自身有效交易日内的平均秩，缺失交易日不同的序列对是近似值
+
+    参数:
+    - stock_matrix: 股票×交易日 的real_change矩阵，缺失为NaN
+    - index_matrix: 交易日×指数 的real_change矩阵，缺失为NaN
+    - metrics: 需要计算的指标，取值见 METRICS
+
+    返回:
+    - {指标名: 股票×指数 的系数矩阵}，共同交易日不足 MIN_METRIC_DAYS 或方差为0时为NaN
+    - 共同交易日数矩阵 股票×指数
+    """
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"不支持的相关性指标: {sorted(unknown)}")
+
+    results = {}
+    counts = None
+    if "pearson" in metrics or "beta" in metrics:
+        counts, covariance, variance_x, variance_y, stock_std, index_std = _masked_moments(stock_matrix, index_matrix)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if "pearson" in metrics:
+                results["pearson"] = np.clip(covariance / np.sqrt(variance_x * variance_y), -1.0, 1.0)
+            if "beta" in metrics:
+                # 标准化序列上的回归系数乘以 股票标准差/指数标准差 即为原始尺度的beta
+                results["beta"] = covariance / variance_y * (stock_std[:, None] / index_std[None, :])
+    if "spearman" in metrics:
+        stock_ranks = pd.DataFrame(stock_matrix).rank(axis=1).to_numpy(dtype=np.float64)
+        index_ranks = pd.DataFrame(index_matrix).rank(axis=0).to_numpy(dtype=np.float64)
+        results["spearman"], counts = _pearson(stock_ranks, index_ranks)
+
+    too_few = counts < MIN_METRIC_DAYS
+    for name in results:
+        results[name][too_few | ~np.isfinite(results[name])] = np.nan
+    return results, counts.astype(np.int64)
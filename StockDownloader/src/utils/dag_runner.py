@@ -0,0 +1,200 @@
+# src/utils/dag_runner.py
+"""
+此模块提供一个按依赖关系执行任务的简单DAG执行器。
+每个任务声明依赖的任务和所属的资源类别，依赖全部成功后即可运行，互不依赖的分支在资源限额内并行执行；
+执行器记录每个任务的状态、尝试次数和耗时，失败的任务按设置的次数延迟重试，
+再次调用 run 时只重新执行未成功的任务，已成功的任务不会重复执行。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, List
+
+from ..core.config import config
+from ..core.logger import logger
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCESS = "success"
+FAILED = "failed"
+BLOCKED = "blocked"  # 依赖的任务失败，本次运行不再执行
+
+
+class DagTask:
+    """DAG中的一个任务及其执行记录"""
+
+    def __init__(self, name: str, func: Callable[[], object], depends_on: Iterable[str] = (), resource: str = None,
+                 max_retries: int = 0, retry_delay: float = 0):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+        self.resource = resource
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.status = PENDING
+        self.attempts = 0  # 累计尝试次数（包括之前的运行）
+        self.elapsed = 0.0  # 累计运行耗时（秒）
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.retry_at = None
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "attempts": self.attempts,
+            "elapsed": round(self.elapsed, 2),
+            "error": self.error,
+        }
+
+
+class DagRunner:
+    """
+    DAG执行器。
+
+    用法:
+        runner = DagRunner("daily_update")
+        runner.add("stock_bars", update_stock_data, resource="network", max_retries=2, retry_delay=60)
+        runner.add("stock_indicators", update_stock_indicators, depends_on=["stock_bars"], resource="cpu")
+        if not runner.run():
+            runner.run()  # 只重新执行失败和被阻塞的任务
+
+    参数:
+    - name: 执行器名称，用于日志
+    - limits: {资源类别: 可同时运行的任务数}，默认为 config.DAG_RESOURCE_LIMITS；未列出的类别和没有类别的任务不受限制
+    - on_task_done: 任务每次运行结束（成功、等待重试或失败）后以该任务为参数调用，用于记录进度
+    """
+
+    def __init__(self, name: str = "dag", limits: Dict[str, int] = None, on_task_done: Callable[[DagTask], object] = None):
+        self.name = name
+        self.limits = dict(config.DAG_RESOURCE_LIMITS if limits is None else limits)
+        self.on_task_done = on_task_done
+        self.tasks: Dict[str, DagTask] = {}
+
+    def add(self, name: str, func: Callable[[], object], depends_on: Iterable[str] = (), resource: str = None,
+            max_retries: int = 0, retry_delay: float = 0) -> DagTask:
+        """添加任务，依赖的任务可以在运行前任意时刻添加"""
+        if name in self.tasks:
+            raise ValueError(f"任务 {name} 已存在")
+        task = DagTask(name, func, depends_on, resource, max_retries, retry_delay)
+        self.tasks[name] = task
+        return task
+
+    def _validate(self):
+        """检查依赖的任务是否存在以及是否有环"""
+        for task in self.tasks.values():
+            for dependency in task.depends_on:
+                if dependency not in self.tasks:
+                    raise ValueError(f"任务 {task.name} 依赖的任务 {dependency} 不存在")
+        remaining = {name: set(task.depends_on) for name, task in self.tasks.items()}
+        while remaining:
+            ready = [name for name, dependencies in remaining.items() if not dependencies & remaining.keys()]
+            if not ready:
+                raise ValueError(f"任务依赖存在环: {', '.join(sorted(remaining))}")
+            for name in ready:
+                del remaining[name]
+
+    def _block_dependents(self):
+        """依赖失败或被阻塞任务的待运行任务标记为阻塞"""
+        changed = True
+        while changed:
+            changed = False
+            for task in self.tasks.values():
+                if task.status == PENDING and any(self.tasks[d].status in (FAILED, BLOCKED) for d in task.depends_on):
+                    task.status = BLOCKED
+                    task.error = "依赖的任务失败"
+                    changed = True
+
+    def _ready_tasks(self, now: float) -> List[DagTask]:
+        return [
+            task for task in self.tasks.values()
+            if task.status == PENDING
+            and (task.retry_at is None or task.retry_at <= now)
+            and all(self.tasks[d].status == SUCCESS for d in task.depends_on)
+        ]
+
+    def run(self) -> bool:
+        """
+        执行所有未成功的任务
+
+        返回:
+        - 全部任务成功时返回True；否则返回False，失败原因见各任务的 error，可以再次调用 run 继续执行
+        """
+        self._validate()
+        for task in self.tasks.values():
+            if task.status != SUCCESS:
+                task.status = PENDING
+                task.error = None
+                task.retry_at = None
+        # 本次运行中每个任务已尝试的次数
+        tries = defaultdict(int)
+        in_use = defaultdict(int)
+        running = {}
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.tasks))) as executor:
+            while True:
+                now = time.time()
+                for task in self._ready_tasks(now):
+                    if task.resource is not None and in_use[task.resource] >= self.limits.get(task.resource, float("inf")):
+                        continue
+                    in_use[task.resource] += 1
+                    tries[task.name] += 1
+                    task.attempts += 1
+                    task.status = RUNNING
+                    task.started_at = now
+                    logger.info(f"[{self.name}] 开始任务 {task.name} (第 {tries[task.name]} 次)")
+                    running[executor.submit(task.func)] = task
+
+                if not running:
+                    waiting = [task.retry_at for task in self.tasks.values() if task.status == PENDING and task.retry_at]
+                    if not waiting:
+                        break
+                    time.sleep(max(0.0, min(waiting) - time.time()))
+                    continue
+
+                retry_times = [task.retry_at for task in self.tasks.values() if task.status == PENDING and task.retry_at]
+                timeout = max(0.0, min(retry_times) - time.time()) if retry_times else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    in_use[task.resource] -= 1
+                    task.finished_at = time.time()
+                    task.elapsed += task.finished_at - task.started_at
+                    error = future.exception()
+                    if error is None:
+                        task.status = SUCCESS
+                        task.retry_at = None
+                        logger.info(f"[{self.name}] 任务 {task.name} 完成，耗时 {task.finished_at - task.started_at:.2f} 秒")
+                    elif tries[task.name] <= task.max_retries:
+                        task.status = PENDING
+                        task.retry_at = task.finished_at + task.retry_delay
+                        logger.warning(f"[{self.name}] 任务 {task.name} 失败，{task.retry_delay} 秒后重试: {error}")
+                    else:
+                        task.status = FAILED
+                        task.error = str(error)
+                        logger.error(f"[{self.name}] 任务 {task.name} 失败: {error}")
+                    if self.on_task_done is not None:
+                        self.on_task_done(task)
+                self._block_dependents()
+
+        self._log_summary(time.time() - start_time)
+        return all(task.status == SUCCESS for task in self.tasks.values())
+
+    def _log_summary(self, wall_time: float):
+        serial_time = sum(task.elapsed for task in self.tasks.values())
+        logger.info(f"[{self.name}] 运行结束，总耗时 {wall_time:.2f} 秒（各任务耗时合计 {serial_time:.2f} 秒）")
+        for task in self.tasks.values():
+            message = f"[{self.name}]   {task.name}: {task.status}, 尝试 {task.attempts} 次, 耗时 {task.elapsed:.2f} 秒"
+            if task.error:
+                message += f", 错误: {task.error}"
+            logger.info(message)
+
+    def summary(self) -> List[Dict[str, object]]:
+        """各任务的状态、尝试次数、耗时和错误"""
+        return [task.to_dict() for task in self.tasks.values()]
@@ -0,0 +1,279 @@
+# src/utils/derived_maintenance.py
+"""
+此模块提供 derived_stock / derived_index 的批量维护功能。
+日常写入时衍生表由 daily_stock / daily_index 上的行级触发器维护（见 sql2build）；
+全量下载等大批量写入时可以在一个会话内暂停触发器，写入完成后按受影响的(代码, 日期范围)
+用一条集合语句重新计算 real_change，避免每写入一行就执行一次触发器。
+批量刷新的计算方式必须与触发器一致，bulk_load_enabled 在首次使用前用一个临时代码在回滚的事务中
+比较触发器和批量刷新的结果，不一致或数据库用户没有权限暂停触发器时不使用批量模式，仍由触发器逐行维护。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import math
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.models.index import IndexDailyData
+from ..database.models.stock import StockDailyData
+from ..database.session import engine
+
+# 日线表与其衍生表的对应关系
+DERIVED_TABLES = {
+    "daily_stock": "derived_stock",
+    "daily_index": "derived_index",
+}
+
+# real_change 的计算方式：收盘价相对上一交易日收盘价的涨跌幅（百分比），每个代码的第一个交易日为NULL
+# 需要与数据库中触发器函数 update_derived_on_change 的计算方式保持一致（由 verify_refresh_expression 检查）
+REAL_CHANGE_EXPRESSION = "(d.close / NULLIF(lag(d.close) OVER (PARTITION BY d.symbol ORDER BY d.date), 0) - 1) * 100"
+
+# 重新计算受影响范围内 real_change 的SQL
+# 计算范围向前扩展到范围前的最后一个交易日（提供lag所需的收盘价），向后扩展到范围后的第一个交易日（其涨跌幅依赖范围内的最后收盘价）
+_REFRESH_SQL = """
+WITH affected AS (
+    SELECT a.symbol, a.start_date, a.end_date,
+           COALESCE((SELECT max(p.date) FROM {source} p WHERE p.symbol = a.symbol AND p.date < a.start_date), a.start_date) AS window_start,
+           COALESCE((SELECT min(n.date) FROM {source} n WHERE n.symbol = a.symbol AND n.date > a.end_date), a.end_date) AS window_end
+    FROM unnest(CAST(:symbols AS varchar[]), CAST(:start_dates AS date[]), CAST(:end_dates AS date[])) AS a(symbol, start_date, end_date)
+),
+recomputed AS (
+    SELECT d.symbol, d.date, a.start_date, {expression} AS real_change
+    FROM {source} d
+    JOIN affected a ON d.symbol = a.symbol AND d.date >= a.window_start AND d.date <= a.window_end
+)
+INSERT INTO {derived} (symbol, date, real_change)
+SELECT symbol, date, real_change FROM recomputed WHERE date >= start_date
+ON CONFLICT (symbol, date) DO UPDATE SET real_change = excluded.real_change
+"""
+
+
+# 检查计算方式时使用的临时代码和日线，所在事务最后回滚，不会留在数据库中
+_VERIFY_SYMBOL = "__verify__"
+_VERIFY_CLOSES = [10.0, 10.5, 9.87, 9.87, 11.2, 3.3, 3.25]
+_VERIFY_MODELS = {
+    "daily_stock": StockDailyData,
+    "daily_index": IndexDailyData,
+}
+
+_RECOMPUTE_SQL = """
+SELECT d.date, {expression} AS real_change
+FROM {source} d
+WHERE d.symbol = :symbol
+"""
+
+_bulk_check_lock = threading.Lock()
+_bulk_check_result: Optional[bool] = None
+
+
+def _verify_rows(source_table: str):
+    """临时代码的日线，收盘价包含上涨、不变和下跌的情况"""
+    rows = []
+    previous = None
+    for offset, close in enumerate(_VERIFY_CLOSES):
+        row = {"symbol": _VERIFY_SYMBOL, "date": date(1900, 1, 1) + timedelta(days=offset), "open": close, "close": close,
+               "high": close, "low": close, "volume": 1000 + offset, "amount": 10000 + offset}
+        if source_table == "daily_stock":
+            row.update(outstanding_share=1e8, turnover=0.1)
+        else:
+            change = close - previous if previous is not None else None
+            row.update(amplitude=0.0, change_amount=change, turnover_rate=0.1,
+                       change_rate=change / previous * 100 if previous else None)
+        rows.append(row)
+        previous = close
+    return rows
+
+
+def verify_refresh_expression(source_table: str) -> Optional[str]:
+    """
+    在回滚的事务中写入临时代码的日线，比较触发器生成的 real_change 与 REAL_CHANGE_EXPRESSION 的计算结果
+
+    返回:
+    - 不一致的说明；一致时返回None
+    """
+    derived_table = DERIVED_TABLES[source_table]
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            connection.execute(insert(_VERIFY_MODELS[source_table]), _verify_rows(source_table))
+            by_trigger = dict(connection.execute(
+                text(f"SELECT date, real_change FROM {derived_table} WHERE symbol = :symbol"), {"symbol": _VERIFY_SYMBOL}
+            ).fetchall())
+            by_refresh = dict(connection.execute(
+                text(_RECOMPUTE_SQL.format(source=source_table, expression=REAL_CHANGE_EXPRESSION)), {"symbol": _VERIFY_SYMBOL}
+            ).fetchall())
+        finally:
+            transaction.rollback()
+    if not by_trigger:
+        return f"{source_table} 上的触发器没有生成 {derived_table} 数据"
+    for day, expected in sorted(by_refresh.items()):
+        if day not in by_trigger:
+            return f"触发器没有生成 {day} 的 {derived_table} 数据"
+        actual = by_trigger[day]
+        if (actual is None) != (expected is None) or (actual is not None and not math.isclose(actual, expected, rel_tol=1e-9, abs_tol=1e-9)):
+            return f"{day} 的 real_change 触发器为 {actual}，批量刷新为 {expected}"
+    return None
+
+
+def _replication_role_denied() -> Optional[str]:
+    """
+    检查当前数据库用户能否设置 session_replication_role（在回滚的事务中设置，不影响连接池中的连接）
+
+    返回:
+    - 没有权限时返回数据库的错误信息；有权限时返回None
+    """
+    with engine.connect() as connection:
+        try:
+            connection.execute(text("SET session_replication_role = replica"))
+        except DBAPIError as e:
+            # 42501: insufficient_privilege
+            if getattr(e.orig, "pgcode", None) == "42501":
+                return str(e.orig).strip()
+            raise
+        finally:
+            connection.rollback()
+    return None
+
+
+def bulk_load_enabled() -> bool:
+    """
+    是否使用批量写入模式：需要开启 DERIVED_BULK_LOAD、数据库用户有权限暂停触发器，并且批量刷新与触发器的计算结果一致
+    检查在每个进程中只执行一次
+    """
+    global _bulk_check_result
+    if not config.DERIVED_BULK_LOAD:
+        return False
+    with _bulk_check_lock:
+        if _bulk_check_result is None:
+            try:
+                denied = _replication_role_denied()
+                problems = [] if denied else [problem for problem in map(verify_refresh_expression, DERIVED_TABLES) if problem]
+            except Exception as e:
+                denied, problems = None, [f"检查失败: {e}"]
+            _bulk_check_result = not denied and not problems
+            if denied:
+                logger.warning(f"数据库用户不能设置 session_replication_role，不使用批量写入模式，由触发器逐行维护衍生表: {denied}")
+            elif problems:
+                logger.error(f"批量刷新与触发器的计算方式不一致，不使用批量写入模式: {'; '.join(problems)}")
+            else:
+                logger.info("批量刷新与触发器的计算方式一致，使用批量写入模式")
+        return _bulk_check_result
+
+
+def refresh_derived(db: Session, source_table: str, ranges: Dict[str, Tuple[date, date]]) -> int:
+    """
+    用一条集合语句重新计算指定代码和日期范围内的 real_change，并写入对应的衍生表
+
+    参数:
+    - source_table: daily_stock 或 daily_index
+    - ranges: {代码: (起始日期, 结束日期)}
+
+    返回:
+    - 写入的衍生表行数
+    """
+    if source_table not in DERIVED_TABLES:
+        raise ValueError(f"没有为 {source_table} 定义衍生表")
+    if not ranges:
+        return 0
+    symbols = list(ranges)
+    sql = _REFRESH_SQL.format(source=source_table, derived=DERIVED_TABLES[source_table], expression=REAL_CHANGE_EXPRESSION)
+    result = db.execute(text(sql), {
+        "symbols": symbols,
+        "start_dates": [ranges[symbol][0] for symbol in symbols],
+        "end_dates": [ranges[symbol][1] for symbol in symbols],
+    })
+    return result.rowcount
+
+
+class BulkDerivedLoad:
+    """
+    批量写入日线数据时暂停行级触发器，结束时一次性刷新衍生表。
+
+    在独立连接上设置 session_replication_role = replica，使普通触发器在该会话内不再执行，
+    其他会话不受影响；通过 db 属性获取绑定在该连接上的会话写入数据，并用 mark 记录受影响的日期范围。
+    正常退出时按表各执行一条 refresh_derived 并恢复触发器；异常退出时已提交的数据仍然需要刷新，
+    同样会执行刷新后再抛出异常。
+    设置 session_replication_role 需要超级用户或被授予该参数权限的数据库用户。
+    日线通过 upsert 写入，每个代码一条 INSERT ... ON CONFLICT DO UPDATE；该会话不是线程安全的，
+    多个下载线程共用一个批量写入时 upsert 在 lock 内依次执行，每次只占用一条语句的时间。
+
+    用法:
+        with BulkDerivedLoad() as bulk_load:
+            saver.save_stock_daily_data_to_db(stock_data, symbol, bulk_load=bulk_load)  # 调用 bulk_load.upsert
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.db = None
+        self.lock = threading.Lock()
+        self.affected: Dict[str, Dict[str, Tuple[date, date]]] = {table: {} for table in DERIVED_TABLES}
+
+    def __enter__(self):
+        self.connection = engine.connect()
+        self.connection.execute(text("SET session_replication_role = replica"))
+        self.connection.commit()
+        self.db = Session(bind=self.connection)
+        logger.info("已暂停当前会话的行级触发器，开始批量写入")
+        return self
+
+    def upsert(self, model, rows: List[Dict[str, Any]]) -> int:
+        """
+        用一条 INSERT ... ON CONFLICT DO UPDATE 写入一个代码的日线，并记录受影响的日期
+
+        参数:
+        - model: StockDailyData 或 IndexDailyData
+        - rows: 同一代码的日线字典列表，日期不能重复
+
+        返回:
+        - 写入的行数
+        """
+        if not rows:
+            return 0
+        stmt = pg_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["symbol", "date"],
+            set_={column: getattr(stmt.excluded, column) for column in rows[0] if column not in ("symbol", "date")}
+        )
+        with self.lock:
+            try:
+                self.db.execute(stmt, rows)
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+            self.mark(model.__tablename__, rows[0]["symbol"], [row["date"] for row in rows])
+        return len(rows)
+
+    def mark(self, source_table: str, symbol: str, dates: Iterable[date]):
+        """记录某个代码被写入的交易日，合并为该代码受影响的日期范围"""
+        dates = list(dates)
+        if not dates:
+            return
+        start_date, end_date = min(dates), max(dates)
+        if symbol in self.affected[source_table]:
+            old_start, old_end = self.affected[source_table][symbol]
+            start_date, end_date = min(start_date, old_start), max(end_date, old_end)
+        self.affected[source_table][symbol] = (start_date, end_date)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.db.rollback()
+            for source_table, ranges in self.affected.items():
+                if ranges:
+                    count = refresh_derived(self.db, source_table, ranges)
+                    logger.info(f"已刷新 {DERIVED_TABLES[source_table]}: {len(ranges)} 个代码, {count} 行")
+            self.db.commit()
+        finally:
+            self.db.close()
+            self.connection.execute(text("RESET session_replication_role"))
+            self.connection.commit()
+            self.connection.close()
+        return False
@@ -0,0 +1,159 @@
+# src/utils/gap_detector.py
+"""
+此模块负责检测日线表中缺失的交易日，并生成补全数据的下载计划。
+在数据库中用一条语句把每个代码的存续期（第一条日线至最近交易日）与交易日历做反连接，
+把连续缺失的交易日合并为(代码, 起始日期, 结束日期)区间，下载时只请求这些区间。
+已下载过的区间记录在 gap_fetch_log 中，区间内仍然没有日线的交易日（停牌）不再视为缺失；
+最后一条日线之后的区间下载为空（退市或长期停牌）时，该代码的存续期截止到最后一条日线，
+之后是否恢复交易由增量更新负责，补全计划因此会收敛而不是每次重复请求同样的区间。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from datetime import date, datetime
+from typing import Iterable, List, NamedTuple, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.models.gap_fetch import GapFetchLog
+from .trading_calendar import trading_calendar, get_latest_trading_day
+
+# 可检测的数据源: {名称: 日线表}
+GAP_SOURCES = {
+    "stock": "daily_stock",
+    "index": "daily_index",
+}
+# 同一代码相邻两个缺失区间之间相隔不超过该交易日数时合并为一次下载
+MERGE_GAP_TRADING_DAYS = 5
+
+# 检测缺失区间的SQL：交易日历以带序号的数组传入，缺失交易日的序号减去其在该代码缺失日中的行号相同即为同一个连续区间
+_GAP_SQL = """
+WITH calendar AS (
+    SELECT c.date, c.idx
+    FROM unnest(CAST(:trade_dates AS date[])) WITH ORDINALITY AS c(date, idx)
+),
+bars AS (
+    SELECT symbol, min(date) AS first_date, max(date) AS last_bar
+    FROM {table}
+    {symbol_filter}
+    GROUP BY symbol
+),
+lifetime AS (
+    -- 最后一条日线之后已下载过且没有数据的代码视为已停止交易，存续期截止到最后一条日线
+    SELECT b.symbol, b.first_date,
+           CASE WHEN EXISTS (
+               SELECT 1 FROM gap_fetch_log f
+               WHERE f.source = :source AND f.symbol = b.symbol AND f.start_date > b.last_bar AND f.row_count = 0
+           ) THEN b.last_bar END AS last_date
+    FROM bars b
+),
+missing AS (
+    SELECT l.symbol, c.date, c.idx
+    FROM lifetime l
+    JOIN calendar c ON c.date >= l.first_date AND (l.last_date IS NULL OR c.date <= l.last_date)
+    WHERE NOT EXISTS (SELECT 1 FROM {table} d WHERE d.symbol = l.symbol AND d.date = c.date)
+      -- 已下载过的区间内仍然没有日线的交易日是上游没有数据（停牌），不再视为缺失
+      AND NOT EXISTS (
+          SELECT 1 FROM gap_fetch_log f
+          WHERE f.source = :source AND f.symbol = l.symbol AND c.date BETWEEN f.start_date AND f.end_date
+      )
+)
+SELECT symbol, min(date) AS start_date, max(date) AS end_date,
+       min(idx) AS start_idx, max(idx) AS end_idx, count(*) AS missing_days
+FROM (
+    SELECT symbol, date, idx, idx - row_number() OVER (PARTITION BY symbol ORDER BY idx) AS island
+    FROM missing
+) m
+GROUP BY symbol, island
+ORDER BY symbol, start_date
+"""
+
+
+class FetchSpan(NamedTuple):
+    """下载计划中的一次请求"""
+    symbol: str
+    start_date: date
+    end_date: date
+    missing_days: int  # 区间内缺失的交易日数（合并后的区间包含少量已有的交易日）
+
+
+def detect_gaps(db: Session, source: str, symbols: List[str] = None, end_date: date = None) -> pd.DataFrame:
+    """
+    检测日线表中每个代码缺失的交易日区间
+
+    只检测日线表中已有数据的代码，从其第一条日线开始到 end_date；
+    gap_fetch_log 中已下载过的区间不再检测，最后一条日线之后下载为空的代码只检测到最后一条日线。
+
+    参数:
+    - source: GAP_SOURCES 中的数据源，stock 或 index
+    - symbols: 只检测这些代码，默认为日线表中的全部代码
+    - end_date: 检测到该日期为止，默认为最近交易日
+
+    返回:
+    - symbol, start_date, end_date, start_idx, end_idx, missing_days 列的DataFrame，idx为交易日在日历中的序号
+    """
+    end_date = end_date or get_latest_trading_day()
+    trade_dates = trading_calendar.trading_days_between(datetime.strptime(config.START_DATE, "%Y%m%d").date(), end_date)
+    params = {"trade_dates": trade_dates, "source": source}
+    symbol_filter = ""
+    if symbols is not None:
+        symbol_filter = "WHERE symbol = ANY(CAST(:symbols AS varchar[]))"
+        params["symbols"] = list(symbols)
+    sql = _GAP_SQL.format(table=GAP_SOURCES[source], symbol_filter=symbol_filter)
+    rows = db.execute(text(sql), params).fetchall()
+    gaps = pd.DataFrame(rows, columns=["symbol", "start_date", "end_date", "start_idx", "end_idx", "missing_days"])
+    logger.info(f"{source} 缺失检测完成: {gaps['symbol'].nunique()} 个代码, {len(gaps)} 个区间, {int(gaps['missing_days'].sum())} 个交易日")
+    return gaps
+
+
+def build_fetch_plan(gaps: pd.DataFrame, merge_within: int = MERGE_GAP_TRADING_DAYS) -> List[FetchSpan]:
+    """
+    将缺失区间合并为下载计划：同一代码相隔不超过 merge_within 个交易日的区间合并为一次请求
+
+    参数:
+    - gaps: detect_gaps 的返回值
+    - merge_within: 合并的最大间隔交易日数，0表示不合并
+
+    返回:
+    - 按代码和日期排序的 FetchSpan 列表
+    """
+    plan = []
+    for symbol, symbol_gaps in gaps.sort_values(["symbol", "start_idx"]).groupby("symbol", sort=False):
+        current = None
+        for gap in symbol_gaps.itertuples(index=False):
+            if current is not None and gap.start_idx - current["end_idx"] - 1 <= merge_within:
+                current.update(end_date=gap.end_date, end_idx=gap.end_idx, missing_days=current["missing_days"] + gap.missing_days)
+                continue
+            if current is not None:
+                plan.append(FetchSpan(symbol, current["start_date"], current["end_date"], int(current["missing_days"])))
+            current = {"start_date": gap.start_date, "end_date": gap.end_date, "end_idx": gap.end_idx, "missing_days": gap.missing_days}
+        if current is not None:
+            plan.append(FetchSpan(symbol, current["start_date"], current["end_date"], int(current["missing_days"])))
+    return plan
+
+
+def record_fetched_spans(db: Session, source: str, spans: Iterable[Tuple[FetchSpan, int]]):
+    """
+    记录已成功下载的区间及上游返回的行数，之后的缺失检测跳过这些区间
+
+    参数:
+    - spans: (下载的区间, 返回的行数) 列表
+    """
+    rows = [
+        {"source": source, "symbol": span.symbol, "start_date": span.start_date, "end_date": span.end_date, "row_count": count}
+        for span, count in spans
+    ]
+    if not rows:
+        return
+    stmt = pg_insert(GapFetchLog)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["source", "symbol", "start_date"],
+        set_={"end_date": stmt.excluded.end_date, "row_count": stmt.excluded.row_count, "fetched_at": stmt.excluded.fetched_at},
+    )
+    db.execute(stmt, rows)
+    db.commit()
@@ -0,0 +1,227 @@
+# src/utils/indicator_store.py
+"""
+此模块负责维护技术指标表 stock_indicator。
+每次日线数据写入后运行，每只股票从 stock_indicator_state 中保存的窗口尾部数据和EMA递推值出发，
+只对新增交易日用NumPy计算均线、日收益率、波动率、ATR和EMA，不再重读全部历史。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import time
+from typing import Dict, List, Tuple, Any
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.logger import logger
+from ..database.models.indicator import StockIndicator, StockIndicatorState
+from ..database.models.info import StockInfo
+from ..database.models.stock import StockDailyData
+from ..database.session import SessionLocal
+
+# 均线窗口（交易日）
+MA_WINDOWS = [5, 10, 20, 60]
+# 波动率窗口（交易日）
+VOLATILITY_WINDOW = 20
+# ATR的Wilder平滑周期
+ATR_PERIOD = 14
+# EMA周期
+EMA_PERIODS = [12, 26]
+# 每批处理的股票数
+BATCH_SIZE = 200
+
+
+def _rolling_window_mean(values: np.ndarray, window: int, first_output: int) -> np.ndarray:
+    """用前缀和计算values中从first_output开始每个位置的window日均值，数据不足的位置为NaN"""
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(first_output, len(values)) + 1
+    starts = ends - window
+    result = np.full(len(ends), np.nan)
+    full = starts >= 0
+    result[full] = (cumulative[ends[full]] - cumulative[starts[full]]) / window
+    return result
+
+
+def _ema(values: np.ndarray, alpha: float, carry: float = None) -> np.ndarray:
+    """以上一交易日的EMA为起点递推新交易日的EMA，没有起点时以第一个值为起点"""
+    if carry is not None:
+        values = np.concatenate(([carry], values))
+    result = pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return result[1:] if carry is not None else result
+
+
+def compute_indicator_tail(bars: pd.DataFrame, state: Dict[str, Any] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    计算一只股票新增交易日的技术指标
+
+    参数:
+    - bars: 新增交易日的 date, close, high, low，按日期升序
+    - state: stock_indicator_state 中保存的状态，None表示从头计算
+
+    返回:
+    - 新增交易日的指标（列与 stock_indicator 表一致，不含symbol）
+    - 计算后的新状态
+    """
+    state = state or {"bar_count": 0, "closes": [], "returns": [], "ema12": None, "ema26": None, "atr_14": None}
+    closes = bars["close"].to_numpy(dtype=np.float64)
+    highs = bars["high"].fillna(bars["close"]).to_numpy(dtype=np.float64)
+    lows = bars["low"].fillna(bars["close"]).to_numpy(dtype=np.float64)
+    tail = np.asarray(state["closes"], dtype=np.float64)
+    all_closes = np.concatenate((tail, closes))
+    result = pd.DataFrame({"date": bars["date"].to_numpy()})
+
+    for window in MA_WINDOWS:
+        result[f"ma{window}"] = _rolling_window_mean(all_closes, window, len(tail))
+
+    # 日收益率：第一个交易日没有前收盘价
+    previous_closes = all_closes[len(tail) - 1:-1] if len(tail) else np.concatenate(([np.nan], closes[:-1]))
+    returns = (closes / previous_closes - 1) * 100
+    result["return_1d"] = returns
+
+    # 波动率：只使用有效收益率序列，窗口内不足VOLATILITY_WINDOW个收益率时为NaN
+    return_tail = np.asarray(state["returns"], dtype=np.float64)
+    valid_returns = returns[~np.isnan(returns)]
+    all_returns = np.concatenate((return_tail, valid_returns))
+    ends = len(return_tail) + np.cumsum(~np.isnan(returns))
+    cumulative = np.concatenate(([0.0], np.cumsum(all_returns)))
+    cumulative_squares = np.concatenate(([0.0], np.cumsum(all_returns ** 2)))
+    starts = ends - VOLATILITY_WINDOW
+    volatility = np.full(len(closes), np.nan)
+    full = starts >= 0
+    window_sum = cumulative[ends[full]] - cumulative[starts[full]]
+    window_squares = cumulative_squares[ends[full]] - cumulative_squares[starts[full]]
+    variance = (window_squares - window_sum ** 2 / VOLATILITY_WINDOW) / (VOLATILITY_WINDOW - 1)
+    volatility[full] = np.sqrt(np.maximum(variance, 0.0))
+    result[f"volatility_{VOLATILITY_WINDOW}"] = volatility
+
+    # ATR：真实波幅的Wilder平滑，不足ATR_PERIOD个交易日时不输出
+    true_range = np.maximum.reduce([
+        highs - lows,
+        np.abs(highs - previous_closes),
+        np.abs(lows - previous_closes),
+    ])
+    true_range = np.where(np.isnan(previous_closes), highs - lows, true_range)
+    atr = _ema(true_range, 1 / ATR_PERIOD, state["atr_14"])
+    bar_numbers = state["bar_count"] + np.arange(1, len(closes) + 1)
+    result[f"atr_{ATR_PERIOD}"] = np.where(bar_numbers >= ATR_PERIOD, atr, np.nan)
+
+    emas = {}
+    for period in EMA_PERIODS:
+        emas[period] = _ema(closes, 2 / (period + 1), state[f"ema{period}"])
+        result[f"ema{period}"] = emas[period]
+
+    new_state = {
+        "bar_count": int(state["bar_count"] + len(closes)),
+        "closes": all_closes[-max(MA_WINDOWS):].tolist(),
+        "returns": all_returns[-VOLATILITY_WINDOW:].tolist(),
+        "atr_14": float(atr[-1]),
+    }
+    for period in EMA_PERIODS:
+        new_state[f"ema{period}"] = float(emas[period][-1])
+    return result, new_state
+
+
+def _load_states(db: Session, symbols: List[str]) -> Dict[str, Dict[str, Any]]:
+    states = {}
+    for state in db.query(StockIndicatorState).filter(StockIndicatorState.symbol.in_(symbols)).all():
+        states[state.symbol] = {
+            "last_date": state.last_date,
+            "bar_count": state.bar_count,
+            "closes": state.closes,
+            "returns": state.returns,
+            "ema12": state.ema12,
+            "ema26": state.ema26,
+            "atr_14": state.atr_14,
+        }
+    return states
+
+
+def _save_batch(db: Session, indicator_rows: List[Dict[str, Any]], state_rows: List[Dict[str, Any]]):
+    """用批量upsert写入一批股票的指标和状态"""
+    if indicator_rows:
+        stmt = pg_insert(StockIndicator)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["symbol", "date"],
+            set_={column: getattr(stmt.excluded, column) for column in indicator_rows[0] if column not in ("symbol", "date")}
+        )
+        db.execute(stmt, indicator_rows)
+    if state_rows:
+        stmt = pg_insert(StockIndicatorState)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["symbol"],
+            set_={column: getattr(stmt.excluded, column) for column in state_rows[0] if column != "symbol"}
+        )
+        db.execute(stmt, state_rows)
+
+
+def update_stock_indicators(symbols: List[str] = None, rebuild: bool = False):
+    """
+    增量更新技术指标
+    每只股票只读取并计算 stock_indicator_state.last_date 之后的交易日；没有状态或rebuild为True时从头计算
+
+    参数:
+    - symbols: 只更新这些股票，默认为stock_info中的全部股票
+    - rebuild: 忽略已保存的状态，重新计算全部历史（修正了历史日线数据后使用）
+    """
+    start_time = time.time()
+    db = SessionLocal()
+    try:
+        if symbols is None:
+            symbols = [symbol for symbol, in db.query(StockInfo.symbol).all()]
+        updated_symbols = 0
+        written_rows = 0
+
+        for batch_start in range(0, len(symbols), BATCH_SIZE):
+            batch = symbols[batch_start:batch_start + BATCH_SIZE]
+            states = {} if rebuild else _load_states(db, batch)
+
+            # 整批一次查询：都有状态时只读取最早的最后交易日之后的数据
+            query = db.query(StockDailyData.symbol, StockDailyData.date, StockDailyData.close, StockDailyData.high, StockDailyData.low).filter(
+                StockDailyData.symbol.in_(batch),
+                StockDailyData.close.isnot(None)
+            )
+            if states and len(states) == len(batch):
+                query = query.filter(StockDailyData.date > min(state["last_date"] for state in states.values()))
+            bars = pd.DataFrame(query.all(), columns=["symbol", "date", "close", "high", "low"])
+
+            indicator_rows = []
+            state_rows = []
+            for symbol, symbol_bars in bars.groupby("symbol", sort=False):
+                state = states.get(symbol)
+                if state:
+                    symbol_bars = symbol_bars[symbol_bars["date"] > state["last_date"]]
+                if symbol_bars.empty:
+                    continue
+                symbol_bars = symbol_bars.sort_values("date")
+                indicators, new_state = compute_indicator_tail(symbol_bars, state)
+                indicators.insert(0, "symbol", symbol)
+                indicator_rows.extend(indicators.astype(object).where(indicators.notna(), None).to_dict("records"))
+                new_state.update(symbol=symbol, last_date=symbol_bars["date"].iloc[-1])
+                state_rows.append(new_state)
+
+            _save_batch(db, indicator_rows, state_rows)
+            db.commit()
+            updated_symbols += len(state_rows)
+            written_rows += len(indicator_rows)
+
+        elapsed_time = time.time() - start_time
+        per_symbol = elapsed_time / updated_symbols * 1000 if updated_symbols else 0
+        logger.info(f"技术指标更新完成: {updated_symbols} 只股票, {written_rows} 行, 耗时 {elapsed_time:.2f} 秒 (每只股票 {per_symbol:.1f} 毫秒)")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"技术指标更新失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="增量更新技术指标")
+    parser.add_argument("symbols", nargs="*", help="只更新这些股票，默认为全部")
+    parser.add_argument("--rebuild", action="store_true", help="忽略已保存的状态，重新计算全部历史")
+    args = parser.parse_args()
+    update_stock_indicators(symbols=args.symbols or None, rebuild=args.rebuild)
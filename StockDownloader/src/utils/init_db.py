@@ -35,6 +35,15 @@ from ..database.models import StockDailyData, IndexDailyData, StockInfo, IndexIn
 from ..database.models.etf import ETFDailyData
 from ..database.models.hot_rank import StockHotRank
 from ..database.models.info import ETFInfo
+from ..database.models.correlation import StockIndexCorrelation, StockIndexRollingCorrelation, UniverseCorrelation
+from ..database.models.indicator import StockIndicator, StockIndicatorState
+from ..database.models.snapshot import StockDailySnapshot
+from ..database.models.period_bar import StockPeriodBar, IndexPeriodBar
+from ..database.models.work_queue import IngestionJob
+from ..database.models.job_run import JobRun
+from ..database.models.dead_letter import IngestionDeadLetter
+from ..database.models.rebuild_journal import RebuildRun, RebuildCheckpoint
+from ..database.models.gap_fetch import GapFetchLog
 
 
 def init_database():
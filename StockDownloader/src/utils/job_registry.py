@@ -0,0 +1,247 @@
+# src/utils/job_registry.py
+"""
+此模块提供基于数据库的后台任务登记。
+网页端和每日更新在 job_run 表中登记每次运行的任务，记录参数、状态、进度和错误信息，
+每个任务声明占用的资源类别（如 network、db_write、cpu），登记新任务时在PostgreSQL事务级咨询锁内
+按 config.JOB_RESOURCE_BUDGETS 检查运行中任务已占用的资源，不冲突的任务可以同时运行，
+占用 exclusive 的任务（如重建数据库）与所有任务冲突，多个Web进程之间不会同时启动冲突的任务；
+运行中的任务由后台线程定期写入心跳，心跳超时的任务（进程崩溃或重启）被标记为失败，不会永远占用。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, text
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.models.job_run import JobRun
+from ..database.session import SessionLocal
+from .work_queue import default_worker_id
+
+# 任务状态
+RUNNING = "running"
+SUCCESS = "success"
+ERROR = "error"
+
+# 与所有任务冲突的资源类别
+EXCLUSIVE = "exclusive"
+# 等待资源时重新检查的间隔（秒）
+ADMISSION_POLL_SECONDS = 30
+
+# 登记任务时串行化冲突检查和插入，锁在事务结束时自动释放
+_ADMISSION_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('job_run'))"
+
+# 心跳超时的运行中任务标记为失败
+_EXPIRE_SQL = """
+UPDATE job_run
+SET status = 'error', finished_at = now(), message = '任务进程已退出（心跳超时）',
+    last_error = COALESCE(last_error, '任务进程已退出（心跳超时）')
+WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => :stale_seconds)
+"""
+
+_RUNNING_SQL = "SELECT id, job_type, resources FROM job_run WHERE status = 'running' ORDER BY id"
+
+# 每种任务类型最近一次运行的记录
+_LATEST_SQL = """
+SELECT DISTINCT ON (job_type) *
+FROM job_run
+WHERE job_type = ANY(CAST(:job_types AS varchar[]))
+ORDER BY job_type, id DESC
+"""
+
+
+def find_conflict(running, resources: Dict[str, int]) -> Optional[str]:
+    """
+    检查新任务能否与运行中的任务同时运行
+
+    参数:
+    - running: 运行中任务的 (ID, 任务类型, 占用的资源) 列表
+    - resources: 新任务占用的资源 {资源类别: 数量}
+
+    返回:
+    - 冲突原因；可以运行时返回None
+    """
+    resources = resources or {}
+    if running and EXCLUSIVE in resources:
+        return f"需要独占运行，任务 {running[0][1]} (ID {running[0][0]}) 正在运行"
+    in_use = {}
+    for job_id, job_type, job_resources in running:
+        if EXCLUSIVE in (job_resources or {}):
+            return f"任务 {job_type} (ID {job_id}) 正在独占运行"
+        for name, amount in (job_resources or {}).items():
+            in_use[name] = in_use.get(name, 0) + amount
+    for name, amount in resources.items():
+        budget = config.JOB_RESOURCE_BUDGETS.get(name)
+        if budget is not None and in_use.get(name, 0) + amount > budget:
+            holders = [f"{job_type} (ID {job_id})" for job_id, job_type, job_resources in running if name in (job_resources or {})]
+            return f"资源 {name} 已被 {', '.join(holders)} 占用"
+    return None
+
+
+def _running_jobs(db):
+    return [(row.id, row.job_type, row.resources) for row in db.execute(text(_RUNNING_SQL))]
+
+
+def start_job(job_type: str, params: Dict[str, object] = None, source: str = "server",
+              resources: Dict[str, int] = None, message: str = None, wait: bool = False) -> Optional[int]:
+    """
+    登记一个运行中的任务
+
+    参数:
+    - job_type: 任务类型
+    - params: 任务参数
+    - source: 触发来源
+    - resources: 占用的资源 {资源类别: 数量}，{EXCLUSIVE: 1} 表示与所有任务冲突；为空时不占用资源
+    - message: 初始进度说明
+    - wait: 资源不足时是否每隔 ADMISSION_POLL_SECONDS 秒重新检查，直到可以运行
+
+    返回:
+    - 任务ID；资源不足且不等待时返回None
+    """
+    resources = dict(resources or {})
+    while True:
+        db = SessionLocal()
+        try:
+            db.execute(text(_ADMISSION_LOCK_SQL))
+            db.execute(text(_EXPIRE_SQL), {"stale_seconds": config.JOB_STALE_SECONDS})
+            conflict = find_conflict(_running_jobs(db), resources)
+            if conflict is None:
+                job = JobRun(job_type=job_type, source=source, params=params or {}, resources=resources, status=RUNNING,
+                             message=message, progress_done=0, progress_total=0, owner=default_worker_id())
+                db.add(job)
+                db.commit()
+                logger.info(f"登记任务 {job_type} (ID {job.id})，占用资源 {resources}")
+                return job.id
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if not wait:
+            logger.info(f"任务 {job_type} 未启动: {conflict}")
+            return None
+        logger.info(f"任务 {job_type} 等待资源: {conflict}，{ADMISSION_POLL_SECONDS} 秒后重新检查")
+        time.sleep(ADMISSION_POLL_SECONDS)
+
+
+def admission_conflicts(job_resources: Dict[str, Dict[str, int]]) -> Dict[str, Optional[str]]:
+    """按当前运行中的任务检查各类任务能否启动，返回 {任务类型: 冲突原因或None}"""
+    db = SessionLocal()
+    try:
+        running = _running_jobs(db)
+    finally:
+        db.close()
+    return {job_type: find_conflict(running, resources) for job_type, resources in job_resources.items()}
+
+
+def update_job(job_id: int, message: str = None, done: int = None, total: int = None):
+    """更新任务的进度说明和进度，同时写入心跳；未传入的字段保持不变"""
+    # 时间由数据库生成，与 created_at 默认值和心跳超时检查使用同一时区
+    values = {"heartbeat_at": func.now()}
+    if message is not None:
+        values["message"] = message
+    if done is not None:
+        values["progress_done"] = done
+    if total is not None:
+        values["progress_total"] = total
+    db = SessionLocal()
+    try:
+        db.query(JobRun).filter(JobRun.id == job_id, JobRun.status == RUNNING).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def finish_job(job_id: int, error: str = None, message: str = None):
+    """记录任务结束，error 不为空时为失败；成功时的进度说明为 message（默认为"完成"）加结束时间"""
+    values = {"status": ERROR if error else SUCCESS, "finished_at": func.now(), "heartbeat_at": func.now()}
+    if error:
+        values["last_error"] = error[:2000]
+        values["message"] = f"错误: {error}"
+    else:
+        values["message"] = f"{message or '完成'} ({datetime.now().strftime('%H:%M:%S')})"
+    db = SessionLocal()
+    try:
+        db.query(JobRun).filter(JobRun.id == job_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _to_dict(row) -> Dict[str, object]:
+    job = dict(row)
+    for key in ("created_at", "heartbeat_at", "finished_at"):
+        if job.get(key) is not None:
+            job[key] = job[key].strftime("%Y-%m-%d %H:%M:%S")
+    return job
+
+
+def latest_jobs(job_types: Iterable[str]) -> Dict[str, Dict[str, object]]:
+    """每种任务类型最近一次运行的记录，没有运行过的类型不包含在结果中"""
+    db = SessionLocal()
+    try:
+        db.execute(text(_EXPIRE_SQL), {"stale_seconds": config.JOB_STALE_SECONDS})
+        db.commit()
+        rows = db.execute(text(_LATEST_SQL), {"job_types": list(job_types)}).mappings().all()
+        return {row["job_type"]: _to_dict(row) for row in rows}
+    finally:
+        db.close()
+
+
+def recent_jobs(limit: int = 20) -> List[Dict[str, object]]:
+    """最近登记的任务，按时间倒序"""
+    db = SessionLocal()
+    try:
+        rows = db.execute(text("SELECT * FROM job_run ORDER BY id DESC LIMIT :limit"), {"limit": limit}).mappings().all()
+        return [_to_dict(row) for row in rows]
+    finally:
+        db.close()
+
+
+class JobTracker:
+    """
+    跟踪一个已登记的任务：运行期间由后台线程定期写入心跳，退出时记录成功或失败。
+
+    用法:
+        job_id = start_job("update_data", resources={"network": 1, "db_write": 1})
+        with JobTracker(job_id, success_message="更新完成") as job:
+            job.progress(1, 2, "正在更新指数数据...")
+    """
+
+    def __init__(self, job_id: int, success_message: str = None):
+        self.job_id = job_id
+        self.success_message = success_message
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def progress(self, done: int = None, total: int = None, message: str = None):
+        try:
+            update_job(self.job_id, message=message, done=done, total=total)
+        except Exception as e:
+            logger.error(f"更新任务 {self.job_id} 的进度失败: {e}")
+
+    def _run(self):
+        while not self._stopped.wait(config.JOB_HEARTBEAT_SECONDS):
+            self.progress()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        finish_job(self.job_id, error=(str(exc_value) or exc_type.__name__) if exc_value is not None else None, message=self.success_message)
+        return False
+
+
+def track_job(job_type: str, params: Dict[str, object] = None, source: str = "server", resources: Dict[str, int] = None,
+              message: str = None) -> JobTracker:
+    """登记任务（资源不足时等待）并返回其跟踪器，用于定时任务等不能放弃运行的场景"""
+    return JobTracker(start_job(job_type, params, source, resources, message, wait=True))
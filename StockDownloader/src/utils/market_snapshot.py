@@ -0,0 +1,99 @@
+# src/utils/market_snapshot.py
+"""
+此模块负责维护和读取全市场截面表 stock_daily_snapshot。
+daily_stock 以(symbol, date)为主键，读取某一天的全市场数据需要在索引中分散读取；
+截面表每个交易日一行，日线写入后按受影响的日期重建，读取一天的全市场数据只需读取一行。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+from datetime import date, timedelta
+from typing import List
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..core.logger import logger
+from ..database.models.snapshot import StockDailySnapshot
+
+# 截面表中以数组保存的列，与 StockDailySnapshot 一致
+SNAPSHOT_COLUMNS = ["open", "close", "high", "low", "volume", "amount", "turnover", "real_change"]
+# 按日期范围重建时每条语句处理的最大天数，避免全量重建时单条语句过大
+REFRESH_CHUNK_DAYS = 366
+
+# 按日期重建截面的SQL：每个日期把当天所有股票聚合为按代码排序的数组
+_REFRESH_SQL = """
+INSERT INTO stock_daily_snapshot (date, symbols, open, close, high, low, volume, amount, turnover, real_change)
+SELECT d.date,
+       array_agg(d.symbol ORDER BY d.symbol),
+       array_agg(d.open ORDER BY d.symbol),
+       array_agg(d.close ORDER BY d.symbol),
+       array_agg(d.high ORDER BY d.symbol),
+       array_agg(d.low ORDER BY d.symbol),
+       array_agg(d.volume ORDER BY d.symbol),
+       array_agg(d.amount ORDER BY d.symbol),
+       array_agg(d.turnover ORDER BY d.symbol),
+       array_agg(ds.real_change ORDER BY d.symbol)
+FROM daily_stock d
+LEFT JOIN derived_stock ds ON ds.symbol = d.symbol AND ds.date = d.date
+WHERE d.date >= :start_date AND d.date <= :end_date
+GROUP BY d.date
+ON CONFLICT (date) DO UPDATE SET
+    symbols = excluded.symbols,
+    open = excluded.open,
+    close = excluded.close,
+    high = excluded.high,
+    low = excluded.low,
+    volume = excluded.volume,
+    amount = excluded.amount,
+    turnover = excluded.turnover,
+    real_change = excluded.real_change
+"""
+
+
+def refresh_stock_snapshots(db: Session, start_date: date, end_date: date) -> int:
+    """
+    重建日期范围内每个交易日的截面，由日线写入流程在写入完成后调用
+
+    返回:
+    - 重建的交易日数
+    """
+    refreshed = 0
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=REFRESH_CHUNK_DAYS - 1), end_date)
+        result = db.execute(text(_REFRESH_SQL), {"start_date": chunk_start, "end_date": chunk_end})
+        refreshed += result.rowcount
+        db.commit()
+        chunk_start = chunk_end + timedelta(days=1)
+    logger.info(f"已重建 {start_date} 至 {end_date} 的全市场截面: {refreshed} 个交易日")
+    return refreshed
+
+
+def _snapshot_to_frame(snapshot: StockDailySnapshot) -> pd.DataFrame:
+    frame = pd.DataFrame({column: getattr(snapshot, column) for column in SNAPSHOT_COLUMNS}, index=pd.Index(snapshot.symbols, name="symbol"))
+    frame.insert(0, "date", snapshot.date)
+    return frame
+
+
+def load_market_snapshot(db: Session, day: date) -> pd.DataFrame:
+    """
+    读取某一天的全市场数据
+
+    返回:
+    - 以股票代码为索引的DataFrame，列为 date 和 SNAPSHOT_COLUMNS；当天没有截面时返回空DataFrame
+    """
+    snapshot = db.get(StockDailySnapshot, day)
+    if snapshot is None:
+        return pd.DataFrame(columns=["date"] + SNAPSHOT_COLUMNS, index=pd.Index([], name="symbol"))
+    return _snapshot_to_frame(snapshot)
+
+
+def load_market_snapshots(db: Session, start_date: date, end_date: date) -> List[pd.DataFrame]:
+    """按日期顺序读取日期范围内每天的全市场数据，每天一个DataFrame，格式同 load_market_snapshot"""
+    snapshots = db.query(StockDailySnapshot).filter(
+        StockDailySnapshot.date >= start_date,
+        StockDailySnapshot.date <= end_date
+    ).order_by(StockDailySnapshot.date).all()
+    return [_snapshot_to_frame(snapshot) for snapshot in snapshots]
@@ -0,0 +1,74 @@
+# src/utils/request_budget.py
+"""
+此模块提供按数据源共享的请求速率限额和按资产类别的公平分配。
+同一数据源（如东方财富、新浪）的所有下载线程共用一个每秒请求数限额，
+多个资产类别同时等待时按权重轮流分配请求时间片（加权公平队列），
+只有一个类别在下载时它可以使用全部限额，任何类别都不需要等待其他类别下载完成。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import threading
+import time
+from typing import Dict
+
+from ..core.config import config
+
+
+class FairShareLimiter:
+    """
+    加权公平的请求速率限额（线程间共享）。
+
+    每个类别维护一个虚拟时间，每获得一个请求时间片增加 1/权重，
+    时间片到达时分配给正在等待的类别中虚拟时间最小的一个；
+    刚开始等待的类别的虚拟时间不低于其他等待类别的最小值，不会因为之前空闲而连续占用时间片。
+
+    参数:
+    - rate: 每秒最多请求数，0表示不限制
+    - weights: {类别: 权重}，未列出的类别权重为1
+    """
+
+    def __init__(self, rate: float, weights: Dict[str, float] = None):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.weights = dict(weights or {})
+        self._condition = threading.Condition()
+        self._next_time = 0.0
+        self._virtual_time: Dict[str, float] = {}
+        self._waiting: Dict[str, int] = {}
+        self.granted: Dict[str, int] = {}
+
+    def _chosen(self) -> str:
+        """等待中的类别里虚拟时间最小的一个，调用时需持有锁"""
+        return min((name for name, count in self._waiting.items() if count), key=lambda name: (self._virtual_time[name], name))
+
+    def acquire(self, asset_class: str):
+        """为某个类别等待并占用一个请求时间片"""
+        if not self.interval:
+            return
+        with self._condition:
+            if not self._waiting.get(asset_class):
+                active = [self._virtual_time[name] for name, count in self._waiting.items() if count]
+                self._virtual_time[asset_class] = max(self._virtual_time.get(asset_class, 0.0), min(active, default=0.0))
+            self._waiting[asset_class] = self._waiting.get(asset_class, 0) + 1
+            while True:
+                now = time.time()
+                if self._next_time <= now and self._chosen() == asset_class:
+                    break
+                self._condition.wait(timeout=max(0.001, self._next_time - now))
+            self._next_time = max(now, self._next_time) + self.interval
+            self._virtual_time[asset_class] += 1.0 / self.weights.get(asset_class, 1.0)
+            self._waiting[asset_class] -= 1
+            self.granted[asset_class] = self.granted.get(asset_class, 0) + 1
+            self._condition.notify_all()
+
+
+_limiters: Dict[str, FairShareLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_upstream_limiter(upstream: str) -> FairShareLimiter:
+    """某个数据源在本进程内共享的限额，速率见 config.INGEST_UPSTREAM_RATES，权重见 config.INGEST_CLASS_WEIGHTS"""
+    with _limiters_lock:
+        if upstream not in _limiters:
+            _limiters[upstream] = FairShareLimiter(config.INGEST_UPSTREAM_RATES.get(upstream, 0), config.INGEST_CLASS_WEIGHTS)
+        return _limiters[upstream]
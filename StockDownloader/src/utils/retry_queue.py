@@ -0,0 +1,155 @@
+# src/utils/retry_queue.py
+"""
+此模块提供按代码延迟重试的下载执行器和死信表操作。
+下载失败的代码不在原地等待重试，而是记下按尝试次数指数退避的可重试时间后放到一边，下载线程继续处理其他代码；
+一轮下载结束后再重试已到重试时间的代码，仍然失败的代码写入 ingestion_dead_letter，
+下一次下载时重新加入并在成功后删除，单个代码失败不会导致整个类别或整个任务重新运行。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.models.dead_letter import IngestionDeadLetter
+from ..database.session import SessionLocal
+
+
+def pending_dead_letters(asset_class: str) -> Dict[str, Dict[str, object]]:
+    """某个资产类别在之前的下载中最终失败的代码，返回 {代码: 下载参数}"""
+    db = SessionLocal()
+    try:
+        rows = db.query(IngestionDeadLetter.symbol, IngestionDeadLetter.params).filter(IngestionDeadLetter.asset_class == asset_class).all()
+        return {symbol: params or {} for symbol, params in rows}
+    finally:
+        db.close()
+
+
+def record_dead_letters(asset_class: str, entries: Iterable[Tuple[str, Dict[str, object], int, str]]):
+    """写入最终失败的 (代码, 下载参数, 尝试次数, 错误信息)，已存在的代码累加连续失败次数"""
+    rows = [
+        {"asset_class": asset_class, "symbol": symbol, "params": params, "attempts": attempts, "failed_runs": 1, "last_error": error[:2000]}
+        for symbol, params, attempts, error in entries
+    ]
+    if not rows:
+        return
+    stmt = pg_insert(IngestionDeadLetter)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["asset_class", "symbol"],
+        set_={
+            "params": stmt.excluded.params,
+            "attempts": stmt.excluded.attempts,
+            "failed_runs": IngestionDeadLetter.failed_runs + 1,
+            "last_error": stmt.excluded.last_error,
+            "last_failed_at": stmt.excluded.last_failed_at,
+        },
+    )
+    db = SessionLocal()
+    try:
+        db.execute(stmt, rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+def resolve_dead_letters(asset_class: str, symbols: Iterable[str]):
+    """删除已下载成功的代码的死信记录"""
+    symbols = list(symbols)
+    if not symbols:
+        return
+    db = SessionLocal()
+    try:
+        db.query(IngestionDeadLetter).filter(
+            IngestionDeadLetter.asset_class == asset_class, IngestionDeadLetter.symbol.in_(symbols)
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_with_deferred_retry(asset_class: str, items: List[Tuple[str, Dict[str, object]]],
+                            process: Callable[[str, Dict[str, object]], object], threads: int = 1,
+                            max_attempts: int = None, base_delay: float = None, persist: bool = True,
+                            on_finished: Callable[[str, str], object] = None) -> Dict[str, list]:
+    """
+    下载一批代码，失败的代码延迟到本轮结束后重试
+
+    参数:
+    - asset_class: 资产类别，用于日志和死信表
+    - items: (代码, 下载参数) 列表，下载参数需要能保存为JSON
+    - process: process(代码, 下载参数)，失败时抛出异常
+    - threads: 下载线程数
+    - max_attempts: 每个代码最多尝试次数，默认为 config.MAX_RETRIES
+    - base_delay: 第一次失败后的重试等待时间（秒），之后按次数翻倍，默认为 config.RETRY_DELAY
+    - persist: 是否把最终失败的代码写入死信表，并删除成功的代码原有的死信记录
+    - on_finished: 每个代码成功或最终失败后调用 on_finished(代码, 错误信息或None)
+
+    返回:
+    - {"done": [成功的代码], "dead": [(代码, 错误信息)]}
+    """
+    max_attempts = max_attempts or config.MAX_RETRIES
+    base_delay = config.RETRY_DELAY if base_delay is None else base_delay
+    attempts = {}
+    parked = []
+    sequence = itertools.count()
+    done = []
+    dead = []
+    lock = threading.Lock()
+
+    def attempt(item):
+        symbol, params = item
+        try:
+            process(symbol, params)
+        except Exception as e:
+            with lock:
+                attempts[symbol] = attempts.get(symbol, 0) + 1
+                count = attempts[symbol]
+                if count < max_attempts:
+                    delay = base_delay * 2 ** (count - 1)
+                    heapq.heappush(parked, (time.time() + delay, next(sequence), symbol, params))
+                else:
+                    dead.append((symbol, params, count, str(e)))
+            if count < max_attempts:
+                logger.warning(f"[{asset_class}] {symbol} 第 {count} 次失败，{delay} 秒后重试: {e}")
+            else:
+                logger.error(f"[{asset_class}] {symbol} 第 {count} 次失败，放弃本次下载: {e}")
+                if on_finished is not None:
+                    on_finished(symbol, str(e))
+            return
+        with lock:
+            done.append(symbol)
+        if on_finished is not None:
+            on_finished(symbol, None)
+
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        list(executor.map(attempt, items))
+        # 本轮结束后只剩等待重试的代码，等到最早的重试时间后重试所有已到时间的代码
+        while parked:
+            wait_seconds = parked[0][0] - time.time()
+            if wait_seconds > 0:
+                logger.info(f"[{asset_class}] {len(parked)} 个代码等待重试，{wait_seconds:.1f} 秒后开始")
+                time.sleep(wait_seconds)
+            ready = []
+            with lock:
+                while parked and parked[0][0] <= time.time():
+                    _, _, symbol, params = heapq.heappop(parked)
+                    ready.append((symbol, params))
+            list(executor.map(attempt, ready))
+
+    if persist:
+        try:
+            record_dead_letters(asset_class, dead)
+            resolve_dead_letters(asset_class, done)
+        except Exception as e:
+            logger.error(f"[{asset_class}] 更新死信表失败: {e}")
+    if dead:
+        logger.error(f"[{asset_class}] {len(dead)} 个代码最终失败: {', '.join(symbol for symbol, _, _, _ in dead[:20])}")
+    return {"done": done, "dead": [(symbol, error) for symbol, _, _, error in dead]}
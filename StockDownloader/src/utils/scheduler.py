@@ -0,0 +1,150 @@
+# src/utils/scheduler.py
+"""
+此模块提供按下次触发时间调度的定时任务调度器。
+每个任务有一条触发规则（如"交易日的09:26"），调度器把各任务的下次触发时间放在最小堆中，
+休眠到最早的触发时间后执行该任务，再按规则计算下一次触发时间，不再每分钟轮询检查。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import heapq
+import itertools
+import threading
+from datetime import datetime, time, timedelta
+from typing import Callable, Dict, Optional
+
+from ..core.logger import logger
+from .trading_calendar import trading_calendar
+
+# 计算下次触发时间失败（如无法获取交易日历）后重新计算的间隔
+RESCHEDULE_DELAY = timedelta(hours=1)
+
+
+class TradingDayRule:
+    """在每个交易日的固定时间触发"""
+
+    def __init__(self, hour: int, minute: int = 0):
+        self.at = time(hour, minute)
+
+    def next_fire(self, after: datetime) -> Optional[datetime]:
+        """after之后的第一个触发时间，交易日历范围之外返回None"""
+        day = after.date()
+        if trading_calendar.is_trading_day(day) and datetime.combine(day, self.at) > after:
+            return datetime.combine(day, self.at)
+        next_day = trading_calendar.next_trading_day(day)
+        return datetime.combine(next_day, self.at) if next_day else None
+
+    def __repr__(self):
+        return f"交易日 {self.at.strftime('%H:%M')}"
+
+
+class ScheduledJob:
+    def __init__(self, name: str, rule, func: Callable[[], object]):
+        self.name = name
+        self.rule = rule
+        self.func = func
+        self.next_run: Optional[datetime] = None
+
+
+class Scheduler:
+    """
+    定时任务调度器。
+
+    同名任务只保留最后添加的一个；run_forever 在当前线程中运行，start 在守护线程中运行。
+    任务在调度线程中依次执行，执行期间错过的触发时间不会补执行。
+
+    用法:
+        scheduler.add_job("stock_list", TradingDayRule(9, 26), download_stock_list_task)
+        scheduler.start()
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _push(self, job: ScheduledJob, after: datetime):
+        """按规则计算任务的下次触发时间并放入堆中，调用时需持有锁"""
+        try:
+            job.next_run = job.rule.next_fire(after)
+        except Exception as e:
+            logger.error(f"计算任务 {job.name} 的下次触发时间失败，{RESCHEDULE_DELAY} 后重新计算: {e}")
+            heapq.heappush(self._heap, (after + RESCHEDULE_DELAY, next(self._sequence), job, False))
+            return
+        if job.next_run is None:
+            logger.warning(f"任务 {job.name} 没有下次触发时间，不再调度")
+            return
+        heapq.heappush(self._heap, (job.next_run, next(self._sequence), job, True))
+        logger.info(f"任务 {job.name} ({job.rule}) 下次触发时间: {job.next_run.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    def add_job(self, name: str, rule, func: Callable[[], object], run_now: bool = False):
+        """
+        添加任务，同名任务已存在时替换
+
+        参数:
+        - name: 任务名
+        - rule: 触发规则，提供 next_fire(after) 方法
+        - func: 任务函数
+        - run_now: 是否立即执行一次（在调度线程中执行）
+        """
+        with self._condition:
+            if name in self._jobs:
+                logger.info(f"替换已存在的任务 {name}")
+            job = ScheduledJob(name, rule, func)
+            self._jobs[name] = job
+            if run_now:
+                job.next_run = datetime.now()
+                heapq.heappush(self._heap, (job.next_run, next(self._sequence), job, True))
+            else:
+                self._push(job, datetime.now())
+            self._condition.notify()
+
+    def remove_job(self, name: str):
+        with self._condition:
+            self._jobs.pop(name, None)
+            self._condition.notify()
+
+    def _next_due(self):
+        """等待并取出下一个到期的条目，调用时需持有锁"""
+        while True:
+            # 丢弃已被替换或删除的任务的条目
+            while self._heap and self._jobs.get(self._heap[0][2].name) is not self._heap[0][2]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._condition.wait()
+                continue
+            wait_seconds = (self._heap[0][0] - datetime.now()).total_seconds()
+            if wait_seconds <= 0:
+                return heapq.heappop(self._heap)
+            self._condition.wait(timeout=wait_seconds)
+
+    def run_forever(self):
+        """在当前线程中运行调度循环"""
+        logger.info("定时任务调度器已启动")
+        while True:
+            with self._condition:
+                fire_time, _, job, fire = self._next_due()
+            if fire:
+                logger.info(f"执行定时任务 {job.name}")
+                try:
+                    job.func()
+                except Exception as e:
+                    logger.error(f"定时任务 {job.name} 执行失败: {e}")
+            with self._condition:
+                if self._jobs.get(job.name) is job:
+                    # 从任务结束时刻计算下次触发时间，跳过执行期间错过的触发时间
+                    self._push(job, max(fire_time, datetime.now()))
+
+    def start(self):
+        """在守护线程中运行调度循环，重复调用不会启动多个线程"""
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+            self._thread.start()
+
+
+# 全局调度器
+scheduler = Scheduler()
@@ -1,19 +1,124 @@
 # src/utils/trading_calendar.py
 """
 此模块提供交易日历相关的工具函数。
-包括判断当前日期是否为交易日的函数。
+交易日历每天最多从akshare下载一次，保存在缓存目录的 trade_calendar.csv 中，
+并以有序日期数组的形式保存在内存中，判断交易日、查找前后交易日、区间交易日和第N个交易日都使用二分查找。
 Authors: hovi.hyw & AI
 Date: 2024-07-03
 """
 
 import akshare as ak
 import pandas as pd
-from datetime import datetime, time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date
+from typing import List, Optional
 import os
+import threading
 
 from ..core.logger import logger
 from ..core.config import config
 
+# 交易日历缓存文件
+TRADE_CALENDAR_FILE = os.path.join(config.CACHE_PATH, "trade_calendar.csv")
+
+
+class TradingCalendar:
+    """
+    交易日历服务。
+
+    第一次查询时加载交易日历：缓存文件是今天写入的则直接读取，否则重新下载并覆盖缓存文件；
+    下载失败时使用已有的缓存文件。加载后的日历在内存中保留到第二天，多线程共享同一份日历。
+    """
+
+    def __init__(self, cache_file: str = TRADE_CALENDAR_FILE):
+        self.cache_file = cache_file
+        self._dates: List[date] = []
+        self._loaded_on: Optional[date] = None
+        self._lock = threading.Lock()
+
+    def _read_cache(self) -> List[date]:
+        df = pd.read_csv(self.cache_file, dtype=str)
+        return sorted(pd.to_datetime(df['trade_date']).dt.date)
+
+    def _download(self) -> List[date]:
+        trade_date_df = ak.tool_trade_date_hist_sina()
+        dates = sorted(pd.to_datetime(trade_date_df['trade_date']).dt.date)
+        from .file_utils import ensure_directory_exists
+        ensure_directory_exists(os.path.dirname(self.cache_file))
+        pd.DataFrame({'trade_date': [d.isoformat() for d in dates]}).to_csv(self.cache_file, index=False)
+        logger.info(f"已下载交易日历: {dates[0]} 至 {dates[-1]}, 共 {len(dates)} 个交易日")
+        return dates
+
+    def _dates_for_today(self) -> List[date]:
+        """返回今天可用的交易日历，必要时加载"""
+        today = date.today()
+        if self._loaded_on == today:
+            return self._dates
+        with self._lock:
+            if self._loaded_on == today:
+                return self._dates
+            cache_exists = os.path.exists(self.cache_file)
+            if cache_exists and datetime.fromtimestamp(os.path.getmtime(self.cache_file)).date() == today:
+                dates = self._read_cache()
+            else:
+                try:
+                    dates = self._download()
+                except Exception as e:
+                    if not cache_exists:
+                        raise
+                    logger.warning(f"下载交易日历失败，使用缓存文件 {self.cache_file}: {e}")
+                    dates = self._read_cache()
+            self._dates = dates
+            self._loaded_on = today
+            return dates
+
+    def refresh(self):
+        """丢弃内存和缓存文件中的日历，下次查询时重新下载"""
+        with self._lock:
+            self._loaded_on = None
+            if os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+
+    def is_trading_day(self, day: date) -> bool:
+        dates = self._dates_for_today()
+        position = bisect_left(dates, day)
+        return position < len(dates) and dates[position] == day
+
+    def previous_trading_day(self, day: date, inclusive: bool = False) -> Optional[date]:
+        """day之前（inclusive为True时包括day）的最后一个交易日，不存在时返回None"""
+        dates = self._dates_for_today()
+        position = (bisect_right if inclusive else bisect_left)(dates, day)
+        return dates[position - 1] if position > 0 else None
+
+    def next_trading_day(self, day: date, inclusive: bool = False) -> Optional[date]:
+        """day之后（inclusive为True时包括day）的第一个交易日，不存在时返回None"""
+        dates = self._dates_for_today()
+        position = (bisect_left if inclusive else bisect_right)(dates, day)
+        return dates[position] if position < len(dates) else None
+
+    def trading_days_between(self, start_date: date, end_date: date) -> List[date]:
+        """start_date 至 end_date（包括两端）之间的全部交易日"""
+        dates = self._dates_for_today()
+        return dates[bisect_left(dates, start_date):bisect_right(dates, end_date)]
+
+    def offset(self, day: date, n: int) -> Optional[date]:
+        """
+        相对day的第n个交易日：n > 0 为day之后的第n个，n < 0 为day之前的第-n个，
+        n = 0 时day是交易日则返回day，否则返回None；超出日历范围时返回None
+        """
+        dates = self._dates_for_today()
+        if n > 0:
+            position = bisect_right(dates, day) + n - 1
+        elif n < 0:
+            position = bisect_left(dates, day) + n
+        else:
+            return day if self.is_trading_day(day) else None
+        return dates[position] if 0 <= position < len(dates) else None
+
+
+# 全局交易日历
+trading_calendar = TradingCalendar()
+
 
 def is_trading_day(check_date=None):
     """
@@ -29,17 +134,7 @@ def is_trading_day(check_date=None):
         # 如果未指定日期，使用今天的日期
         if check_date is None:
             check_date = datetime.today().date()
-            
-        # 将日期转换为字符串格式
-        check_date_str = check_date.strftime("%Y%m%d")
-        
-        # 使用akshare获取交易日历
-        trade_date_df = ak.tool_trade_date_hist_sina()
-        # 将日期列转换为字符串格式
-        trade_date_df['trade_date'] = trade_date_df['trade_date'].astype(str).str.replace('-', '')
-        
-        # 检查指定日期是否在交易日列表中
-        return check_date_str in trade_date_df['trade_date'].values
+        return trading_calendar.is_trading_day(check_date)
     except Exception as e:
         logger.error(f"判断交易日失败: {e}")
         # 如果无法确定，默认为非交易日
@@ -53,32 +148,31 @@ def get_latest_trading_day():
     Returns:
         datetime.date: 最近的交易日期。
     """
+    today = datetime.today().date()
     try:
-        today = datetime.today().date()
-        
-        # 如果今天是交易日，直接返回今天
-        if is_trading_day(today):
-            return today
-            
-        # 否则，向前查找最近的交易日
-        trade_date_df = ak.tool_trade_date_hist_sina()
-        # 将日期列转换为日期对象
-        trade_date_df['date_obj'] = pd.to_datetime(trade_date_df['trade_date']).dt.date
-        # 筛选出小于今天的交易日
-        past_trading_days = trade_date_df[trade_date_df['date_obj'] < today]['date_obj']
-        
-        if not past_trading_days.empty:
-            # 返回最近的一个交易日
-            return past_trading_days.iloc[-1]
-        else:
-            # 如果没有找到，返回今天
-            return today
+        latest_trading_day = trading_calendar.previous_trading_day(today, inclusive=True)
+        # 如果没有找到，返回今天
+        return latest_trading_day or today
     except Exception as e:
         logger.error(f"获取最近交易日失败: {e}")
         # 如果无法确定，返回今天
         return today
 
 
+def get_next_trading_day(from_date):
+    """
+    获取指定日期之后的第一个交易日。
+    
+    Returns:
+        datetime.date: 下一个交易日期，无法确定时返回None。
+    """
+    try:
+        return trading_calendar.next_trading_day(from_date)
+    except Exception as e:
+        logger.error(f"获取下一个交易日失败: {e}")
+        return None
+
+
 def get_stock_list_filename_with_datetime():
     """
     获取带有当前日期时间的股票列表文件名。
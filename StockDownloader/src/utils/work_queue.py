@@ -0,0 +1,199 @@
+# src/utils/work_queue.py
+"""
+此模块提供基于PostgreSQL的分布式工作队列操作。
+工作保存在 ingestion_job 表中，工作进程用 SELECT ... FOR UPDATE SKIP LOCKED 领取一批工作并获得租约，
+处理期间定期续约（心跳）；租约到期未续约的工作可以被其他工作进程重新领取，
+失败的工作按次数指数退避后重新排队，超过最多领取次数后进入 dead 状态不再领取。
+Authors: hovi.hyw & AI
+Date: 2024-07-03
+"""
+
+import os
+import socket
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..core.config import config
+from ..core.logger import logger
+from ..database.models.work_queue import IngestionJob
+from ..database.session import SessionLocal
+
+# 工作状态
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+# 租约过期且已达到最多领取次数的工作（领取者反复在处理中崩溃）不再领取
+_EXPIRE_SQL = """
+UPDATE ingestion_job
+SET status = 'dead', lease_owner = NULL, lease_expires_at = NULL,
+    last_error = COALESCE(last_error, '租约多次过期'), updated_at = now()
+WHERE plan = :plan AND status = 'running' AND lease_expires_at < now() AND attempts >= max_attempts
+"""
+
+# 领取工作：待领取且已到可领取时间的工作，以及租约已过期的执行中工作；被其他事务锁定的行直接跳过
+_CLAIM_SQL = """
+UPDATE ingestion_job j
+SET status = 'running', lease_owner = :worker, attempts = j.attempts + 1,
+    lease_expires_at = now() + make_interval(secs => :lease_seconds), heartbeat_at = now(), updated_at = now()
+WHERE j.id IN (
+    SELECT id FROM ingestion_job
+    WHERE plan = :plan
+      AND ((status = 'pending' AND available_at <= now()) OR (status = 'running' AND lease_expires_at < now()))
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING j.id, j.kind, j.symbol, j.name, j.start_date, j.end_date, j.attempts, j.max_attempts
+"""
+
+_HEARTBEAT_SQL = """
+UPDATE ingestion_job
+SET lease_expires_at = now() + make_interval(secs => :lease_seconds), heartbeat_at = now()
+WHERE id = ANY(CAST(:ids AS bigint[])) AND lease_owner = :worker AND status = 'running'
+"""
+
+_COMPLETE_SQL = """
+UPDATE ingestion_job
+SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, last_error = NULL, updated_at = now()
+WHERE id = :id AND lease_owner = :worker AND status = 'running'
+"""
+
+# 失败后按已领取次数指数退避，达到最多领取次数后进入 dead 状态
+_FAIL_SQL = """
+UPDATE ingestion_job
+SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'pending' END,
+    available_at = now() + make_interval(secs => :retry_delay * power(2, attempts - 1)),
+    lease_owner = NULL, lease_expires_at = NULL, last_error = :error, updated_at = now()
+WHERE id = :id AND lease_owner = :worker AND status = 'running'
+RETURNING status
+"""
+
+
+def default_worker_id() -> str:
+    """工作进程标识：主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_jobs(db: Session, plan: str, kind: str, items: Iterable[Tuple[str, str, date, date]], max_attempts: int = None) -> int:
+    """
+    向计划中加入工作，计划中已有的(类型, 代码)不会重复加入，多个主机可以同时为同一计划入队
+
+    参数:
+    - plan: 计划名称
+    - kind: stock 或 index
+    - items: (代码, 名称, 起始日期, 结束日期) 列表
+    - max_attempts: 最多领取次数，默认为 config.QUEUE_MAX_ATTEMPTS
+
+    返回:
+    - 新加入的工作数
+    """
+    max_attempts = max_attempts or config.QUEUE_MAX_ATTEMPTS
+    rows = [
+        {"plan": plan, "kind": kind, "symbol": symbol, "name": name, "start_date": start_date, "end_date": end_date,
+         "status": PENDING, "attempts": 0, "max_attempts": max_attempts}
+        for symbol, name, start_date, end_date in items
+    ]
+    if not rows:
+        return 0
+    stmt = pg_insert(IngestionJob).on_conflict_do_nothing(index_elements=["plan", "kind", "symbol"]).returning(IngestionJob.id)
+    added = len(db.execute(stmt, rows).all())
+    db.commit()
+    return added
+
+
+def claim_jobs(db: Session, plan: str, worker: str, batch_size: int = None) -> List[Dict[str, object]]:
+    """领取一批工作，返回工作列表（没有可领取的工作时为空）"""
+    db.execute(text(_EXPIRE_SQL), {"plan": plan})
+    rows = db.execute(text(_CLAIM_SQL), {
+        "plan": plan,
+        "worker": worker,
+        "lease_seconds": config.QUEUE_LEASE_SECONDS,
+        "batch_size": batch_size or config.QUEUE_CLAIM_BATCH,
+    }).mappings().all()
+    db.commit()
+    return [dict(row) for row in rows]
+
+
+def heartbeat(db: Session, worker: str, job_ids: List[int]) -> int:
+    """为仍在处理的工作续约，返回续约成功的工作数"""
+    if not job_ids:
+        return 0
+    result = db.execute(text(_HEARTBEAT_SQL), {"ids": list(job_ids), "worker": worker, "lease_seconds": config.QUEUE_LEASE_SECONDS})
+    db.commit()
+    return result.rowcount
+
+
+def complete_job(db: Session, worker: str, job_id: int):
+    db.execute(text(_COMPLETE_SQL), {"id": job_id, "worker": worker})
+    db.commit()
+
+
+def fail_job(db: Session, worker: str, job_id: int, error: str) -> str:
+    """记录工作失败，返回工作的新状态（pending 或 dead）"""
+    status = db.execute(text(_FAIL_SQL), {
+        "id": job_id, "worker": worker, "error": error[:2000], "retry_delay": config.QUEUE_RETRY_DELAY
+    }).scalar()
+    db.commit()
+    return status
+
+
+def plan_counts(db: Session, plan: str) -> Dict[str, int]:
+    """计划中各状态的工作数"""
+    rows = db.execute(text("SELECT status, count(*) FROM ingestion_job WHERE plan = :plan GROUP BY status"), {"plan": plan}).all()
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, DEAD: 0}
+    counts.update({status: count for status, count in rows})
+    return counts
+
+
+class LeaseKeeper:
+    """
+    后台线程定期为工作进程持有的工作续约，间隔为租约时长的三分之一。
+
+    用法:
+        with LeaseKeeper(worker, [job["id"] for job in jobs]) as keeper:
+            for job in jobs:
+                ...
+                keeper.release(job["id"])
+    """
+
+    def __init__(self, worker: str, job_ids: Iterable[int]):
+        self.worker = worker
+        self.job_ids = set(job_ids)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def release(self, job_id: int):
+        with self._lock:
+            self.job_ids.discard(job_id)
+
+    def _run(self):
+        interval = max(1, config.QUEUE_LEASE_SECONDS // 3)
+        while not self._stopped.wait(interval):
+            with self._lock:
+                job_ids = list(self.job_ids)
+            db = SessionLocal()
+            try:
+                renewed = heartbeat(db, self.worker, job_ids)
+                if renewed < len(job_ids):
+                    logger.warning(f"{self.worker} 有 {len(job_ids) - renewed} 项工作的租约已失效，可能已被其他工作进程领取")
+            except Exception as e:
+                logger.error(f"{self.worker} 续约失败: {e}")
+            finally:
+                db.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stopped.set()
+        self._thread.join()
+        return False
@@ -1,14 +1,8 @@
 import sys
 import os
-import time
-import threading
-from datetime import datetime, timedelta
-import akshare as ak
-from functools import wraps
-import random
+from datetime import datetime
 import logging
 from dotenv import load_dotenv
-import pandas as pd
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
@@ -47,65 +41,49 @@ else:
     logger.error(f"环境变量文件不存在: {env_path}")
 
 # 导入StockDownloader模块
-from StockDownloader.src.tasks.download_stock_task import download_all_stock_data
-from StockDownloader.src.tasks.download_index_task import download_all_index_data
-from StockDownloader.src.tasks.download_etf_task import download_all_etf_data
-from StockDownloader.src.tasks.download_hot_rank_task import download_all_hot_rank_data
+from StockDownloader.src.tasks.download_stock_task import refresh_stock_universe
+from StockDownloader.src.tasks.download_index_task import refresh_index_universe
+from StockDownloader.src.tasks.update_data_task import update_stock_data as update_stock_daily_data, update_index_data as update_index_daily_data
+from StockDownloader.src.utils.indicator_store import update_stock_indicators
+from StockDownloader.src.utils.bar_resampler import update_period_bars
+from StockDownloader.src.utils.trading_calendar import trading_calendar, get_latest_trading_day
+from StockDownloader.src.utils.scheduler import scheduler, TradingDayRule
+from StockDownloader.src.utils.correlation_calculator import update_stock_index_correlation
+from StockDownloader.src.utils.dag_runner import DagRunner, SUCCESS
+from StockDownloader.src.utils.job_registry import track_job
+from StockDownloader.src.tasks.queue_worker import run_queue_ingestion
+from StockDownloader.src.tasks.sharded_ingestion import run_sharded_ingestion
+from StockDownloader.src.tasks.multi_asset_ingestion import ingest_asset_class
+from StockDownloader.src.core.config import config
 
-def retry_with_delay(max_retries=3, initial_delay=60):
-    """
-    带重试和延迟的装饰器
-    """
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            retries = 0
-            delay = initial_delay
-            while retries < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    retries += 1
-                    if retries == max_retries:
-                        raise e
-                    logger.warning(f"操作失败，{delay}秒后重试: {str(e)}")
-                    # 添加随机延迟，避免固定间隔
-                    actual_delay = delay + random.randint(1, 30)
-                    time.sleep(actual_delay)
-                    # 增加下次重试的延迟时间
-                    delay *= 2
-            return None
-        return wrapper
-    return decorator
+# 每日更新在任务登记表中占用的资源，与网页端的更新数据、相关度计算和重建数据库冲突
+DAILY_UPDATE_RESOURCES = {"network": 1, "db_write": 1, "cpu": 1}
+
+# 代码列表、日线、ETF和热度排名任务失败（如获取代码列表失败）后的重试次数和重试间隔（秒）
+# 这些任务内部按代码延迟重试（见 utils.retry_queue），单个代码失败不会导致任务失败
+TASK_MAX_RETRIES = 2
+TASK_RETRY_DELAY = 60
 
-@retry_with_delay(max_retries=3, initial_delay=60)
 def is_trading_day():
     """
     判断今天是否为交易日
-    通过获取交易日历来判断
+    通过缓存的交易日历来判断，日历每天最多下载一次
     """
     try:
-        today = datetime.now().strftime('%Y%m%d')
-        # 获取交易日历
-        df = ak.tool_trade_date_hist_sina()
-        # 将交易日历中的日期转换为字符串格式
-        trade_dates = [d.strftime('%Y%m%d') for d in df['trade_date'].values]
-        return today in trade_dates
+        return trading_calendar.is_trading_day(datetime.now().date())
     except Exception as e:
         logger.error(f"检查交易日时发生错误: {str(e)}")
         raise
 
-@retry_with_delay(max_retries=3, initial_delay=66)  # 1分钟初始延迟
 def update_stock_data():
     """
-    更新股票数据，带重试机制
+    更新股票日线数据，股票列表由 stock_universe 任务更新，重试由任务图负责
     """
-    download_all_stock_data(update_only=True)
+    update_stock_daily_data()
 
-@retry_with_delay(max_retries=3, initial_delay=66)  # 1分钟初始延迟
 def update_index_data():
     """
-    更新指数数据，带重试机制
+    更新指数日线数据，指数列表由 index_universe 任务更新，重试由任务图负责
     """
     logger.info("开始执行指数数据更新函数...")
     
@@ -114,7 +92,6 @@ def update_index_data():
     logger.info(f"当前指数数据库中最新日期: {latest_index_date}")
     
     # 获取最近的交易日
-    from StockDownloader.src.utils.trading_calendar import get_latest_trading_day
     latest_trading_day = get_latest_trading_day()
     logger.info(f"最近的交易日: {latest_trading_day}")
     
@@ -127,8 +104,8 @@ def update_index_data():
     
     # 调用下载函数并记录详细日志
     try:
-        logger.info("调用download_all_index_data函数进行更新...")
-        download_all_index_data(update_only=True)
+        logger.info("调用update_index_daily_data函数进行更新...")
+        update_index_daily_data()
         
         # 验证更新后的数据
         new_latest_date = get_latest_index_date()
@@ -142,103 +119,114 @@ def update_index_data():
         logger.error(f"指数数据更新过程中发生错误: {str(e)}")
         raise
 
-@retry_with_delay(max_retries=3, initial_delay=66)  # 1分钟初始延迟
 def update_etf_data():
     """
-    更新ETF数据，带重试机制
+    更新ETF数据，单线程逐个下载，每个ETF之后等待3-5秒（失败后8-13秒）；失败的ETF延迟到本轮结束后重试，仍然失败的写入死信表，下次更新时重试
+    获取ETF列表失败时任务失败，由任务图重试
     """
-    download_all_etf_data(update_only=True)
+    ingest_asset_class("etf", threads=1)
 
-@retry_with_delay(max_retries=3, initial_delay=66)  # 1分钟初始延迟
 def update_hot_rank_data():
     """
-    更新股票热度排名数据，带重试机制
+    更新股票热度排名数据，单线程逐个下载，每个股票之后等待1-3秒；失败的股票延迟到本轮结束后重试，仍然失败的写入死信表，下次更新时重试
+    获取股票列表失败时任务失败，由任务图重试
     """
-    download_all_hot_rank_data(update_only=True)
+    ingest_asset_class("hot_rank", threads=1)
+
+def build_daily_update_dag(stock_need_update, index_need_update, etf_need_update, hot_rank_need_update, on_task_done=None):
+    """
+    构建每日更新的任务图，只包含需要更新的数据及其下游任务
+    依赖关系: 代码列表 -> 日线 -> 技术指标/周期K线/相关度，ETF和热度排名各自独立
+    """
+    dag = DagRunner("daily_update", on_task_done=on_task_done)
+    bar_tasks = []
+    # 配置了 QUEUE_WORKERS 时日线通过工作队列下载，其他主机可以用 --worker-only 加入同一计划
+    # 配置了 INGEST_SHARDS（或 --shards）时股票和指数日线由同一组进程按代码分片下载（daily_bars 任务）
+    sharded = not config.QUEUE_WORKERS and config.INGEST_SHARDS > 1
+    if config.QUEUE_WORKERS:
+        stock_bars = lambda: run_queue_ingestion("update", ["stock"], workers=config.QUEUE_WORKERS)
+        index_bars = lambda: run_queue_ingestion("update", ["index"], workers=config.QUEUE_WORKERS)
+    elif config.MULTI_ASSET_INGEST:
+        stock_bars = lambda: ingest_asset_class("stock", refresh_universe=False)
+        index_bars = lambda: ingest_asset_class("index", refresh_universe=False)
+    else:
+        stock_bars, index_bars = update_stock_data, update_index_data
+    # 配置了 MULTI_ASSET_INGEST（或 --multi-asset）时各类别的下载线程同时运行，共享各数据源的请求限额
+    if config.MULTI_ASSET_INGEST:
+        etf_bars = lambda: ingest_asset_class("etf")
+        hot_rank = lambda: ingest_asset_class("hot_rank")
+    else:
+        etf_bars, hot_rank = update_etf_data, update_hot_rank_data
+    kinds = [kind for kind, need in (("stock", stock_need_update), ("index", index_need_update)) if need]
+    if stock_need_update:
+        dag.add("stock_universe", refresh_stock_universe, resource="network", max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+    if index_need_update:
+        dag.add("index_universe", refresh_index_universe, resource="network", max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+    if sharded and kinds:
+        # 分片下载只运行一次，所有分片进程共享同一个 INGEST_RATE_LIMIT 限额
+        dag.add("daily_bars", lambda: run_sharded_ingestion("update", kinds, shards=config.INGEST_SHARDS),
+                depends_on=[f"{kind}_universe" for kind in kinds], resource="network",
+                max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+        bar_tasks.append("daily_bars")
+    if stock_need_update:
+        if not sharded:
+            dag.add("stock_bars", stock_bars, depends_on=["stock_universe"], resource="network",
+                    max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+            bar_tasks.append("stock_bars")
+        stock_bars_task = "daily_bars" if sharded else "stock_bars"
+        # 股票日线写入后增量更新技术指标和周期K线
+        dag.add("stock_indicators", update_stock_indicators, depends_on=[stock_bars_task], resource="cpu")
+        dag.add("stock_period_bars", lambda: update_period_bars("stock"), depends_on=[stock_bars_task], resource="db")
+    if index_need_update:
+        if not sharded:
+            dag.add("index_bars", index_bars, depends_on=["index_universe"], resource="network",
+                    max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+            bar_tasks.append("index_bars")
+        dag.add("index_period_bars", lambda: update_period_bars("index"), depends_on=["daily_bars" if sharded else "index_bars"], resource="db")
+    if bar_tasks:
+        # 股票或指数日线更新后增量更新今年的股票-指数相关度
+        dag.add("correlation", lambda: update_stock_index_correlation(incremental=True), depends_on=bar_tasks, resource="cpu")
+    if etf_need_update:
+        dag.add("etf_bars", etf_bars, resource="network", max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+    if hot_rank_need_update:
+        dag.add("hot_rank", hot_rank, resource="network", max_retries=TASK_MAX_RETRIES, retry_delay=TASK_RETRY_DELAY)
+    return dag
 
-def run_daily_update(max_retries=3):
+def run_daily_update():
     """
     运行每日更新任务
-    Args:
-        max_retries (int): 最大重试次数
-    """
-    for attempt in range(max_retries):
-        try:
-            logger.info(f"开始执行每日更新任务... (尝试 {attempt + 1}/{max_retries})")
-            
-            # 检查各类数据是否需要更新
-            stock_need_update = need_update_stock()
-            index_need_update = need_update_index()
-            etf_need_update = need_update_etf()
-            hot_rank_need_update = need_update_hot_rank()
-            
-            # 如果都不需要更新，直接返回
-            if not any([stock_need_update, index_need_update, etf_need_update, hot_rank_need_update]):
-                logger.info("所有数据都是最新的，无需更新")
-                return
-            
-            # 创建线程来更新股票数据（如果需要）
-            stock_thread = None
-            if stock_need_update:
-                logger.info("开始更新股票数据...")
-                stock_thread = threading.Thread(target=update_stock_data)
-                stock_thread.start()
-            
-            # 串行更新指数和ETF数据
-            if index_need_update:
-                logger.info("开始更新指数数据...")
-                start_time = datetime.now()
-                logger.info(f"当前时间: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                
-                # 获取更新前的最新指数数据日期
-                pre_update_date = get_latest_index_date()
-                logger.info(f"更新前指数数据最新日期: {pre_update_date}")
-                
-                # 调用更新函数
-                update_index_data()
-                
-                # 获取更新后的最新指数数据日期
-                post_update_date = get_latest_index_date()
-                logger.info(f"更新后指数数据最新日期: {post_update_date}")
-                
-                # 检查是否真正更新了数据
-                if post_update_date and post_update_date > pre_update_date:
-                    logger.info(f"指数数据成功更新，日期从 {pre_update_date} 更新到 {post_update_date}")
-                else:
-                    logger.warning(f"指数数据可能未成功更新，更新前日期: {pre_update_date}，更新后日期: {post_update_date}")
-                
-                end_time = datetime.now()
-                elapsed_time = (end_time - start_time).total_seconds()
-                logger.info(f"指数数据更新完成，耗时: {elapsed_time:.2f} 秒")
-                logger.info("指数数据更新完成")
-            
-            if etf_need_update:
-                logger.info("开始更新ETF数据...")
-                update_etf_data()
-                logger.info("ETF数据更新完成")
-            
-            if hot_rank_need_update:
-                logger.info("开始更新股票热度排名数据...")
-                update_hot_rank_data()
-                logger.info("股票热度排名数据更新完成")
-            
-            # 等待股票数据更新完成（如果有）
-            if stock_thread:
-                stock_thread.join()
-                logger.info("股票数据更新完成")
-            
+    互不依赖的任务并行执行，失败的代码在各下载任务内部延迟重试，最终失败的代码写入死信表由下一次更新补全；
+    任务图只运行一次，不再整体重新运行
+    """
+    # 检查各类数据是否需要更新
+    stock_need_update = need_update_stock()
+    index_need_update = need_update_index()
+    etf_need_update = need_update_etf()
+    hot_rank_need_update = need_update_hot_rank()
+    
+    # 如果都不需要更新，直接返回
+    if not any([stock_need_update, index_need_update, etf_need_update, hot_rank_need_update]):
+        logger.info("所有数据都是最新的，无需更新")
+        return
+    
+    # 在任务登记表中记录本次运行，网页端可以看到定时更新的进度
+    params = {"stock": stock_need_update, "index": index_need_update, "etf": etf_need_update, "hot_rank": hot_rank_need_update}
+    with track_job("daily_update", params, source="daily_update", resources=DAILY_UPDATE_RESOURCES,
+                   message="正在运行每日更新任务图...") as job:
+        def report(task):
+            finished = sum(1 for t in dag.tasks.values() if t.status == SUCCESS)
+            job.progress(finished, len(dag.tasks), f"{task.name}: {task.status}")
+
+        dag = build_daily_update_dag(stock_need_update, index_need_update, etf_need_update, hot_rank_need_update, on_task_done=report)
+        job.progress(0, len(dag.tasks))
+        logger.info("开始执行每日更新任务...")
+        if dag.run():
             logger.info("每日更新任务执行完成")
-            return  # 如果所有更新都成功，直接返回
-            
-        except Exception as e:
-            logger.error(f"更新任务失败 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
-            if attempt < max_retries - 1:
-                wait_time = (attempt + 1) * 300  # 递增等待时间，从5分钟开始
-                logger.info(f"等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
-            else:
-                logger.error("达到最大重试次数，更新任务失败")
-                raise  # 重试耗尽后抛出异常
+            return
+        
+        failed = [task["name"] for task in dag.summary() if task["status"] != "success"]
+        logger.error(f"更新任务失败，未完成的任务: {', '.join(failed)}")
+        raise RuntimeError(f"每日更新任务失败，未完成的任务: {', '.join(failed)}")
 
 def get_latest_stock_date():
     """
@@ -267,57 +255,6 @@ def get_latest_etf_date():
     from StockDownloader.src.tasks.update_data_task import get_latest_date_from_db
     return get_latest_date_from_db(engine, ETFDailyData)
 
-def get_next_trading_day(from_date):
-    """
-    获取指定日期之后的第一个交易日
-    """
-    try:
-        # 获取交易日历
-        df = ak.tool_trade_date_hist_sina()
-        # 将日期列转换为日期对象
-        df['trade_date'] = pd.to_datetime(df['trade_date']).dt.date
-        # 获取大于指定日期的第一个交易日
-        next_trading_days = df[df['trade_date'] > from_date]['trade_date']
-        return next_trading_days.iloc[0] if not next_trading_days.empty else None
-    except Exception as e:
-        logger.error(f"获取下一个交易日时发生错误: {str(e)}")
-        return None
-
-def calculate_next_update_time(is_trading=False, should_update=True):
-    """
-    计算下一次更新时间
-    Args:
-        is_trading (bool): 是否为交易日
-        should_update (bool): 是否需要更新数据
-    """
-    now = datetime.now()
-    today = now.date()
-    
-    # 如果数据已是最新，直接返回下一个交易日的17点
-    if not should_update:
-        next_trading = get_next_trading_day(today)
-        if next_trading:
-            return datetime(next_trading.year, next_trading.month, next_trading.day, 17, 0)
-        return now + timedelta(days=1)
-    
-    # 如果当前时间在17点之前
-    if now.hour < 17:
-        return datetime(today.year, today.month, today.day, 17, 0)
-    # 如果当前时间在22点之后，获取下一个交易日的17点
-    elif now.hour >= 22:
-        next_trading = get_next_trading_day(today)
-        if next_trading:
-            return datetime(next_trading.year, next_trading.month, next_trading.day, 17, 0)
-    # 如果是交易日且在17-22点之间，可以立即更新
-    elif is_trading and 17 <= now.hour < 22:
-        return now
-    
-    # 默认等到下一个交易日的17点
-    next_trading = get_next_trading_day(today)
-    if next_trading:
-        return datetime(next_trading.year, next_trading.month, next_trading.day, 17, 0)
-    return now + timedelta(days=1)  # 如果无法获取下一个交易日，默认等待24小时
-
 def need_update_stock():
     """
     判断是否需要更新股票数据
@@ -327,7 +264,6 @@ def need_update_stock():
         return True
     
     # 获取最近的交易日
-    from StockDownloader.src.utils.trading_calendar import get_latest_trading_day
     latest_trading_day = get_latest_trading_day()
     
     # 如果数据日期落后于最近的交易日，需要更新
@@ -342,7 +278,6 @@ def need_update_index():
         return True
     
     # 获取最近的交易日
-    from StockDownloader.src.utils.trading_calendar import get_latest_trading_day
     latest_trading_day = get_latest_trading_day()
     
     # 如果数据日期落后于最近的交易日，需要更新
@@ -357,7 +292,6 @@ def need_update_etf():
         return True
     
     # 获取最近的交易日
-    from StockDownloader.src.utils.trading_calendar import get_latest_trading_day
     latest_trading_day = get_latest_trading_day()
     
     # 如果数据日期落后于最近的交易日，需要更新
@@ -381,7 +315,6 @@ def need_update_hot_rank():
         return True
     
     # 获取最近的交易日
-    from StockDownloader.src.utils.trading_calendar import get_latest_trading_day
     latest_trading_day = get_latest_trading_day()
     
     # 确保日期类型一致后再比较
@@ -396,54 +329,63 @@ def need_update_hot_rank():
     # 如果数据日期落后于最近的交易日，需要更新
     return latest_data_date < latest_trading_day
 
+def update_if_due():
+    """
+    检查是否需要并且可以更新数据，满足条件时运行每日更新
+    交易日只在17-22点之间更新（调度器在每个交易日17:00触发），非交易日数据落后时立即更新
+    """
+    now = datetime.now()
+    is_trade_day = is_trading_day()
+    # 检查是否需要更新任何一种数据
+    should_update = any([need_update_stock(), need_update_index(), need_update_etf(), need_update_hot_rank()])
+    
+    if not should_update:
+        logger.info("数据已是最新，无需更新")
+    elif is_trade_day and not 17 <= now.hour < 22:
+        # 交易日：如果在17-22点之间可以更新，否则等到17点
+        logger.info(f"当前时间不在更新时间范围内，等待到下一个更新时间")
+    else:
+        logger.info("开始更新数据..." if is_trade_day else "非交易日，开始更新数据...")
+        run_daily_update()
+
 def main():
     """
     主函数
+    启动时检查一次；容器环境中之后由调度器在每个交易日17:00触发
     """
     try:
-        while True:
-            now = datetime.now()
-            is_trade_day = is_trading_day()
-            # 检查是否需要更新任何一种数据
-            should_update = any([need_update_stock(), need_update_index(), need_update_etf(), need_update_hot_rank()])
-            
-            if not should_update:
-                logger.info("数据已是最新，无需更新")
-                # 计算下一次更新时间，传入should_update=False
-                next_update = calculate_next_update_time(is_trade_day, should_update=False)
-            else:
-                # 判断当前是否在合适的更新时间
-                if is_trade_day:
-                    # 交易日：如果在17-22点之间可以更新，否则等到17点
-                    if 17 <= now.hour < 22:
-                        logger.info("开始更新数据...")
-                        run_daily_update()
-                        next_update = calculate_next_update_time(is_trade_day, should_update=should_update)
-                    else:
-                        next_update = calculate_next_update_time(is_trade_day, should_update=should_update)
-                        logger.info(f"当前时间不在更新时间范围内，等待到下一个更新时间")
-                else:
-                    # 非交易日：可以立即更新
-                    logger.info("非交易日，开始更新数据...")
-                    run_daily_update()
-                    next_update = calculate_next_update_time(is_trade_day, should_update=should_update)
-            
-            # 计算等待时间
-            wait_seconds = (next_update - now).total_seconds()
-            logger.info(f"下次更新时间: {next_update.strftime('%Y-%m-%d %H:%M:%S')}, ")
-            logger.info(f"等待时间: {wait_seconds/3600:.2f}小时")
-            
-            # 如果不是容器环境，更新一次后退出
-            if os.environ.get('CONTAINER_ENV') != 'true':
-                logger.info("非容器环境，更新完成后退出")
-                break
-                
-            # 休眠到下一次更新时间
-            time.sleep(wait_seconds)
+        update_if_due()
+        
+        # 如果不是容器环境，更新一次后退出
+        if os.environ.get('CONTAINER_ENV') != 'true':
+            logger.info("非容器环境，更新完成后退出")
+            return
+        
+        # 休眠到下一次更新时间，由调度器计算并记录下次触发时间
+        scheduler.add_job("daily_update", TradingDayRule(17, 0), update_if_due)
+        scheduler.run_forever()
             
     except Exception as e:
         logger.error(f"程序执行出错: {str(e)}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="每日数据更新")
+    parser.add_argument("--worker-only", action="store_true",
+                        help="只作为工作进程加入今天的股票和指数日线下载计划，完成后退出")
+    parser.add_argument("--workers", type=int, default=max(1, config.QUEUE_WORKERS), help="--worker-only 时本机的工作进程数")
+    parser.add_argument("--shards", type=int, help="股票和指数日线按代码哈希分为N个进程并行下载，覆盖 INGEST_SHARDS")
+    parser.add_argument("--multi-asset", action="store_true",
+                        help="股票、指数、ETF和热度排名同时下载并共享各数据源的请求限额，覆盖 MULTI_ASSET_INGEST")
+    args = parser.parse_args()
+    if args.multi_asset:
+        config.MULTI_ASSET_INGEST = True
+    if args.shards:
+        config.INGEST_SHARDS = args.shards
+    if args.worker_only:
+        for kind in ("stock", "index"):
+            run_queue_ingestion("update", [kind], workers=args.workers)
+    else:
+        main()
@@ -11,9 +11,10 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 # 导入所需模块
 from StockDownloader.src.utils.correlation_calculator import update_stock_index_correlation
-from StockDownloader.src.database.session import SessionLocal, engine
-from StockDownloader.src.database.base import Base
+from StockDownloader.src.tasks.rebuild_task import start_rebuild, resume_rebuild, latest_resumable_run, rebuild_summary
 from StockDownloader.src.tasks.update_data_task import update_stock_data, update_index_data
+from StockDownloader.src.utils.db_utils import initialize_database_if_needed
+from StockDownloader.src.utils.job_registry import start_job, latest_jobs, recent_jobs, admission_conflicts, JobTracker, EXCLUSIVE
 
 # 设置日志
 log_dir = os.path.join(os.path.dirname(__file__), 'logs')
@@ -39,15 +40,20 @@ logger.addHandler(console_handler)
 # 创建Flask应用
 app = Flask(__name__)
 
-# 存储任务状态
-task_status = {
-    'update_data': {'status': 'idle', 'message': ''},
-    'rebuild_database': {'status': 'idle', 'message': ''},
-    'update_correlation': {'status': 'idle', 'message': ''}
+# 网页端可以启动的任务及其占用的资源类别，资源不冲突的任务可以同时运行（各类别的限额见 JOB_RESOURCE_BUDGETS），
+# 重建数据库与所有任务冲突
+# 任务状态保存在数据库的 job_run 表中，可以用多进程WSGI服务器（如 gunicorn -w 4 server:app）运行
+SERVER_JOB_RESOURCES = {
+    'update_data': {'network': 1, 'db_write': 1},
+    'rebuild_database': {EXCLUSIVE: 1},
+    'update_correlation': {'cpu': 1, 'db_read': 1},
 }
+SERVER_JOB_TYPES = list(SERVER_JOB_RESOURCES)
+# 状态页面同时显示的其他任务（定时每日更新）
+STATUS_JOB_TYPES = SERVER_JOB_TYPES + ['daily_update']
 
-# 后台任务锁，防止同时运行多个任务
-task_lock = threading.Lock()
+# 确保任务登记表等数据库表已创建
+initialize_database_if_needed()
 
 # HTML模板
 @app.route('/')
@@ -127,6 +133,7 @@ def index():
         <div class="button-container">
             <button id="updateDataBtn" onclick="runTask('update_data')">更新数据</button>
             <button id="rebuildDatabaseBtn" onclick="runTask('rebuild_database')">重建数据库</button>
+            <button id="resumeRebuildBtn" onclick="runTask('resume_rebuild')" disabled>继续重建数据库</button>
             <button id="updateCorrelationBtn" onclick="runTask('update_correlation')">更新指数相关度</button>
         </div>
         
@@ -134,6 +141,7 @@ def index():
             <div id="update_data_status" class="task-status idle">更新数据: 空闲</div>
             <div id="rebuild_database_status" class="task-status idle">重建数据库: 空闲</div>
             <div id="update_correlation_status" class="task-status idle">更新指数相关度: 空闲</div>
+            <div id="daily_update_status" class="task-status idle">定时每日更新: 空闲</div>
         </div>
         
         <script>
@@ -143,7 +151,9 @@ def index():
                     .then(response => response.json())
                     .then(data => {
                         updateStatusUI(data);
-                        setTimeout(checkStatus, 2000); // 每2秒检查一次
+                        // 有任务运行时每2秒检查一次，否则每10秒检查一次
+                        const anyRunning = Object.values(data).some(job => job.status === 'running');
+                        setTimeout(checkStatus, anyRunning ? 2000 : 10000);
                     })
                     .catch(error => {
                         console.error('获取状态失败:', error);
@@ -160,21 +170,29 @@ def index():
                     'update_correlation': document.getElementById('updateCorrelationBtn')
                 };
                 
-                // 如果有任何任务正在运行，禁用所有按钮
-                const anyRunning = tasks.some(task => data[task].status === 'running');
-                
-                tasks.forEach(task => {
+                // 与运行中的任务冲突的任务不能启动
+                tasks.concat(['daily_update']).forEach(task => {
                     const statusElement = document.getElementById(`${task}_status`);
                     const status = data[task].status;
                     const message = data[task].message || '';
+                    const progress = data[task].progress_total ? ` (${data[task].progress_done}/${data[task].progress_total})` : '';
                     
                     // 更新状态显示
                     statusElement.className = `task-status ${status}`;
-                    statusElement.textContent = `${getTaskName(task)}: ${getStatusText(status)} ${message}`;
+                    statusElement.textContent = `${getTaskName(task)}: ${getStatusText(status)}${progress} ${message}`;
                     
                     // 更新按钮状态
-                    buttons[task].disabled = anyRunning;
+                    if (buttons[task]) {
+                        buttons[task].disabled = !data[task].can_start;
+                        buttons[task].title = data[task].blocked_by || '';
+                    }
                 });
+                
+                // 有未完成的重建时可以从检查点继续
+                const resumeButton = document.getElementById('resumeRebuildBtn');
+                const resumable = data['rebuild_database'].resumable;
+                resumeButton.disabled = !(resumable && data['rebuild_database'].can_start);
+                resumeButton.title = resumable ? `重建 ${resumable.id}: ${JSON.stringify(resumable.counts)}` : '没有未完成的重建';
             }
             
             // 获取任务名称
@@ -182,7 +200,8 @@ def index():
                 const names = {
                     'update_data': '更新数据',
                     'rebuild_database': '重建数据库',
-                    'update_correlation': '更新指数相关度'
+                    'update_correlation': '更新指数相关度',
+                    'daily_update': '定时每日更新'
                 };
                 return names[task] || task;
             }
@@ -223,172 +242,121 @@ def index():
 # 获取任务状态
 @app.route('/status')
 def get_status():
-    return jsonify(task_status)
+    jobs = latest_jobs(STATUS_JOB_TYPES)
+    conflicts = admission_conflicts(SERVER_JOB_RESOURCES)
+    status = {job_type: jobs.get(job_type, {'status': 'idle', 'message': ''}) for job_type in STATUS_JOB_TYPES}
+    for job_type, conflict in conflicts.items():
+        status[job_type]['can_start'] = conflict is None
+        status[job_type]['blocked_by'] = conflict
+    # 未完成的重建（进程崩溃、重启或有失败的代码）可以从检查点继续
+    run_id = latest_resumable_run()
+    status['rebuild_database']['resumable'] = rebuild_summary(run_id) if run_id else None
+    return jsonify(status)
+
+# 最近的任务记录
+@app.route('/jobs')
+def get_jobs():
+    return jsonify(recent_jobs(request.args.get('limit', 20, type=int)))
+
+def start_background_task(job_type, target, message, params=None):
+    """在任务登记表中登记任务（与运行中的任务资源冲突时不启动），然后在后台线程中执行"""
+    try:
+        job_id = start_job(job_type, params, source='server', resources=SERVER_JOB_RESOURCES[job_type], message=message)
+        if job_id is None:
+            conflict = admission_conflicts({job_type: SERVER_JOB_RESOURCES[job_type]})[job_type]
+            return jsonify({'success': False, 'message': f'与运行中的任务冲突: {conflict}' if conflict else '与运行中的任务冲突'})
+        
+        # 启动后台线程执行任务
+        thread = threading.Thread(target=target, args=(job_id,))
+        thread.daemon = True
+        thread.start()
+        return jsonify({'success': True, 'message': f'任务已启动 (ID {job_id})', 'job_id': job_id})
+    except Exception as e:
+        logger.error(f"启动任务 {job_type} 失败: {str(e)}")
+        return jsonify({'success': False, 'message': f'启动任务失败: {str(e)}'})
 
 # 运行更新数据任务
 @app.route('/run/update_data', methods=['POST'])
 def run_update_data():
-    if task_lock.acquire(blocking=False):
-        try:
-            # 检查是否有任务正在运行
-            if any(task['status'] == 'running' for task in task_status.values()):
-                task_lock.release()
-                return jsonify({'success': False, 'message': '有其他任务正在运行'})
-            
-            # 更新状态
-            task_status['update_data']['status'] = 'running'
-            task_status['update_data']['message'] = '正在更新数据...'
-            
-            # 启动后台线程执行任务
-            thread = threading.Thread(target=run_update_data_task)
-            thread.daemon = True
-            thread.start()
-            
-            return jsonify({'success': True, 'message': '更新数据任务已启动'})
-        except Exception as e:
-            task_status['update_data']['status'] = 'error'
-            task_status['update_data']['message'] = f'启动任务失败: {str(e)}'
-            task_lock.release()
-            return jsonify({'success': False, 'message': str(e)})
-    else:
-        return jsonify({'success': False, 'message': '有其他任务正在运行'})
+    return start_background_task('update_data', run_update_data_task, '正在更新数据...')
 
 # 运行重建数据库任务
 @app.route('/run/rebuild_database', methods=['POST'])
 def run_rebuild_database():
-    if task_lock.acquire(blocking=False):
-        try:
-            # 检查是否有任务正在运行
-            if any(task['status'] == 'running' for task in task_status.values()):
-                task_lock.release()
-                return jsonify({'success': False, 'message': '有其他任务正在运行'})
-            
-            # 更新状态
-            task_status['rebuild_database']['status'] = 'running'
-            task_status['rebuild_database']['message'] = '正在重建数据库...'
-            
-            # 启动后台线程执行任务
-            thread = threading.Thread(target=run_rebuild_database_task)
-            thread.daemon = True
-            thread.start()
-            
-            return jsonify({'success': True, 'message': '重建数据库任务已启动'})
-        except Exception as e:
-            task_status['rebuild_database']['status'] = 'error'
-            task_status['rebuild_database']['message'] = f'启动任务失败: {str(e)}'
-            task_lock.release()
-            return jsonify({'success': False, 'message': str(e)})
-    else:
-        return jsonify({'success': False, 'message': '有其他任务正在运行'})
+    return start_background_task('rebuild_database', run_rebuild_database_task, '正在重建数据库...')
+
+# 从检查点继续未完成的重建
+@app.route('/run/resume_rebuild', methods=['POST'])
+def run_resume_rebuild():
+    run_id = latest_resumable_run()
+    if run_id is None:
+        return jsonify({'success': False, 'message': '没有可以继续的重建'})
+    return start_background_task('rebuild_database', run_resume_rebuild_task, f'正在继续重建 {run_id}...', {'resume': run_id})
 
 # 运行更新指数相关度任务
 @app.route('/run/update_correlation', methods=['POST'])
 def run_update_correlation():
-    if task_lock.acquire(blocking=False):
-        try:
-            # 检查是否有任务正在运行
-            if any(task['status'] == 'running' for task in task_status.values()):
-                task_lock.release()
-                return jsonify({'success': False, 'message': '有其他任务正在运行'})
-            
-            # 更新状态
-            task_status['update_correlation']['status'] = 'running'
-            task_status['update_correlation']['message'] = '正在更新指数相关度...'
-            
-            # 启动后台线程执行任务
-            thread = threading.Thread(target=run_update_correlation_task)
-            thread.daemon = True
-            thread.start()
-            
-            return jsonify({'success': True, 'message': '更新指数相关度任务已启动'})
-        except Exception as e:
-            task_status['update_correlation']['status'] = 'error'
-            task_status['update_correlation']['message'] = f'启动任务失败: {str(e)}'
-            task_lock.release()
-            return jsonify({'success': False, 'message': str(e)})
-    else:
-        return jsonify({'success': False, 'message': '有其他任务正在运行'})
+    return start_background_task('update_correlation', run_update_correlation_task, '正在更新指数相关度...')
 
 # 更新数据任务实现
-def run_update_data_task():
+def run_update_data_task(job_id):
     try:
-        logger.info("开始执行更新数据任务")
-        task_status['update_data']['message'] = '正在更新股票数据...'
-        
-        # 更新股票数据
-        update_stock_data()
-        
-        task_status['update_data']['message'] = '正在更新指数数据...'
-        # 更新指数数据
-        update_index_data()
-        
-        task_status['update_data']['status'] = 'success'
-        task_status['update_data']['message'] = f'更新完成 ({datetime.now().strftime("%H:%M:%S")})'  
-        logger.info("更新数据任务完成")
+        with JobTracker(job_id, success_message='更新完成') as job:
+            logger.info("开始执行更新数据任务")
+            job.progress(0, 2, '正在更新股票数据...')
+            
+            # 更新股票数据
+            update_stock_data()
+            
+            job.progress(1, 2, '正在更新指数数据...')
+            # 更新指数数据
+            update_index_data()
+            
+            job.progress(2, 2)
+            logger.info("更新数据任务完成")
     except Exception as e:
         logger.error(f"更新数据任务失败: {str(e)}")
-        task_status['update_data']['status'] = 'error'
-        task_status['update_data']['message'] = f'错误: {str(e)}'
-    finally:
-        task_lock.release()
 
 # 重建数据库任务实现
-def run_rebuild_database_task():
+# 重建过程记录在 rebuild_run / rebuild_checkpoint 中，中断后可以用"继续重建数据库"从检查点继续
+def run_rebuild_database_task(job_id):
     try:
-        logger.info("开始执行重建数据库任务")
-        task_status['rebuild_database']['message'] = '正在删除现有数据库表...'
-        
-        # 删除所有表并重新创建
-        Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
-        
-        task_status['rebuild_database']['message'] = '正在下载股票数据...'
-        # 导入下载任务模块
-        from StockDownloader.src.tasks.download_stock_task import download_all_stock_data
-        download_all_stock_data(update_only=False)
-        
-        task_status['rebuild_database']['message'] = '正在下载指数数据...'
-        # 导入下载任务模块
-        from StockDownloader.src.tasks.download_index_task import download_all_index_data
-        download_all_index_data(update_only=False)
-        
-        task_status['rebuild_database']['status'] = 'success'
-        task_status['rebuild_database']['message'] = f'重建完成 ({datetime.now().strftime("%H:%M:%S")})'  
-        logger.info("重建数据库任务完成")
+        with JobTracker(job_id, success_message='重建完成') as job:
+            logger.info("开始执行重建数据库任务")
+            start_rebuild(progress=job.progress)
+            logger.info("重建数据库任务完成")
     except Exception as e:
         logger.error(f"重建数据库任务失败: {str(e)}")
-        task_status['rebuild_database']['status'] = 'error'
-        task_status['rebuild_database']['message'] = f'错误: {str(e)}'
-    finally:
-        task_lock.release()
+
+# 继续重建数据库任务实现
+def run_resume_rebuild_task(job_id):
+    try:
+        with JobTracker(job_id, success_message='重建完成') as job:
+            logger.info("开始继续重建数据库任务")
+            resume_rebuild(progress=job.progress)
+            logger.info("继续重建数据库任务完成")
+    except Exception as e:
+        logger.error(f"继续重建数据库任务失败: {str(e)}")
 
 # 更新指数相关度任务实现
-def run_update_correlation_task():
+def run_update_correlation_task(job_id):
     try:
-        logger.info("开始执行更新指数相关度任务")
-        task_status['update_correlation']['message'] = '正在计算股票与指数相关度...'
-        
-        # 获取CPU逻辑处理器数量
-        import os
-        cpu_count = os.cpu_count()
-        # 保留一些核心给系统使用，至少保留4个核心
-        max_workers = max(1, cpu_count - 4) if cpu_count else 1
-        
-        logger.info(f"使用 {max_workers} 个进程进行并行处理")
-        task_status['update_correlation']['message'] = f'正在计算股票与指数相关度... (使用 {max_workers} 个进程)'
-        
-        # 调用相关度计算函数，传入进程数
-        update_stock_index_correlation(max_workers=max_workers)
-        
-        task_status['update_correlation']['status'] = 'success'
-        task_status['update_correlation']['message'] = f'更新完成 ({datetime.now().strftime("%H:%M:%S")})'
-        logger.info("更新指数相关度任务完成")
+        with JobTracker(job_id, success_message='更新完成') as job:
+            logger.info("开始执行更新指数相关度任务")
+            
+            # 获取CPU逻辑处理器数量
+            cpu_count = os.cpu_count()
+            # 保留一些核心给系统使用，至少保留4个核心
+            max_workers = max(1, cpu_count - 4) if cpu_count else 1
+            
+            logger.info(f"使用 {max_workers} 个进程进行并行处理")
+            job.progress(message=f'正在计算股票与指数相关度... (使用 {max_workers} 个进程)')
+            
+            # 调用相关度计算函数，传入进程数
+            update_stock_index_correlation(max_workers=max_workers)
+            logger.info("更新指数相关度任务完成")
     except Exception as e:
         logger.error(f"更新指数相关度任务失败: {str(e)}")
-        task_status['update_correlation']['status'] = 'error'
-        task_status['update_correlation']['message'] = f'错误: {str(e)}'
-    finally:
-        task_lock.release()
 
 if __name__ == "__main__":
     # 启动Flask应用
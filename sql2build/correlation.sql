@@ -0,0 +1,81 @@
+-- stock_index_correlation
+CREATE TABLE public.stock_index_correlation (
+    symbol character varying(10) NOT NULL,
+    year integer NOT NULL,
+    index_symbol character varying(10) NOT NULL,
+    score_sum bigint NOT NULL DEFAULT 0,
+    valid_days integer NOT NULL DEFAULT 0,
+    score double precision,
+    rank integer,
+    last_date date,
+    pearson double precision,
+    spearman double precision,
+    beta double precision,
+    metric_days integer
+);
+
+
+ALTER TABLE public.stock_index_correlation OWNER TO si;
+
+--
+-- Name: stock_index_correlation stock_index_correlation_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.stock_index_correlation
+    ADD CONSTRAINT stock_index_correlation_pkey PRIMARY KEY (symbol, year, index_symbol);
+
+--
+-- Name: ix_stock_index_correlation_rank; Type: INDEX; Schema: public; Owner: si
+--
+
+CREATE INDEX ix_stock_index_correlation_rank ON public.stock_index_correlation USING btree (symbol, year, rank);
+
+-- stock_index_rolling_correlation
+CREATE TABLE public.stock_index_rolling_correlation (
+    symbol character varying(10) NOT NULL,
+    date date NOT NULL,
+    window_size integer NOT NULL,
+    index_symbol character varying(10) NOT NULL,
+    score double precision,
+    valid_days integer
+);
+
+
+ALTER TABLE public.stock_index_rolling_correlation OWNER TO si;
+
+--
+-- Name: stock_index_rolling_correlation stock_index_rolling_correlation_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.stock_index_rolling_correlation
+    ADD CONSTRAINT stock_index_rolling_correlation_pkey PRIMARY KEY (symbol, date, window_size);
+
+-- universe_correlation
+CREATE TABLE public.universe_correlation (
+    source_universe character varying(20) NOT NULL,
+    target_universe character varying(20) NOT NULL,
+    symbol character varying(20) NOT NULL,
+    year integer NOT NULL,
+    target_symbol character varying(20) NOT NULL,
+    score_sum bigint NOT NULL DEFAULT 0,
+    valid_days integer NOT NULL DEFAULT 0,
+    score double precision,
+    rank integer,
+    last_date date
+);
+
+
+ALTER TABLE public.universe_correlation OWNER TO si;
+
+--
+-- Name: universe_correlation universe_correlation_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.universe_correlation
+    ADD CONSTRAINT universe_correlation_pkey PRIMARY KEY (source_universe, target_universe, symbol, year, target_symbol);
+
+--
+-- Name: ix_universe_correlation_rank; Type: INDEX; Schema: public; Owner: si
+--
+
+CREATE INDEX ix_universe_correlation_rank ON public.universe_correlation USING btree (source_universe, target_universe, symbol, year, rank);
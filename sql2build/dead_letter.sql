@@ -0,0 +1,21 @@
+-- ingestion_dead_letter
+CREATE TABLE public.ingestion_dead_letter (
+    asset_class character varying NOT NULL,
+    symbol character varying NOT NULL,
+    params json,
+    attempts integer NOT NULL,
+    failed_runs integer NOT NULL,
+    last_error text,
+    first_failed_at timestamp without time zone DEFAULT now() NOT NULL,
+    last_failed_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.ingestion_dead_letter OWNER TO si;
+
+--
+-- Name: ingestion_dead_letter ingestion_dead_letter_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.ingestion_dead_letter
+    ADD CONSTRAINT ingestion_dead_letter_pkey PRIMARY KEY (asset_class, symbol);
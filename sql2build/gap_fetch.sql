@@ -0,0 +1,19 @@
+-- gap_fetch_log
+CREATE TABLE public.gap_fetch_log (
+    source character varying NOT NULL,
+    symbol character varying NOT NULL,
+    start_date date NOT NULL,
+    end_date date NOT NULL,
+    row_count integer NOT NULL,
+    fetched_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.gap_fetch_log OWNER TO si;
+
+--
+-- Name: gap_fetch_log gap_fetch_log_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.gap_fetch_log
+    ADD CONSTRAINT gap_fetch_log_pkey PRIMARY KEY (source, symbol, start_date);
@@ -0,0 +1,46 @@
+-- stock_indicator
+CREATE TABLE public.stock_indicator (
+    symbol character varying NOT NULL,
+    date date NOT NULL,
+    ma5 double precision,
+    ma10 double precision,
+    ma20 double precision,
+    ma60 double precision,
+    return_1d double precision,
+    volatility_20 double precision,
+    atr_14 double precision,
+    ema12 double precision,
+    ema26 double precision
+);
+
+
+ALTER TABLE public.stock_indicator OWNER TO si;
+
+--
+-- Name: stock_indicator stock_indicator_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.stock_indicator
+    ADD CONSTRAINT stock_indicator_pkey PRIMARY KEY (symbol, date);
+
+-- stock_indicator_state
+CREATE TABLE public.stock_indicator_state (
+    symbol character varying NOT NULL,
+    last_date date NOT NULL,
+    bar_count integer NOT NULL,
+    closes json NOT NULL,
+    returns json NOT NULL,
+    ema12 double precision,
+    ema26 double precision,
+    atr_14 double precision
+);
+
+
+ALTER TABLE public.stock_indicator_state OWNER TO si;
+
+--
+-- Name: stock_indicator_state stock_indicator_state_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.stock_indicator_state
+    ADD CONSTRAINT stock_indicator_state_pkey PRIMARY KEY (symbol);
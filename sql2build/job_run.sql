@@ -0,0 +1,39 @@
+-- job_run
+CREATE TABLE public.job_run (
+    id bigserial NOT NULL,
+    job_type character varying NOT NULL,
+    source character varying NOT NULL,
+    params json,
+    resources json,
+    status character varying(10) NOT NULL,
+    message text,
+    progress_done integer NOT NULL,
+    progress_total integer NOT NULL,
+    owner character varying,
+    created_at timestamp without time zone DEFAULT now() NOT NULL,
+    heartbeat_at timestamp without time zone DEFAULT now() NOT NULL,
+    finished_at timestamp without time zone,
+    last_error text
+);
+
+
+ALTER TABLE public.job_run OWNER TO si;
+
+--
+-- Name: job_run job_run_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.job_run
+    ADD CONSTRAINT job_run_pkey PRIMARY KEY (id);
+
+--
+-- Name: ix_job_run_type_created; Type: INDEX; Schema: public; Owner: si
+--
+
+CREATE INDEX ix_job_run_type_created ON public.job_run USING btree (job_type, created_at);
+
+--
+-- Name: ix_job_run_status; Type: INDEX; Schema: public; Owner: si
+--
+
+CREATE INDEX ix_job_run_status ON public.job_run USING btree (status);
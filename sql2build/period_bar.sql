@@ -0,0 +1,47 @@
+-- stock_period_bar
+CREATE TABLE public.stock_period_bar (
+    symbol character varying NOT NULL,
+    frequency character varying(1) NOT NULL,
+    period_start date NOT NULL,
+    date date NOT NULL,
+    open double precision,
+    close double precision,
+    high double precision,
+    low double precision,
+    volume bigint,
+    amount bigint
+);
+
+
+ALTER TABLE public.stock_period_bar OWNER TO si;
+
+--
+-- Name: stock_period_bar stock_period_bar_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.stock_period_bar
+    ADD CONSTRAINT stock_period_bar_pkey PRIMARY KEY (symbol, frequency, period_start);
+
+-- index_period_bar
+CREATE TABLE public.index_period_bar (
+    symbol character varying NOT NULL,
+    frequency character varying(1) NOT NULL,
+    period_start date NOT NULL,
+    date date NOT NULL,
+    open double precision,
+    close double precision,
+    high double precision,
+    low double precision,
+    volume bigint,
+    amount bigint
+);
+
+
+ALTER TABLE public.index_period_bar OWNER TO si;
+
+--
+-- Name: index_period_bar index_period_bar_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.index_period_bar
+    ADD CONSTRAINT index_period_bar_pkey PRIMARY KEY (symbol, frequency, period_start);
@@ -0,0 +1,52 @@
+-- rebuild_run
+CREATE TABLE public.rebuild_run (
+    id bigserial NOT NULL,
+    kinds json NOT NULL,
+    status character varying(10) NOT NULL,
+    cleared_at timestamp without time zone,
+    planned_at timestamp without time zone,
+    last_error text,
+    created_at timestamp without time zone DEFAULT now() NOT NULL,
+    updated_at timestamp without time zone DEFAULT now() NOT NULL,
+    finished_at timestamp without time zone
+);
+
+
+ALTER TABLE public.rebuild_run OWNER TO si;
+
+--
+-- Name: rebuild_run rebuild_run_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.rebuild_run
+    ADD CONSTRAINT rebuild_run_pkey PRIMARY KEY (id);
+
+
+-- rebuild_checkpoint
+CREATE TABLE public.rebuild_checkpoint (
+    run_id bigint NOT NULL,
+    kind character varying NOT NULL,
+    symbol character varying NOT NULL,
+    name character varying(100),
+    start_date date NOT NULL,
+    end_date date NOT NULL,
+    status character varying(10) NOT NULL,
+    last_error text,
+    completed_at timestamp without time zone
+);
+
+
+ALTER TABLE public.rebuild_checkpoint OWNER TO si;
+
+--
+-- Name: rebuild_checkpoint rebuild_checkpoint_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.rebuild_checkpoint
+    ADD CONSTRAINT rebuild_checkpoint_pkey PRIMARY KEY (run_id, kind, symbol);
+
+--
+-- Name: ix_rebuild_checkpoint_run_status; Type: INDEX; Schema: public; Owner: si
+--
+
+CREATE INDEX ix_rebuild_checkpoint_run_status ON public.rebuild_checkpoint USING btree (run_id, status);
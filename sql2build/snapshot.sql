@@ -0,0 +1,23 @@
+-- stock_daily_snapshot
+CREATE TABLE public.stock_daily_snapshot (
+    date date NOT NULL,
+    symbols character varying[] NOT NULL,
+    open double precision[],
+    close double precision[],
+    high double precision[],
+    low double precision[],
+    volume bigint[],
+    amount bigint[],
+    turnover double precision[],
+    real_change double precision[]
+);
+
+
+ALTER TABLE public.stock_daily_snapshot OWNER TO si;
+
+--
+-- Name: stock_daily_snapshot stock_daily_snapshot_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.stock_daily_snapshot
+    ADD CONSTRAINT stock_daily_snapshot_pkey PRIMARY KEY (date);
@@ -0,0 +1,43 @@
+-- ingestion_job
+CREATE TABLE public.ingestion_job (
+    id bigserial NOT NULL,
+    plan character varying NOT NULL,
+    kind character varying NOT NULL,
+    symbol character varying NOT NULL,
+    name character varying(100),
+    start_date date NOT NULL,
+    end_date date NOT NULL,
+    status character varying(10) NOT NULL,
+    attempts integer NOT NULL,
+    max_attempts integer NOT NULL,
+    available_at timestamp without time zone DEFAULT now() NOT NULL,
+    lease_owner character varying,
+    lease_expires_at timestamp without time zone,
+    heartbeat_at timestamp without time zone,
+    last_error text,
+    created_at timestamp without time zone DEFAULT now() NOT NULL,
+    updated_at timestamp without time zone DEFAULT now() NOT NULL
+);
+
+
+ALTER TABLE public.ingestion_job OWNER TO si;
+
+--
+-- Name: ingestion_job ingestion_job_pkey; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.ingestion_job
+    ADD CONSTRAINT ingestion_job_pkey PRIMARY KEY (id);
+
+--
+-- Name: ingestion_job ingestion_job_plan_kind_symbol_key; Type: CONSTRAINT; Schema: public; Owner: si
+--
+
+ALTER TABLE ONLY public.ingestion_job
+    ADD CONSTRAINT ingestion_job_plan_kind_symbol_key UNIQUE (plan, kind, symbol);
+
+--
+-- Name: ix_ingestion_job_plan_status; Type: INDEX; Schema: public; Owner: si
+--
+
+CREATE INDEX ix_ingestion_job_plan_status ON public.ingestion_job USING btree (plan, status, available_at);